@@ -0,0 +1,280 @@
+"""
+Backfill of the summaries and the daily counts of archived data drops.
+
+The archive directory has a sub-directory per data drop, named so that the
+drops sort in the order that these were published, e.g. 2020-07-10. Each
+drop is prepared by a worker of the pool with the same engine functions as
+the charts and two things are kept in the store directory:
+
+* counts/<drop>.pkl.gz: the daily confirmed, active, recovered and death
+  counts of each region in the drop, see drilldown.daily_counts
+* summary.csv: the statistics of the summary table of each drop
+
+Comparing the counts of the same day across the drops shows how it was
+revised. A checkpoint of the finished drops is saved after each drop so an
+interrupted backfill resumes where it stopped, and a drop is only prepared
+again if its files changed.
+"""
+
+import os
+import io
+import json
+import queue
+import hashlib
+import logging
+import pathlib
+import contextlib
+import multiprocessing as mp
+from datetime import timedelta
+from timeit import default_timer as timer
+
+import pandas as pd
+
+from covid19trackerph import drilldown
+from covid19trackerph import engines
+from covid19trackerph import execution
+from covid19trackerph import outputsink
+from covid19trackerph import queryservice
+from covid19trackerph import tracing
+from covid19trackerph import trackerchart as tc
+
+
+DEFAULT_ENGINE = 'vectorized'
+COUNTS_DIR = "counts"
+CHECKPOINT = "checkpoint.json"
+SUMMARY = "summary.csv"
+# Seconds between the checks for dead workers while waiting for the drops.
+WORKER_CHECK_SECONDS = 5
+# Keys of the daily counts in the store.
+COUNT_KEYS = [tc.REGION]
+
+
+def find_drops(archive_dir):
+    """Return the directories of the archived drops that have Case
+    Information, in order."""
+    file_pattern, _ = tc.DATA_SOURCES['ci_data']
+    return sorted(str(path) for path in pathlib.Path(archive_dir).iterdir()
+                  if path.is_dir() and any(path.glob(file_pattern)))
+
+
+def drop_name(drop_dir):
+    """Return the name of the drop in the store."""
+    return os.path.basename(os.path.normpath(drop_dir))
+
+
+def drop_files(drop_dir):
+    """Return the data files of the drop."""
+    return sorted(path for file_pattern, _ in tc.DATA_SOURCES.values()
+                  for path in pathlib.Path(drop_dir).glob(file_pattern))
+
+
+def drop_fingerprint(drop_dir):
+    """Return the hash of the names, sizes and modification times of the
+    data files of the drop."""
+    digest = hashlib.sha1()
+    for path in drop_files(drop_dir):
+        stat = path.stat()
+        digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns};"
+                      .encode('utf-8'))
+    return digest.hexdigest()
+
+
+def counts_path(store_dir, drop):
+    """Return the path of the daily counts of the drop in the store."""
+    return os.path.join(store_dir, COUNTS_DIR, f"{drop}.pkl.gz")
+
+
+def process_drop(drop_dir, store_dir, engine=DEFAULT_ENGINE):
+    """Prepare a drop, write its daily counts to the store and return its
+    name, its summary statistics and the seconds that it took.
+
+    This runs in a worker so the data is prepared in the worker itself. The
+    test facility lookup is read once by each worker and reused for all of
+    its drops.
+    """
+    start = timer()
+    drop = drop_name(drop_dir)
+    engine = engines.get_engine(engine)
+    with tracing.span('backfill_drop', drop=drop), \
+            execution.WorkerPool('serial') as pool:
+        ci_data = engine.calc_case_info_data(
+            engines.read_files(drop_dir, 'ci_data'), pool)
+        test_data = engine.calc_testing_aggregates_data(
+            engines.read_files(drop_dir, 'test_data'), pool)
+        summary = queryservice.jsonable(
+            engine.summary_metrics(ci_data, test_data))
+        counts = drilldown.daily_counts(ci_data, COUNT_KEYS).astype('int32')
+        buffer = io.BytesIO()
+        counts.to_pickle(buffer, compression='gzip')
+        outputsink.atomic_write(counts_path(store_dir, drop),
+                                buffer.getvalue())
+    return drop, summary, timer() - start
+
+
+def run_drop(started, drop_dir, store_dir, engine=DEFAULT_ENGINE):
+    """Record the process that prepares the drop in the started mapping
+    then process the drop."""
+    started[drop_dir] = os.getpid()
+    return process_drop(drop_dir, store_dir, engine)
+
+
+def shared_dict(pool):
+    """Return a context manager of a dict that the workers of the pool can
+    update."""
+    if pool.in_process:
+        return contextlib.nullcontext({})
+    return _managed_dict(mp.get_context(pool.start_method))
+
+
+@contextlib.contextmanager
+def _managed_dict(context):
+    with context.Manager() as manager:
+        yield manager.dict()
+
+
+def lost_drops(pool, outstanding, started):
+    """Return the outstanding drops that were being prepared by a worker
+    that died."""
+    lost = pool.lost_workers()
+    return [drop_dir for drop_dir in outstanding
+            if started.get(drop_dir) in lost]
+
+
+def load_checkpoint(path):
+    """Load the finished drops of the checkpoint."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as file_handle:
+            return json.load(file_handle)
+    except ValueError:
+        logging.warning("Ignoring invalid backfill checkpoint %s", path)
+        return {}
+
+
+def save_checkpoint(path, checkpoint):
+    """Save the finished drops."""
+    outputsink.atomic_write(path, json.dumps(checkpoint, indent=1,
+                                             sort_keys=True))
+
+
+def save_summary(store_dir, checkpoint):
+    """Write the summary statistics of the finished drops as CSV."""
+    summary = pd.DataFrame.from_dict(
+        {drop: entry['summary'] for drop, entry in checkpoint.items()},
+        orient='index').sort_index()
+    summary.index.name = 'drop'
+    outputsink.atomic_write(os.path.join(store_dir, SUMMARY),
+                            summary.to_csv())
+
+
+def pending_drops(drops, store_dir, checkpoint):
+    """Return the (directory, fingerprint) of the drops that are not in the
+    checkpoint or whose files changed since."""
+    pending = []
+    for drop_dir in drops:
+        drop = drop_name(drop_dir)
+        digest = drop_fingerprint(drop_dir)
+        entry = checkpoint.get(drop)
+        if (entry is None or entry['fingerprint'] != digest or
+                not os.path.exists(counts_path(store_dir, drop))):
+            pending.append((drop_dir, digest))
+    return pending
+
+
+def log_throughput(count, elapsed):
+    """Log the number of drops backfilled per minute."""
+    logging.info("Backfilled %d drops in %s, %.2f drops/min", count,
+                 timedelta(seconds=elapsed),
+                 count * 60 / elapsed if elapsed else 0)
+
+
+def backfill(archive_dir, store_dir, pool, engine=DEFAULT_ENGINE,
+             rebuild=False):
+    """Backfill the drops of the archive directory to the store directory
+    in the pool and return the statistics of the run.
+
+    The drops in the checkpoint of the store are skipped unless rebuild is
+    True or their files changed. A drop that fails, or whose worker dies, is
+    logged and left out so that it is retried by the next run.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    start = timer()
+    os.makedirs(os.path.join(store_dir, COUNTS_DIR), exist_ok=True)
+    checkpoint_path = os.path.join(store_dir, CHECKPOINT)
+    checkpoint = {} if rebuild else load_checkpoint(checkpoint_path)
+    drops = find_drops(archive_dir)
+    pending = pending_drops(drops, store_dir, checkpoint)
+    logging.info("Backfilling %d of %d drops with the %s engine on %d %s "
+                 "workers", len(pending), len(drops), engine, pool.workers,
+                 pool.executor)
+    done = queue.Queue()
+    failed = []
+    finished = 0
+    # A few drops are queued ahead of each worker so that the workers are
+    # never idle while the checkpoint is saved.
+    waiting = list(reversed(pending))
+    outstanding = {}
+    with shared_dict(pool) as started:
+        while waiting or outstanding:
+            while waiting and len(outstanding) < 2 * pool.workers:
+                drop_dir, digest = waiting.pop()
+                pool.apply_async(
+                    run_drop, (started, drop_dir, store_dir, engine),
+                    callback=lambda result, drop_dir=drop_dir: done.put(
+                        (drop_dir, result, None)),
+                    error_callback=lambda error, drop_dir=drop_dir: done.put(
+                        (drop_dir, None, error)))
+                outstanding[drop_dir] = digest
+            try:
+                drop_dir, result, error = done.get(
+                    timeout=WORKER_CHECK_SECONDS)
+            except queue.Empty:
+                # The result of a drop whose worker died never comes.
+                for drop_dir in lost_drops(pool, outstanding, started):
+                    logging.error("Failed to backfill %s: its worker died",
+                                  drop_name(drop_dir))
+                    failed.append(drop_name(drop_dir))
+                    del outstanding[drop_dir]
+                continue
+            digest = outstanding.pop(drop_dir)
+            if error is not None:
+                logging.error("Failed to backfill %s: %s", drop_name(drop_dir),
+                              error)
+                failed.append(drop_name(drop_dir))
+                continue
+            drop, summary, seconds = result
+            checkpoint[drop] = {'fingerprint': digest,
+                                'seconds': round(seconds, 3),
+                                'summary': summary}
+            save_checkpoint(checkpoint_path, checkpoint)
+            finished += 1
+            logging.info("Backfilled %s in %.1fs (%d of %d)", drop, seconds,
+                         finished, len(pending))
+    if checkpoint:
+        save_summary(store_dir, checkpoint)
+    elapsed = timer() - start
+    log_throughput(finished, elapsed)
+    return {'drops': len(drops), 'backfilled': finished,
+            'skipped': len(drops) - len(pending), 'failed': sorted(failed),
+            'seconds': elapsed,
+            'drops_per_minute': finished * 60 / elapsed if elapsed else 0}
+
+
+def load_counts(store_dir):
+    """Return the daily counts of all of the drops in the store, indexed by
+    the drop, the region and the date."""
+    paths = sorted(pathlib.Path(store_dir, COUNTS_DIR).glob("*.pkl.gz"))
+    if not paths:
+        raise ValueError(f"No backfilled drops in {store_dir}")
+    return pd.concat({path.name[:-len(".pkl.gz")]: pd.read_pickle(path)
+                      for path in paths}, names=['drop'])
+
+
+def revisions(store_dir, series='Confirmed', region=None):
+    """Return the daily counts of the series, of the region or of the whole
+    country, with a row per date and a column per drop."""
+    counts = load_counts(store_dir)[series]
+    if region is not None:
+        counts = counts.xs(region, level=tc.REGION)
+    return counts.groupby(level=['date', 'drop']).sum().unstack('drop')
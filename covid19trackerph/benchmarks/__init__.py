@@ -0,0 +1 @@
+"""Benchmarks of the tracker pipeline. Each module is run with python -m."""
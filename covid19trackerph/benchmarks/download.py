@@ -0,0 +1,186 @@
+"""
+Benchmark the data drop downloads against a local Drive stand-in.
+
+The files of a fixture directory, or generated files if none is given, are
+served by localdrive.LocalDrive with the given request latency, bandwidth,
+page size and failure rate. For each number of download workers this
+measures the time to list the folder and the end-to-end throughput of
+datadrop.download into a temporary data directory.
+
+In production, the pooled transport retries each failed request
+transport.DEFAULT_RETRIES times and the chunks are not retried again. The
+stand-in has no transport so the failed chunks are retried as many times
+instead, with the backoff of datadrop. The number of retries is given in the
+conditions of the results.
+
+    python -m covid19trackerph.benchmarks.download --latency 50 \\
+        --bandwidth 20 --workers 1,4,8
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import traceback
+from timeit import default_timer as timer
+
+from covid19trackerph import datadrop
+from covid19trackerph import transport
+from covid19trackerph.localdrive import LocalDrive
+
+
+FOLDER_ID = "local-datadrop"
+MB = 1024 * 1024
+
+
+def generate_fixtures(directory, files=20, file_size=8 * MB, seed=0):
+    """Write files of random content that look like the data drop files."""
+    rng = random.Random(seed)
+    for index in range(files):
+        name = ("DOH COVID Data Drop_ 20211010 - "
+                f"04 Case Information_batch_{index}.csv")
+        with open(os.path.join(directory, name), 'wb') as file_handle:
+            file_handle.write(
+                rng.getrandbits(8 * file_size).to_bytes(file_size, 'little'))
+
+
+def time_listing(drive):
+    """Return the time to the first file and to the end of the listing."""
+    start = timer()
+    first = None
+    count = 0
+    for _ in datadrop.list_data_files(drive, FOLDER_ID):
+        if first is None:
+            first = timer() - start
+        count += 1
+    return {'files': count, 'first_file_seconds': first,
+            'listing_seconds': timer() - start,
+            'pages': len(drive.list_requests)}
+
+
+def time_download(drive, workers, chunksize, retries):
+    """Download all of the files into a temporary data directory."""
+    data_dir = tempfile.mkdtemp(prefix="datadrop-bench-")
+    saved_data_dir = datadrop.DATA_DIR
+    datadrop.DATA_DIR = data_dir
+    try:
+        start = timer()
+        downloaded = datadrop.download(folder_id=FOLDER_ID, workers=workers,
+                                       chunksize=chunksize,
+                                       service_factory=lambda: drive,
+                                       retries=retries)
+        elapsed = timer() - start
+        size = sum(os.path.getsize(path) for path in downloaded)
+    finally:
+        datadrop.DATA_DIR = saved_data_dir
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return {'workers': workers, 'files': len(downloaded), 'bytes': size,
+            'seconds': elapsed,
+            'mb_per_second': size / MB / elapsed if elapsed else 0.0,
+            'media_requests': len(drive.media_requests)}
+
+
+def make_drive(fixture_dir, args):
+    """Create the Drive stand-in with the configured conditions."""
+    return LocalDrive.from_directory(
+        fixture_dir, folder_id=FOLDER_ID, latency=args.latency / 1000,
+        bandwidth=args.bandwidth * MB if args.bandwidth else None,
+        page_size=args.page_size, fail_rate=args.fail_rate, seed=args.seed)
+
+
+def run(fixture_dir, args):
+    """Run the benchmark and return the results."""
+    results = {'conditions': {'latency_ms': args.latency,
+                              'bandwidth_mb_per_second': args.bandwidth,
+                              'page_size': args.page_size,
+                              'fail_rate': args.fail_rate,
+                              'chunk_size_mb': args.chunk_size,
+                              'retries': args.retries},
+               'listing': time_listing(make_drive(fixture_dir, args)),
+               'downloads': []}
+    logging.info("Listed %(files)d files in %(pages)d pages in "
+                 "%(listing_seconds).3fs, first file after "
+                 "%(first_file_seconds).3fs", results['listing'])
+    for workers in args.workers:
+        for _ in range(args.repeat):
+            result = time_download(make_drive(fixture_dir, args), workers,
+                                   args.chunk_size * MB, args.retries)
+            logging.info("%(workers)d workers: %(files)d files in "
+                         "%(seconds).2fs, %(mb_per_second).1f MB/s, "
+                         "%(media_requests)d media requests", result)
+            results['downloads'].append(result)
+    return results
+
+
+def _workers(value):
+    """Parse a comma separated list of worker counts."""
+    return [int(workers) for workers in value.split(',')]
+
+
+def _parse_args():
+    """Parse the CLI arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument("--fixture-dir",
+                        help="directory of the files to serve, generated if "
+                             "not given")
+    parser.add_argument("--files", type=int, default=20,
+                        help="number of generated files")
+    parser.add_argument("--file-size", type=float, default=8,
+                        help="size in MB of the generated files")
+    parser.add_argument("--latency", type=float, default=20,
+                        help="latency in milliseconds of each request")
+    parser.add_argument("--bandwidth", type=float, default=None,
+                        help="bandwidth in MB/s of each media request")
+    parser.add_argument("--page-size", type=int, default=None,
+                        help="maximum number of files per listing page")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="probability of a 503 for each media request")
+    parser.add_argument("--workers", type=_workers, default="1,4",
+                        help="comma separated numbers of download workers")
+    parser.add_argument("--chunk-size", type=int,
+                        default=datadrop.DEFAULT_CHUNK_SIZE // MB,
+                        help="size in MB of each requested chunk")
+    parser.add_argument("--retries", type=int,
+                        default=transport.DEFAULT_RETRIES,
+                        help="retries of a failed chunk, by default as many "
+                             "as the retries of each request in production")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="number of runs for each number of workers")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the generated files and the failures")
+    parser.add_argument("--output", help="write the results to a JSON file")
+    parser.add_argument("--loglevel", default="INFO",
+                        help="set log level")
+    return parser.parse_args()
+
+
+def main():
+    """Main function"""
+    args = _parse_args()
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    fixture_dir = args.fixture_dir
+    if fixture_dir is None:
+        fixture_dir = tempfile.mkdtemp(prefix="datadrop-fixtures-")
+        generate_fixtures(fixture_dir, args.files, int(args.file_size * MB),
+                          args.seed)
+    try:
+        results = run(fixture_dir, args)
+    finally:
+        if args.fixture_dir is None:
+            shutil.rmtree(fixture_dir, ignore_errors=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file_handle:
+            json.dump(results, file_handle, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:  # pylint: disable=broad-except
+        logging.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,150 @@
+"""
+Benchmark the engines on synthetic data drops.
+
+For each size, a data drop with that many Case Information rows is generated
+by benchmarks.synthetic, or reused from the cache directory, and each of the
+selected engines runs these stages:
+
+* load_data: reading and preparing both data sets with a cold cache
+* agg_count_cumsum_by_date: the weekly cumulative counts of the trend charts
+* summary_metrics: the statistics of the summary table
+
+The speed-up of each stage over the reference pandas engine is reported.
+The engines that are not installed, e.g. polars without the polars package,
+are skipped. The results are written as JSON and can be compared with a
+previous run.
+
+    python -m covid19trackerph.benchmarks.engines --sizes 100k,1m \\
+        --engines pandas,vectorized,polars --output engines.json
+"""
+
+import sys
+import shutil
+import logging
+import argparse
+import tempfile
+import traceback
+
+from covid19trackerph.benchmarks import pipeline
+
+
+DEFAULT_ENGINES = "pandas,vectorized,polars"
+DEFAULT_SIZES = "10k,100k"
+
+
+def run_engine(engine, work_dir, pool):
+    """Run the stages with the engine on the data drop in the work
+    directory and return their timings."""
+    # pylint: disable=import-outside-toplevel
+    from covid19trackerph import trackerchart as tc
+    from covid19trackerph import verify
+    stages = {}
+    frames, stages['load_data'] = pipeline.time_stage(
+        lambda: {name: engine.load_data(name, work_dir, rebuild=True,
+                                        pool=pool)
+                 for name in tc.DATA_SOURCES})
+    _, stages['agg_count_cumsum_by_date'] = pipeline.time_stage(
+        lambda: [engine.agg_count_cumsum_by_date(
+            frames['ci_data'], 'CaseCode', group, date)
+            for group, date in verify.AGGREGATES])
+    _, stages['summary_metrics'] = pipeline.time_stage(
+        lambda: engine.summary_metrics(frames['ci_data'],
+                                       frames['test_data']))
+    return stages
+
+
+def run_size(args, rows, pool):
+    """Run the engines on a data drop of the given size."""
+    # pylint: disable=import-outside-toplevel
+    from covid19trackerph import engines
+    source_dir = pipeline.data_drop(args.data_dir, rows, args.seed, args.days)
+    # The pickled caches are written to a copy of the data drop.
+    work_dir = tempfile.mkdtemp(prefix="engines-bench-")
+    result = {'rows': rows, 'engines': {}}
+    try:
+        pipeline.link_data_drop(source_dir, work_dir)
+        for name in args.engines:
+            if name not in engines.ENGINES:
+                logging.warning("Skipping the %s engine, it is not "
+                                "installed", name)
+                continue
+            result['engines'][name] = run_engine(
+                engines.ENGINES[name], work_dir, pool)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    reference = result['engines'].get('pandas', {})
+    for name, stages in result['engines'].items():
+        for stage, timing in stages.items():
+            timing['rows_per_second'] = (rows / timing['seconds']
+                                         if timing['seconds'] else 0.0)
+            if stage in reference and timing['seconds']:
+                timing['speedup'] = (reference[stage]['seconds'] /
+                                     timing['seconds'])
+            logging.info("%d rows, %s, %s: %.3fs (%.2fx)", rows, name, stage,
+                         timing['seconds'], timing.get('speedup', 1.0))
+    return result
+
+
+def compare(previous, results):
+    """Log the speed-up of each engine and stage since the previous
+    results."""
+    for rows, result in results['sizes'].items():
+        old = previous.get('sizes', {}).get(rows)
+        if not old:
+            continue
+        for name, stages in result['engines'].items():
+            for stage, timing in stages.items():
+                old_timing = old['engines'].get(name, {}).get(stage)
+                if old_timing and timing['seconds']:
+                    logging.info("%s rows, %s, %s: %.3fs -> %.3fs (%.2fx)",
+                                 rows, name, stage, old_timing['seconds'],
+                                 timing['seconds'],
+                                 old_timing['seconds'] / timing['seconds'])
+
+
+def run(args):
+    """Run the benchmark and return the results."""
+    # pylint: disable=import-outside-toplevel
+    from covid19trackerph import trackerchart as tc
+    results = {'meta': pipeline.run_meta(args, engines=args.engines),
+               'sizes': {}}
+    with tc.create_pool(args.executor, args.workers, args.start_method,
+                        formats=['json']) as pool:
+        results['meta']['workers'] = pool.workers
+        for rows in args.sizes:
+            results['sizes'][str(rows)] = run_size(args, rows, pool)
+    return results
+
+
+def _engines(value):
+    """Parse a comma separated list of engines."""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    if not names:
+        raise argparse.ArgumentTypeError("no engines")
+    return names
+
+
+def _parse_args():
+    """Parse the CLI arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    pipeline.add_common_arguments(parser, DEFAULT_SIZES)
+    parser.add_argument("--engines", type=_engines, default=DEFAULT_ENGINES,
+                        help=("comma separated engines, "
+                              "default: %(default)s"))
+    return parser.parse_args()
+
+
+def main():
+    """Main function"""
+    args = _parse_args()
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    pipeline.write_results(args, run(args), compare)
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:  # pylint: disable=broad-except
+        logging.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,171 @@
+"""
+Benchmark the start-up import time of the tracker entry points.
+
+Each scenario runs in a fresh interpreter with 'python -X importtime' and
+reports the total import time, the wall time of the process and the slowest
+top-level imports:
+
+* help: updatetracker --help
+* skip-download: the modules imported by updatetracker --skip-download
+  before the charts are generated
+* download: the modules imported by a download
+* worker: the modules imported by a pool worker started with the spawn or
+  forkserver start method, which unlike fork does not inherit the modules of
+  the parent
+
+The start-up of a spawned pool is also timed end to end.
+
+    python -m covid19trackerph.benchmarks.importtime --repeat 5
+"""
+
+import os
+import re
+import sys
+import json
+import logging
+import argparse
+import subprocess
+import traceback
+import multiprocessing as mp
+from timeit import default_timer as timer
+
+
+SCENARIOS = {
+    'help': ["-m", "covid19trackerph.updatetracker", "--help"],
+    'skip-download': ["-c", "import covid19trackerph.updatetracker; "
+                            "import covid19trackerph.trackerchart"],
+    'download': ["-c", "import covid19trackerph.updatetracker; "
+                       "import covid19trackerph.transport; "
+                       "import googleapiclient.discovery; "
+                       "import google_auth_oauthlib.flow"],
+    'worker': ["-c", "import covid19trackerph.trackerchart"],
+}
+# Number of top-level imports listed for each scenario.
+REPORT_TOP = 5
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def parse_importtime(output):
+    """Parse the -X importtime output.
+
+    Returns the total import time in seconds and the cumulative time in
+    seconds of each top-level import.
+    """
+    total = 0
+    top_level = {}
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        total += int(self_us)
+        if len(indent) == 1:
+            top_level[name] = int(cumulative_us) / 1e6
+    return total / 1e6, top_level
+
+
+def time_scenario(args):
+    """Run the scenario in a new interpreter and return its import times."""
+    start = timer()
+    process = subprocess.run([sys.executable, "-X", "importtime"] + args,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                             text=True, check=True)
+    wall_time = timer() - start
+    total, top_level = parse_importtime(process.stderr)
+    return {'import_seconds': total, 'wall_seconds': wall_time,
+            'top_level': top_level}
+
+
+def _import_trackerchart(_):
+    """Import the chart module in a worker and return the time it took."""
+    start = timer()
+    # pylint: disable=import-outside-toplevel,unused-import
+    from covid19trackerph import trackerchart  # noqa: F401
+    return timer() - start
+
+
+def time_pool_startup(workers, start_method):
+    """Time the start of a pool until every worker has imported the charts.
+
+    Returns the wall time and the slowest import time of a worker.
+    """
+    context = mp.get_context(start_method)
+    start = timer()
+    with context.Pool(workers) as pool:
+        import_times = pool.map(_import_trackerchart, range(workers),
+                                chunksize=1)
+        wall_time = timer() - start
+    return {'workers': workers, 'start_method': start_method,
+            'wall_seconds': wall_time,
+            'max_worker_import_seconds': max(import_times)}
+
+
+def run(args):
+    """Run the benchmark and return the results."""
+    results = {'scenarios': {}, 'pool': None}
+    for name in args.scenarios:
+        runs = [time_scenario(SCENARIOS[name]) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run_: run_['import_seconds'])
+        results['scenarios'][name] = best
+        logging.info("%s: %.3fs of imports, %.3fs wall time (best of %d)",
+                     name, best['import_seconds'], best['wall_seconds'],
+                     args.repeat)
+        slowest = sorted(best['top_level'].items(), key=lambda item: item[1],
+                         reverse=True)
+        for module, seconds in slowest[:REPORT_TOP]:
+            logging.info("  %s: %.3fs", module, seconds)
+    if args.workers:
+        results['pool'] = time_pool_startup(args.workers, args.start_method)
+        logging.info("Pool of %(workers)d %(start_method)s workers ready in "
+                     "%(wall_seconds).3fs, slowest worker import "
+                     "%(max_worker_import_seconds).3fs", results['pool'])
+    return results
+
+
+def _scenarios(value):
+    """Parse a comma separated list of scenarios."""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if not names or unknown:
+        raise argparse.ArgumentTypeError(
+            f"choose from {', '.join(SCENARIOS)}")
+    return names
+
+
+def _parse_args():
+    """Parse the CLI arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument("--scenarios", type=_scenarios,
+                        default=",".join(SCENARIOS),
+                        help="comma separated scenarios, default: %(default)s")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs of each scenario, the best one is reported")
+    parser.add_argument("--workers", type=int,
+                        default=min(4, os.cpu_count() or 1),
+                        help="workers of the timed pool, 0 to skip it")
+    parser.add_argument("--start-method", default="spawn",
+                        choices=mp.get_all_start_methods(),
+                        help="start method of the timed pool")
+    parser.add_argument("--output", help="write the results to a JSON file")
+    parser.add_argument("--loglevel", default="INFO",
+                        help="set log level")
+    return parser.parse_args()
+
+
+def main():
+    """Main function"""
+    args = _parse_args()
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file_handle:
+            json.dump(results, file_handle, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:  # pylint: disable=broad-except
+        logging.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,308 @@
+"""
+Benchmark the data preparation and the charts on synthetic data drops.
+
+For each size, a data drop with that many Case Information rows is generated
+by benchmarks.synthetic, or reused from the cache directory, and each stage
+of the pipeline is timed:
+
+* read: reading the Case Information file
+* calc_case_info_data: deriving the case columns in the worker pool
+* prepare_data: the whole preparation of both data sets with a cold cache
+* prepare_data_cached: the same from the pickled cache
+* agg_count_cumsum_by_date: the weekly cumulative counts by region
+* plot: every chart task, written as JSON only so that the time is not
+  dominated by the PNG rendering. The time of each task is also reported.
+
+With --profile, each stage is also run under cProfile and the functions
+with the highest cumulative time are included in the results. Only the main
+process is profiled so use the serial executor to profile the worker code.
+The results are written as JSON and can be compared with a previous run.
+
+    python -m covid19trackerph.benchmarks.pipeline --sizes 10k,100k,1m \\
+        --output results.json --compare baseline.json
+"""
+
+import os
+import io
+import sys
+import json
+import pstats
+import shutil
+import logging
+import argparse
+import multiprocessing
+import platform
+import tempfile
+import traceback
+import cProfile
+from datetime import datetime
+from timeit import default_timer as timer
+
+from covid19trackerph import execution
+from covid19trackerph import memory
+from covid19trackerph import taskgraph
+from covid19trackerph.benchmarks import synthetic
+
+
+STAGES = ['read', 'calc_case_info_data', 'prepare_data',
+          'prepare_data_cached', 'agg_count_cumsum_by_date', 'plot']
+DEFAULT_SIZES = "10k,100k"
+# Number of functions listed in the profile of each stage.
+PROFILE_TOP = 15
+
+
+def data_drop(cache_dir, rows, seed, days):
+    """Return the directory of the data drop of the given size, generating
+    it if it is not in the cache directory yet."""
+    directory = os.path.join(cache_dir, f"rows{rows}-seed{seed}-days{days}")
+    marker = os.path.join(directory, ".complete")
+    if not os.path.exists(marker):
+        logging.info("Generating a data drop of %d cases", rows)
+        shutil.rmtree(directory, ignore_errors=True)
+        synthetic.write_data_drop(directory, rows, seed=seed, days=days)
+        with open(marker, 'w', encoding='utf-8'):
+            pass
+    return directory
+
+
+def link_data_drop(source_dir, work_dir):
+    """Link the CSV files of the data drop into the work directory so that
+    the caches written next to them do not end up in the cached drop."""
+    for name in os.listdir(source_dir):
+        if name.endswith(".csv"):
+            os.symlink(os.path.join(source_dir, name),
+                       os.path.join(work_dir, name))
+
+
+def profile_stats(profiler, top=PROFILE_TOP):
+    """Return the functions with the highest cumulative time."""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    functions = []
+    # pylint: disable=no-member
+    for func in stats.fcn_list[:top]:
+        _, calls, total_time, cumulative_time, _ = stats.stats[func]
+        file_name, line, name = func
+        functions.append({'function': f"{file_name}:{line}({name})",
+                          'calls': calls, 'tottime': total_time,
+                          'cumtime': cumulative_time})
+    return functions
+
+
+def time_stage(func, profile=False):
+    """Run the function and return its result and timing.
+
+    The timing has the seconds taken and, if profile is True, the profile of
+    the call.
+    """
+    profiler = cProfile.Profile() if profile else None
+    start = timer()
+    if profiler:
+        profiler.enable()
+    try:
+        result = func()
+    finally:
+        if profiler:
+            profiler.disable()
+    timing = {'seconds': timer() - start}
+    if profiler:
+        timing['profile'] = profile_stats(profiler)
+    return result, timing
+
+
+def run_size(args, rows, pool):
+    """Run the selected stages on a data drop of the given size."""
+    # The data stack is imported here so that --help stays fast.
+    # pylint: disable=import-outside-toplevel,too-many-locals
+    import pandas as pd
+    from covid19trackerph import trackerchart as tc
+    source_dir = data_drop(args.data_dir, rows, args.seed, args.days)
+    # The pickled caches and the task timings are written to a copy of the
+    # data drop so that every run starts cold.
+    work_dir = tempfile.mkdtemp(prefix="pipeline-bench-")
+    result = {'rows': rows, 'stages': {}}
+    stages = result['stages']
+    try:
+        link_data_drop(source_dir, work_dir)
+        _, calc_case_info = tc.DATA_SOURCES['ci_data']
+        case_file = next(os.path.join(work_dir, name)
+                         for name in os.listdir(work_dir)
+                         if "Case Information" in name)
+        ci_data = None
+        if 'read' in args.stages or 'calc_case_info_data' in args.stages:
+            raw, stages['read'] = time_stage(
+                lambda: pd.read_csv(case_file), args.profile)
+            result['raw_bytes'] = memory.frame_bytes(raw)
+            if 'calc_case_info_data' in args.stages:
+                ci_data, stages['calc_case_info_data'] = time_stage(
+                    lambda: tc.apply_parallel(raw, calc_case_info, pool),
+                    args.profile)
+            del raw
+        frames = None
+        if {'prepare_data', 'prepare_data_cached', 'plot'} & set(args.stages):
+            frames, stages['prepare_data'] = time_stage(
+                lambda: {name: tc.load_data(name, work_dir, rebuild=True,
+                                            pool=pool)
+                         for name in tc.DATA_SOURCES}, args.profile)
+            if 'prepare_data_cached' in args.stages:
+                frames, stages['prepare_data_cached'] = time_stage(
+                    lambda: {name: tc.load_data(name, work_dir, pool=pool)
+                             for name in tc.DATA_SOURCES}, args.profile)
+            ci_data = frames['ci_data']
+        if ci_data is not None:
+            result['prepared_bytes'] = memory.frame_bytes(ci_data)
+        if 'agg_count_cumsum_by_date' in args.stages:
+            if ci_data is None:
+                ci_data = tc.load_data('ci_data', work_dir, pool=pool)
+            _, stages['agg_count_cumsum_by_date'] = time_stage(
+                lambda: tc.agg_count_cumsum_by_date(
+                    ci_data, 'CaseCode', tc.REGION, 'DateRepConf'),
+                args.profile)
+        if 'plot' in args.stages:
+            _, stages['plot'] = time_stage(
+                lambda: tc.plot(os.path.dirname(work_dir),
+                                os.path.basename(work_dir), formats=['json'],
+                                pool=pool, data=frames), args.profile)
+            result['charts'] = taskgraph.load_timings(
+                os.path.join(work_dir, tc.TASK_TIMINGS))
+        for name, timing in stages.items():
+            timing['rows_per_second'] = (rows / timing['seconds']
+                                         if timing['seconds'] else 0.0)
+            logging.info("%d rows, %s: %.3fs (%.0f rows/s)", rows, name,
+                         timing['seconds'], timing['rows_per_second'])
+        result['peak_rss'] = memory.peak_rss()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+def compare(previous, results):
+    """Log the speed-up of each stage since the previous results."""
+    for rows, result in results['sizes'].items():
+        old = previous.get('sizes', {}).get(rows)
+        if not old:
+            continue
+        for name, timing in result['stages'].items():
+            old_timing = old['stages'].get(name)
+            if old_timing and timing['seconds']:
+                logging.info("%s rows, %s: %.3fs -> %.3fs (%.2fx)", rows, name,
+                             old_timing['seconds'], timing['seconds'],
+                             old_timing['seconds'] / timing['seconds'])
+
+
+def run_meta(args, **extra):
+    """Return the metadata of a run of a benchmark with the common
+    arguments and the extra metadata."""
+    return {'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': execution.available_cpus(),
+            'executor': args.executor, 'workers': args.workers,
+            'start_method': args.start_method,
+            'seed': args.seed, 'days': args.days, **extra}
+
+
+def write_results(args, results, compare_results):
+    """Compare the results with the previous run with compare_results and
+    write them, as requested by the common arguments."""
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file_handle:
+            compare_results(json.load(file_handle), results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file_handle:
+            json.dump(results, file_handle, indent=1)
+
+
+def run(args):
+    """Run the benchmark and return the results."""
+    # pylint: disable=import-outside-toplevel
+    from covid19trackerph import trackerchart as tc
+    chart_dir = tempfile.mkdtemp(prefix="pipeline-charts-")
+    # The pool passes the output directories on to its workers.
+    output_dirs = (tc.CHART_OUTPUT, tc.TABLE_OUTPUT)
+    tc.set_output_dirs(os.path.join(chart_dir, "charts"),
+                       os.path.join(chart_dir, "tables"))
+    results = {'meta': run_meta(args, stages=args.stages), 'sizes': {}}
+    try:
+        with tc.create_pool(args.executor, args.workers, args.start_method,
+                            formats=['json']) as pool:
+            results['meta']['workers'] = pool.workers
+            for rows in args.sizes:
+                results['sizes'][str(rows)] = run_size(args, rows, pool)
+    finally:
+        tc.set_output_dirs(*output_dirs)
+        shutil.rmtree(chart_dir, ignore_errors=True)
+    return results
+
+
+def parse_sizes(value):
+    """Parse a comma separated list of row counts."""
+    return [synthetic.parse_rows(size) for size in value.split(',')
+            if size.strip()]
+
+
+def _stages(value):
+    """Parse a comma separated list of stages."""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = set(names) - set(STAGES)
+    if not names or unknown:
+        raise argparse.ArgumentTypeError(f"choose from {', '.join(STAGES)}")
+    return names
+
+
+def add_common_arguments(parser, default_sizes=DEFAULT_SIZES):
+    """Add the CLI arguments shared by the benchmarks of the data drops."""
+    parser.add_argument("--sizes", type=parse_sizes, default=default_sizes,
+                        help=("comma separated Case Information rows, e.g. "
+                              "10k,100k,1m,10m, default: %(default)s"))
+    parser.add_argument("--data-dir",
+                        default=os.path.join(tempfile.gettempdir(),
+                                             "covid19trackerph-bench"),
+                        help=("cache directory of the generated data drops, "
+                              "default: %(default)s"))
+    parser.add_argument("--days", type=int, default=synthetic.DEFAULT_DAYS,
+                        help="days covered by the data drops")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed of the data drops")
+    parser.add_argument("--executor", default="process",
+                        choices=execution.EXECUTORS,
+                        help="how the workers are run, default: %(default)s")
+    parser.add_argument("--start-method",
+                        choices=multiprocessing.get_all_start_methods(),
+                        help=("multiprocessing start method of the process "
+                              "workers, default: platform default"))
+    parser.add_argument("--workers", type=int,
+                        help=("number of workers, default: one less than the "
+                              "available CPUs"))
+    parser.add_argument("--compare", metavar="JSON",
+                        help="compare with the results of a previous run")
+    parser.add_argument("--output", help="write the results to a JSON file")
+    parser.add_argument("--loglevel", default="INFO",
+                        help="set log level")
+
+
+def _parse_args():
+    """Parse the CLI arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    add_common_arguments(parser)
+    parser.add_argument("--stages", type=_stages, default=",".join(STAGES),
+                        help="comma separated stages, default: all")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile each stage with cProfile")
+    return parser.parse_args()
+
+
+def main():
+    """Main function"""
+    args = _parse_args()
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    write_results(args, run(args), compare)
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:  # pylint: disable=broad-except
+        logging.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,377 @@
+"""
+Synthetic DOH data drop generator.
+
+Writes Case Information and Testing Aggregates files with the columns, value
+formats and quirks of the real data drop at any size. The data is generated
+from a seed so that the same files are written on every run:
+
+* 1,710 municipalities in 95 provinces of the 17 regions, the returning
+  overseas Filipinos and the repatriates, with the cases concentrated in a
+  few of them like in the real data
+* the null rates of the location, date and status columns of the real drop
+* report dates that rise and fall in waves, with the latest day of the drop
+  reported in full
+* test facilities taken from resources/test-facility.csv so that these join
+  with the facility data
+
+The rows are generated in chunks so that the files of millions of cases can
+be written without holding all of them in memory.
+
+    python -m covid19trackerph.benchmarks.synthetic --rows 1000000 data-bench
+"""
+
+import os
+import sys
+import logging
+import argparse
+import traceback
+
+import numpy as np
+import pandas as pd
+
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+TEST_FACILITY_FILE = os.path.join(SCRIPT_DIR, "resources", "test-facility.csv")
+CASE_INFORMATION_FILE = "DOH COVID Data Drop_ 20211010 - 04 Case Information.csv"
+TESTING_AGGREGATES_FILE = ("DOH COVID Data Drop_ 20211010 - "
+                           "07 Testing Aggregates.csv")
+CASE_COLUMNS = ['CaseCode', 'Age', 'AgeGroup', 'Sex', 'DateSpecimen',
+                'DateResultRelease', 'DateRepConf', 'DateDied', 'DateRecover',
+                'RemovalType', 'Admitted', 'RegionRes', 'ProvRes', 'CityMunRes',
+                'CityMuniPSGC', 'HealthStatus', 'Quarantined', 'DateOnset',
+                'Pregnanttab', 'ValidationStatus']
+TEST_COLUMNS = ['facility_name', 'report_date', 'daily_output_samples_tested',
+                'daily_output_unique_individuals',
+                'daily_output_positive_individuals',
+                'daily_output_negative_individuals', 'daily_output_equivocal',
+                'daily_output_invalid', 'remaining_available_tests',
+                'backlogs', 'cumulative_samples_tested',
+                'cumulative_unique_individuals',
+                'cumulative_positive_individuals',
+                'cumulative_negative_individuals', 'pct_positive_cumulative',
+                'pct_negative_cumulative', 'validation_status']
+# Regions and their share of the cases.
+REGIONS = {
+    'NCR': 0.40,
+    'Region IV-A: CALABARZON': 0.16,
+    'Region III: Central Luzon': 0.09,
+    'Region VII: Central Visayas': 0.06,
+    'Region VI: Western Visayas': 0.04,
+    'Region XI: Davao Region': 0.04,
+    'Region I: Ilocos Region': 0.025,
+    'Region II: Cagayan Valley': 0.025,
+    'Region V: Bicol Region': 0.02,
+    'Region VIII: Eastern Visayas': 0.02,
+    'Region IX: Zamboanga Peninsula': 0.015,
+    'Region X: Northern Mindanao': 0.02,
+    'Region XII: SOCCSKSARGEN': 0.015,
+    'CAR': 0.015,
+    'CARAGA': 0.01,
+    'MIMAROPA': 0.01,
+    'BARMM': 0.005,
+    'ROF': 0.005,
+    'REPATRIATE': 0.005,
+}
+PROVINCES_PER_REGION = 5
+MUNICIPALITIES_PER_PROVINCE = 18
+HEALTH_STATUS_ACTIVE = {'MILD': 0.6, 'ASYMPTOMATIC': 0.25, 'MODERATE': 0.08,
+                        'SEVERE': 0.05, 'CRITICAL': 0.02}
+# Share of the null values of the real data drop.
+NULL_RATES = {
+    'Age': 0.003,
+    'DateSpecimen': 0.02,
+    'DateResultRelease': 0.09,
+    'RegionRes': 0.13,
+    'ProvRes': 0.1,
+    'CityMunRes': 0.02,
+    'DateOnset': 0.58,
+    'Pregnanttab': 0.5,
+    'ValidationStatus': 0.56,
+}
+# Share of the recovered cases with no recovery date.
+RECOVER_DATE_NULL_RATE = 0.6
+VALIDATION_MESSAGES = [
+    "Case has Lab Result, but Result Date is blank",
+    "Multiple location names correspond to the same City PSGC",
+    ('Removal Type is "Recovered", but no Recovered Date is recorded\n'
+     'Health Status is "Recovered", but no Date Recovered is recorded'),
+]
+AGE_GROUPS = ['0 to 4', '5 to 9', '10 to 14', '15 to 19', '20 to 24',
+              '25 to 29', '30 to 34', '35 to 39', '40 to 44', '45 to 49',
+              '50 to 54', '55 to 59', '60 to 64', '65 to 69', '70 to 74',
+              '75 to 79', '80+']
+DEFAULT_START = "2020-03-01"
+DEFAULT_DAYS = 600
+CHUNK_ROWS = 1_000_000
+
+
+def locations(seed=0):
+    """Return the municipalities with their province, region, PSGC code and
+    share of the cases.
+
+    The shares within a region follow a Zipf distribution so a few cities
+    have most of the cases.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for region_index, (region, region_share) in enumerate(REGIONS.items()):
+        short_name = region.split(':')[0].upper()
+        count = PROVINCES_PER_REGION * MUNICIPALITIES_PER_PROVINCE
+        shares = 1.0 / np.arange(1, count + 1) ** 1.1
+        shares = rng.permutation(shares / shares.sum()) * region_share
+        for index in range(count):
+            province = index // MUNICIPALITIES_PER_PROVINCE
+            rows.append({
+                'RegionRes': region,
+                'ProvRes': f"{short_name} PROVINCE {province + 1}",
+                'CityMunRes': (
+                    f"{short_name} CITY {index + 1}" if index % 6 == 0
+                    else f"{short_name} MUNICIPALITY {index + 1}"),
+                'CityMuniPSGC': f"PH{region_index + 1:02d}{index + 1:07d}",
+                'share': shares[index],
+            })
+    places = pd.DataFrame(rows)
+    places['share'] /= places['share'].sum()
+    return places
+
+
+def wave_weights(days):
+    """Return the share of the cases reported on each day.
+
+    The cases come in three waves of rising size on top of a base level.
+    """
+    day = np.arange(days)
+    weights = np.full(days, 0.05)
+    for center, width, height in [(0.25, 0.05, 0.4), (0.55, 0.06, 0.8),
+                                  (0.85, 0.05, 1.0)]:
+        weights += height * np.exp(-0.5 * ((day / days - center) / width) ** 2)
+    # The drop adds the cases of its latest day all at once.
+    weights[-1] *= 2
+    return weights / weights.sum()
+
+
+def _with_nulls(rng, values, rate):
+    """Replace the given share of the values with None."""
+    values = np.asarray(values, dtype=object)
+    values[rng.random(len(values)) < rate] = None
+    return values
+
+
+def _dates(day_numbers, start):
+    """Format the day numbers since the start date, NaN stays empty."""
+    day_numbers = np.asarray(day_numbers, dtype=float)
+    valid = ~np.isnan(day_numbers)
+    dates = np.full(len(day_numbers), None, dtype=object)
+    # datetime64 days are formatted as YYYY-MM-DD.
+    dates[valid] = (np.datetime64(start, 'D') +
+                    day_numbers[valid].astype(int)).astype(str)
+    return dates
+
+
+def case_information(rows, seed=0, start=DEFAULT_START, days=DEFAULT_DAYS,
+                     first_case=0, places=None):
+    """Generate the given number of Case Information rows.
+
+    first_case is the number of the first case code so that chunks of the
+    same file have unique codes. places is the result of locations.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    rng = np.random.default_rng(seed)
+    places = locations(seed) if places is None else places
+    rep_conf = rng.choice(days, size=rows, p=wave_weights(days))
+    specimen = rep_conf - rng.integers(1, 10, size=rows)
+    release = np.minimum(specimen + rng.integers(0, 5, size=rows), rep_conf)
+    onset = specimen - rng.integers(0, 8, size=rows)
+    age = np.clip(rng.normal(38, 18, size=rows).round(), 0, 100)
+    age_group = np.asarray(AGE_GROUPS, dtype=object)[
+        np.minimum(age // 5, len(AGE_GROUPS) - 1).astype(int)]
+    # The older cases are mostly closed.
+    age_in_days = days - 1 - rep_conf
+    closed = rng.random(rows) < np.clip(age_in_days / 21, 0, 0.98)
+    died = closed & (rng.random(rows) < 0.03)
+    recovered = closed & ~died
+    active_status = rng.choice(list(HEALTH_STATUS_ACTIVE), size=rows,
+                               p=list(HEALTH_STATUS_ACTIVE.values()))
+    health_status = np.where(died, 'DIED',
+                             np.where(recovered, 'RECOVERED', active_status))
+    recover_day = np.where(
+        recovered & (rng.random(rows) >= RECOVER_DATE_NULL_RATE),
+        np.minimum(rep_conf + rng.integers(7, 22, size=rows), days - 1),
+        np.nan)
+    died_day = np.where(died, rep_conf + rng.integers(-10, 15, size=rows),
+                        np.nan)
+    died_day = np.minimum(died_day, days - 1)
+    place = places.iloc[rng.choice(len(places), size=rows,
+                                   p=places['share'].to_numpy())]
+    sex = rng.choice(['MALE', 'FEMALE'], size=rows, p=[0.52, 0.48])
+    pregnant = np.where(sex == 'FEMALE',
+                        np.where(rng.random(rows) < 0.02, 'YES', 'NO'), 'NO')
+    case_codes = (first_case + rng.permutation(rows)).astype(str)
+    data = pd.DataFrame({
+        'CaseCode': np.char.add('C', np.char.zfill(case_codes, 7)),
+        'Age': _with_nulls(rng, age, NULL_RATES['Age']),
+        'AgeGroup': age_group,
+        'Sex': sex,
+        'DateSpecimen': _with_nulls(rng, _dates(specimen, start),
+                                    NULL_RATES['DateSpecimen']),
+        'DateResultRelease': _with_nulls(rng, _dates(release, start),
+                                         NULL_RATES['DateResultRelease']),
+        'DateRepConf': _dates(rep_conf, start),
+        'DateDied': _dates(died_day, start),
+        'DateRecover': _dates(recover_day, start),
+        'RemovalType': np.where(died, 'DIED',
+                                np.where(recovered, 'RECOVERED', None)),
+        'Admitted': rng.choice(['NO', 'YES'], size=rows, p=[0.85, 0.15]),
+        'RegionRes': _with_nulls(rng, place['RegionRes'],
+                                 NULL_RATES['RegionRes']),
+        'ProvRes': _with_nulls(rng, place['ProvRes'], NULL_RATES['ProvRes']),
+        'CityMunRes': _with_nulls(rng, place['CityMunRes'],
+                                  NULL_RATES['CityMunRes']),
+        'CityMuniPSGC': place['CityMuniPSGC'].to_numpy(),
+        'HealthStatus': health_status,
+        'Quarantined': rng.choice(['NO', 'YES'], size=rows, p=[0.8, 0.2]),
+        'DateOnset': _with_nulls(rng, _dates(onset, start),
+                                 NULL_RATES['DateOnset']),
+        'Pregnanttab': _with_nulls(rng, pregnant, NULL_RATES['Pregnanttab']),
+        'ValidationStatus': _with_nulls(
+            rng, rng.choice(VALIDATION_MESSAGES, size=rows),
+            NULL_RATES['ValidationStatus']),
+    })
+    # The location of a case without a municipality is missing throughout.
+    no_city = data['CityMunRes'].isna()
+    data.loc[no_city, 'CityMuniPSGC'] = None
+    no_region = data['RegionRes'].isna()
+    data.loc[no_region, ['ProvRes', 'CityMunRes', 'CityMuniPSGC']] = None
+    return data[CASE_COLUMNS]
+
+
+def testing_aggregates(seed=0, start=DEFAULT_START, days=DEFAULT_DAYS,
+                       facilities=None):
+    """Generate the Testing Aggregates rows of the given number of test
+    facilities, every facility of the facility data by default.
+
+    The facilities start testing at different days and their capacity and
+    positivity rate change over time.
+    """
+    # pylint: disable=too-many-locals
+    rng = np.random.default_rng(seed)
+    names = pd.read_csv(TEST_FACILITY_FILE)['facility_name'].dropna().unique()
+    if facilities is not None:
+        names = names[:facilities]
+    frames = []
+    positivity = 0.04 + 0.12 * wave_weights(days) / wave_weights(days).max()
+    for name in names:
+        first_day = int(rng.integers(0, days // 2))
+        day = np.arange(first_day, days)
+        capacity = rng.integers(50, 1500) * np.minimum(
+            1.0, (day - first_day + 1) / 60)
+        samples = rng.poisson(capacity).astype(float)
+        unique = np.floor(samples * rng.uniform(0.9, 1.0, size=len(day)))
+        positive = rng.binomial(unique.astype(int), positivity[day])
+        negative = unique - positive
+        cumulative = [np.cumsum(values) for values in (samples, unique,
+                                                       positive, negative)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct_positive = np.round(cumulative[2] / cumulative[1], 2)
+        frame = pd.DataFrame({
+            'facility_name': name,
+            'report_date': _dates(day, start),
+            'daily_output_samples_tested': samples,
+            'daily_output_unique_individuals': unique,
+            'daily_output_positive_individuals': positive.astype(float),
+            'daily_output_negative_individuals': negative,
+            'daily_output_equivocal': _with_nulls(
+                rng, rng.poisson(0.2, size=len(day)).astype(float), 0.17),
+            'daily_output_invalid': _with_nulls(
+                rng, rng.poisson(0.2, size=len(day)).astype(float), 0.17),
+            'remaining_available_tests': rng.integers(0, 5000,
+                                                      size=len(day)) * 1.0,
+            'backlogs': _with_nulls(
+                rng, rng.poisson(20, size=len(day)).astype(float), 0.19),
+            'cumulative_samples_tested': cumulative[0].astype(int),
+            'cumulative_unique_individuals': cumulative[1].astype(int),
+            'cumulative_positive_individuals': cumulative[2].astype(int),
+            'cumulative_negative_individuals': cumulative[3].astype(int),
+            'pct_positive_cumulative': pct_positive,
+            'pct_negative_cumulative': np.round(1 - pct_positive, 2),
+            'validation_status': None,
+        })
+        # Some of the days have no daily output.
+        missing = rng.random(len(day)) < 0.03
+        frame.loc[missing, TEST_COLUMNS[2:8]] = np.nan
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)[TEST_COLUMNS]
+
+
+def write_data_drop(directory, rows, seed=0, start=DEFAULT_START,
+                    days=DEFAULT_DAYS, chunk_rows=CHUNK_ROWS):
+    """Write the Case Information file of the given number of rows and the
+    Testing Aggregates file to the directory.
+
+    Returns the paths of the files.
+    """
+    # pylint: disable=too-many-arguments
+    os.makedirs(directory, exist_ok=True)
+    places = locations(seed)
+    case_path = os.path.join(directory, CASE_INFORMATION_FILE)
+    seeds = np.random.SeedSequence(seed).spawn(-(-rows // chunk_rows) or 1)
+    for index, chunk_seed in enumerate(seeds):
+        first_case = index * chunk_rows
+        chunk = case_information(min(chunk_rows, rows - first_case),
+                                 seed=chunk_seed, start=start, days=days,
+                                 first_case=first_case, places=places)
+        chunk.to_csv(case_path, mode='w' if index == 0 else 'a',
+                     header=index == 0, index=False)
+        logging.info("Wrote %d of %d cases", first_case + len(chunk), rows)
+    test_path = os.path.join(directory, TESTING_AGGREGATES_FILE)
+    testing_aggregates(seed, start, days).to_csv(test_path, index=False)
+    return case_path, test_path
+
+
+def parse_rows(value):
+    """Parse a number of rows with an optional k or m suffix."""
+    value = value.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(value[-1:], 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        rows = int(float(value) * multiplier)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"invalid number of rows: {value}") \
+            from error
+    if rows <= 0:
+        raise argparse.ArgumentTypeError("the number of rows must be positive")
+    return rows
+
+
+def _parse_args():
+    """Parse the CLI arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument("directory", help="directory of the generated files")
+    parser.add_argument("--rows", type=parse_rows, default="100k",
+                        help="Case Information rows, e.g. 10k or 1m")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS,
+                        help="days covered by the data drop")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--loglevel", default="INFO",
+                        help="set log level")
+    return parser.parse_args()
+
+
+def main():
+    """Main function"""
+    args = _parse_args()
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    for path in write_data_drop(args.directory, args.rows, seed=args.seed,
+                                days=args.days):
+        logging.info("Wrote %s", path)
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:  # pylint: disable=broad-except
+        logging.error(traceback.format_exc())
+        sys.exit(1)
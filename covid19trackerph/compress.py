@@ -0,0 +1,210 @@
+"""
+Post-processing of the generated chart files.
+
+The chart HTML files are repetitive text so these compress very well. This
+module writes '.gz' and '.br' siblings for the text files so that a web server
+can serve the precompressed files directly. It can also optimize the PNG files
+losslessly. A fingerprint of each processed file is kept in a manifest in the
+output directory so that only the files that changed since the last run are
+processed again.
+
+Brotli and Pillow are optional. When brotli is not installed only the gzip
+files are written. PNG optimization uses oxipng or optipng when one of them is
+on the PATH, otherwise Pillow.
+"""
+
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import subprocess
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+
+from covid19trackerph.outputsink import atomic_write
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None
+
+
+TEXT_SUFFIXES = ('.html', '.json', '.svg')
+PNG_SUFFIX = '.png'
+MANIFEST = ".compress-manifest.json"
+# zlib and brotli release the GIL while compressing so threads are enough.
+DEFAULT_WORKERS = 4
+
+
+def fingerprint(data):
+    """Return the fingerprint of the given bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_manifest(directory):
+    """Load the fingerprints of the files processed in the previous run."""
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as file_handle:
+        return json.load(file_handle)
+
+
+def save_manifest(directory, manifest):
+    """Save the fingerprints of the processed files."""
+    atomic_write(os.path.join(directory, MANIFEST),
+                 json.dumps(manifest, indent=1, sort_keys=True))
+
+
+def compress_text(path, data):
+    """Write the compressed siblings of the given text file.
+
+    Returns a dict of the suffix and size of each written file.
+    """
+    sizes = {}
+    # mtime is fixed so that unchanged content produces identical files.
+    sizes['.gz'] = atomic_write(f"{path}.gz",
+                                gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli:
+        sizes['.br'] = atomic_write(f"{path}.br",
+                                    brotli.compress(data, quality=11))
+    return sizes
+
+
+def _png_optimizer():
+    """Return the command of the available PNG optimizer."""
+    if shutil.which('oxipng'):
+        return ['oxipng', '--quiet', '--opt', '4', '--strip', 'safe']
+    if shutil.which('optipng'):
+        return ['optipng', '-quiet', '-o2']
+    return None
+
+
+def optimize_png(path, data):
+    """Losslessly optimize the given PNG file in place.
+
+    The optimized file is only kept if it is smaller. Returns the size of the
+    resulting file.
+    """
+    command = _png_optimizer()
+    tmp_path = f"{path}.opt.png"
+    try:
+        if command:
+            with open(tmp_path, 'wb') as file_handle:
+                file_handle.write(data)
+            subprocess.run(command + [tmp_path], check=True)
+        elif Image:
+            with Image.open(path) as image:
+                image.save(tmp_path, format='PNG', optimize=True)
+        else:
+            logging.debug("No PNG optimizer available for %s", path)
+            return len(data)
+        optimized_size = os.path.getsize(tmp_path)
+        if optimized_size < len(data):
+            os.replace(tmp_path, path)
+            return optimized_size
+        return len(data)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _process_file(path, previous):
+    """Process the file if its fingerprint changed.
+
+    Returns the new manifest entry and the sizes before and after processing
+    of each output suffix or None if the file is unchanged.
+    """
+    with open(path, 'rb') as file_handle:
+        data = file_handle.read()
+    digest = fingerprint(data)
+    if path.endswith(PNG_SUFFIX):
+        # Only the optimized file is up to date. A source that is written
+        # again with the bytes before the optimization is optimized again.
+        if previous and digest == previous.get('output'):
+            return None
+        size = optimize_png(path, data)
+        with open(path, 'rb') as file_handle:
+            output_digest = fingerprint(file_handle.read())
+        return ({'source': digest, 'output': output_digest},
+                {PNG_SUFFIX: (len(data), size)})
+    siblings_exist = all(os.path.exists(f"{path}{suffix}")
+                         for suffix in _text_siblings())
+    if previous == {'source': digest} and siblings_exist:
+        return None
+    sizes = compress_text(path, data)
+    return {'source': digest}, {suffix: (len(data), size)
+                                for suffix, size in sizes.items()}
+
+
+def _text_siblings():
+    return ['.gz', '.br'] if brotli else ['.gz']
+
+
+def _candidates(directory, png, text):
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('.'):
+            continue
+        if ((text and name.endswith(TEXT_SUFFIXES)) or
+                (png and name.endswith(PNG_SUFFIX))):
+            yield name
+
+
+def postprocess(directories, png=False, text=True,
+                max_workers=DEFAULT_WORKERS):
+    """Compress the text files if text is True and optimize the PNG files if
+    png is True in the given directories.
+
+    Only files whose fingerprint changed since the previous run are processed.
+    Returns the statistics of the run.
+    """
+    start = timer()
+    if text and brotli is None:
+        logging.warning("brotli is not installed, only the gzip copies of the "
+                        "text files are written. Install the compress extra "
+                        "to write the brotli copies")
+    stats = {'processed': 0, 'skipped': 0, 'sizes': {}}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for directory in directories:
+            if not os.path.isdir(directory):
+                continue
+            manifest = load_manifest(directory)
+            names = list(_candidates(directory, png, text))
+            futures = [
+                executor.submit(_process_file, os.path.join(directory, name),
+                                manifest.get(name))
+                for name in names]
+            for name, future in zip(names, futures):
+                result = future.result()
+                if result is None:
+                    stats['skipped'] += 1
+                    continue
+                manifest[name], sizes = result
+                stats['processed'] += 1
+                for suffix, (original, size) in sizes.items():
+                    totals = stats['sizes'].setdefault(suffix, [0, 0])
+                    totals[0] += original
+                    totals[1] += size
+            save_manifest(directory, manifest)
+    stats['seconds'] = timer() - start
+    log_stats(stats)
+    return stats
+
+
+def log_stats(stats):
+    """Log the size reduction and the compression time."""
+    logging.info("Compressed %d files, %d unchanged files skipped in %s",
+                 stats['processed'], stats['skipped'],
+                 timedelta(seconds=stats['seconds']))
+    for suffix, (original, size) in sorted(stats['sizes'].items()):
+        logging.info("Output %s: %.2f MB -> %.2f MB (%.1f%% reduction)",
+                     suffix, original / 1e6, size / 1e6,
+                     100 * (1 - size / original) if original else 0)
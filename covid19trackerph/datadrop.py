@@ -9,18 +9,27 @@ This module will download the latest data to the 'data' directory.
 
 import os
 import sys
+import json
+import hashlib
 import logging
 import pickle
+import random
 import re
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from timeit import default_timer as timer
 
-import requests
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from googleapiclient import errors
-from googleapiclient.http import MediaIoBaseDownload
-import PyPDF2
+
+from covid19trackerph import tracing
+
+# The Google API client, the OAuth flow, PyPDF2 and requests take most of a
+# second to import. These are imported where they are used so that the runs
+# that skip the download do not pay for them.
+# pylint: disable=import-outside-toplevel
 
 
 CLIENT_KEY_PATH = "client_secret.json"
@@ -29,6 +38,26 @@ ACCESS_SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 DOH_README_FOLDER_ID = '1ZPPcVU4M7T-dtRyUceb0pMAd8ickYf8o'
 README_FILE_NAME = "READ ME FIRST.pdf"
 DATA_DIR = "data"
+# Number of files downloaded at the same time.
+DEFAULT_DOWNLOAD_WORKERS = 4
+# Size of each chunk requested from Google Drive.
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+# Files are downloaded to a partial file first so these can be resumed.
+PARTIAL_SUFFIX = ".part"
+# Retries of a failed chunk and the exponential backoff delays in seconds.
+DEFAULT_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# These do not follow the naming convention of the rest of the files.
+ODDBALL_FILES = ["Changelog.xlsx", "DOH Data Drop.xlsx"]
+# Drive metadata of the downloaded files. Saved in the data directory.
+MANIFEST_FILE = "datadrop-manifest.json"
+DATA_FILE_FIELDS = "id, name, md5Checksum, size, modifiedTime"
+# Maximum page size allowed by the Drive API.
+LIST_PAGE_SIZE = 1000
+README_FIELDS = "id, name, md5Checksum, modifiedTime"
+# Timeout in seconds of the data drop link redirect lookup.
+URL_TIMEOUT = 30
 
 
 class RemoteFileNotFoundError(Exception):
@@ -39,8 +68,14 @@ class PDFParsingError(Exception):
     """Failed to parse PDF file"""
 
 
-def build_gdrive_service(credentials_path, token_path, scopes):
+class IntegrityError(Exception):
+    """Downloaded file does not match the Google Drive metadata"""
+
+
+def get_credentials(credentials_path, token_path, scopes):
     """ This function is derived from the Google Drive API quickstart guide. """
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
     credentials = None
     # The file token.pickle stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
@@ -58,7 +93,27 @@ def build_gdrive_service(credentials_path, token_path, scopes):
         # Save the credentials for the next run
         with open(token_path, 'wb') as token:
             pickle.dump(credentials, token)
-    return build('drive', 'v3', credentials=credentials)
+    return credentials
+
+
+def gdrive_service_factory(credentials, http_transport=None):
+    """Return a function that builds a new Google Drive service.
+
+    The service objects are not thread safe so each download thread needs its
+    own service. If http_transport is given, the services share its pooled
+    session instead of opening their own connections.
+    """
+    from googleapiclient.discovery import build
+    if http_transport is None:
+        return lambda: build('drive', 'v3', credentials=credentials)
+    return lambda: build('drive', 'v3', http=http_transport.http())
+
+
+def build_gdrive_service(credentials_path, token_path, scopes):
+    """Build the Google Drive service."""
+    from googleapiclient.discovery import build
+    return build('drive', 'v3', credentials=get_credentials(
+        credentials_path, token_path, scopes))
 
 
 def get_gdrive_id(url):
@@ -88,121 +143,550 @@ def trim_oddball_file_name(name):
     return re.sub(r"(.* \d{8} - )", r"", name)
 
 
-def download_gdrive_file(drive_service, file_id, download_path):
-    """Download the Google Drive file for the given file id."""
+def data_file_name(item_file_name):
+    """Return the local file name of the given data drop file name."""
+    if "READ ME" in item_file_name:
+        return trim_readme_name(item_file_name)
+    if any(x in item_file_name for x in ODDBALL_FILES):
+        return trim_oddball_file_name(item_file_name)
+    return trim_data_file_name(item_file_name)
+
+
+def backoff_delay(attempt):
+    """Return the delay in seconds before the given retry attempt.
+
+    The delay grows exponentially with a random jitter so that concurrent
+    downloads do not retry at the same time.
+    """
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def is_retryable(error):
+    """Check if the download can be retried after the given error."""
+    if isinstance(error, errors.HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    import httplib2
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+
+def fetch_range(request, start, end):
+    """Fetch the given byte range of a media request.
+
+    Returns the content and the total size of the file.
+    """
+    headers = dict(request.headers)
+    headers['range'] = f"bytes={start}-{end}"
+    resp, content = request.http.request(request.uri, 'GET', headers=headers)
+    if resp.status in [200, 206]:
+        if resp.status == 200 and start > 0:
+            # The range was ignored and the whole file was sent.
+            content = content[start:end + 1]
+        if 'content-range' in resp:
+            return content, int(resp['content-range'].rsplit('/', 1)[1])
+        if 'content-length' in resp:
+            return content, int(resp['content-length'])
+        return content, start + len(content)
+    if resp.status == 416:
+        # Range Not Satisfiable: the file is empty or already complete.
+        return b"", int(resp['content-range'].rsplit('/', 1)[1])
+    raise errors.HttpError(resp, content, uri=request.uri)
+
+
+def _hash_partial(partial_path):
+    """Return the MD5 hash and size of the partially downloaded file."""
+    md5 = hashlib.md5()
+    size = 0
+    with open(partial_path, 'rb') as file_handle:
+        for block in iter(lambda: file_handle.read(1024 * 1024), b""):
+            md5.update(block)
+            size += len(block)
+    return md5, size
+
+
+def download_gdrive_file(drive_service, file_id, download_path,
+                         chunksize=DEFAULT_CHUNK_SIZE, expected_size=None,
+                         expected_md5=None, retries=DEFAULT_RETRIES):
+    """Download the Google Drive file for the given file id.
+
+    The file is downloaded to a partial file next to the download path. A
+    partial file left by an interrupted download is resumed from where it
+    stopped. Failed chunks are retried with exponential backoff. When the
+    expected size and MD5 checksum are given, the file is verified before it
+    is renamed to the download path. A resumed file that does not match may
+    be left from an older version of the file so it is downloaded again from
+    the start once.
+
+    Returns the number of bytes downloaded.
+    """
+    # pylint: disable=too-many-arguments
+    partial_path = f"{download_path}{PARTIAL_SUFFIX}"
+    resumed = os.path.exists(partial_path)
+    try:
+        return _download_gdrive_file(drive_service, file_id, download_path,
+                                     partial_path, chunksize, expected_size,
+                                     expected_md5, retries)
+    except IntegrityError as error:
+        if not resumed:
+            raise
+        # verify_download removed the partial file.
+        logging.warning("Downloading %s again from the start: %s",
+                        download_path, error)
+    return _download_gdrive_file(drive_service, file_id, download_path,
+                                 partial_path, chunksize, expected_size,
+                                 expected_md5, retries)
+
+
+def _download_gdrive_file(drive_service, file_id, download_path, partial_path,
+                          chunksize, expected_size, expected_md5, retries):
+    # pylint: disable=too-many-arguments,too-many-locals
+    md5, offset = hashlib.md5(), 0
+    if os.path.exists(partial_path):
+        md5, offset = _hash_partial(partial_path)
+        if expected_size is not None and offset > expected_size:
+            logging.warning("Discarding oversized partial file %s",
+                            partial_path)
+            os.remove(partial_path)
+            md5, offset = hashlib.md5(), 0
+        else:
+            logging.info("Resuming %s from %.1f MB", download_path,
+                         offset / 1e6)
+    resumed_from = offset
     request = drive_service.files().get_media(fileId=file_id)
-    with open(download_path, 'wb+') as file_handle:
-        downloader = MediaIoBaseDownload(file_handle, request)
-        done = False
-        logging.info("Downloading %s", download_path)
-        while done is False:
-            status, done = downloader.next_chunk()
-            logging.info("Downloading %d%%.", int(status.progress() * 100))
+    start = timer()
+    total = expected_size
+    attempt = 0
+    logging.info("Downloading %s", download_path)
+    with open(partial_path, 'ab') as file_handle, tracing.span(
+            'download_file', 'datadrop', path=download_path,
+            resumed_from=offset):
+        while total is None or offset < total:
+            try:
+                with tracing.span('fetch_range', 'datadrop', offset=offset):
+                    content, total = fetch_range(request, offset,
+                                                 offset + chunksize - 1)
+            except Exception as error:  # pylint: disable=broad-except
+                attempt += 1
+                if attempt > retries or not is_retryable(error):
+                    raise
+                delay = backoff_delay(attempt)
+                logging.warning("Retrying %s in %.1fs after error: %s",
+                                download_path, delay, error)
+                time.sleep(delay)
+                continue
+            attempt = 0
+            if not content:
+                break
+            file_handle.write(content)
+            md5.update(content)
+            offset += len(content)
+            logging.debug("Downloading %s %d%%.", download_path,
+                          int(offset * 100 / total) if total else 100)
+    with tracing.span('verify_download', 'datadrop', path=download_path):
+        verify_download(partial_path, offset, md5.hexdigest(), expected_size,
+                        expected_md5)
+    os.replace(partial_path, download_path)
+    size = offset - resumed_from
+    elapsed = timer() - start
+    logging.info("Downloaded %s (%.1f MB) in %s", download_path, size / 1e6,
+                 timedelta(seconds=elapsed))
+    return size
+
+
+def verify_download(partial_path, size, md5, expected_size=None,
+                    expected_md5=None):
+    """Verify the downloaded file against the Drive metadata.
+
+    The partial file is removed if it does not match since it cannot be
+    resumed.
+    """
+    mismatch = None
+    if expected_size is not None and size != expected_size:
+        mismatch = f"size {size} != {expected_size}"
+    elif expected_md5 and md5 != expected_md5:
+        mismatch = f"MD5 {md5} != {expected_md5}"
+    if mismatch:
+        os.remove(partial_path)
+        raise IntegrityError(f"Downloaded {partial_path} {mismatch}")
+
+
+def readme_request(drive_service):
+    """Return the request that lists the READ ME file"""
+    return drive_service.files().list(
+        q=("mimeType='application/pdf' and name contains 'READ ME' and "
+           f"parents in '{DOH_README_FOLDER_ID}' and trashed = false"),
+        fields=f"files({README_FIELDS})",
+        supportsAllDrives=True,
+        includeItemsFromAllDrives=True)
 
 
-def get_readme_id(drive_service):
-    """Get the file id of the READ ME file"""
-    results = drive_service.files().list(
-        q=("mimeType='application/pdf' and name contains 'READ ME' and"
-           f"arents in '{DOH_README_FOLDER_ID}' and trashed = false"),
-        fields="nextPageToken, files(id, name)",
-        supportsAllDrives=True,
-        includeItemsFromAllDrives=True).execute()
+def get_readme(drive_service, results=None):
+    """Get the Drive metadata of the READ ME file
+
+    results is the response of readme_request if it was already executed.
+    """
+    if results is None:
+        results = readme_request(drive_service).execute()
     items = results.get('files', [])
     # We expect only one file in the folder.
     if len(items) > 1:
         logging.warning("The READ ME contents have changed.")
     for item in items:
         logging.info("Found file: %s", item['name'])
-        return item['id']
+        return item
     raise RemoteFileNotFoundError("DOH Readme Not Found")
 
 
-def list_data_files(drive_service, folder_id):
-    """Get a list of data files for the given folder id"""
-    results = drive_service.files().list(
+def get_readme_id(drive_service):
+    """Get the file id of the READ ME file"""
+    return get_readme(drive_service)['id']
+
+
+def list_request(drive_service, folder_id, page_size=LIST_PAGE_SIZE,
+                 page_token=None):
+    """Return the request for a page of the files in the given folder id"""
+    return drive_service.files().list(
         q=f"parents in '{folder_id}' and trashed = false",
-        fields="nextPageToken, files(id, name)",
+        fields=f"nextPageToken, files({DATA_FILE_FIELDS})",
+        pageSize=page_size,
+        pageToken=page_token,
         supportsAllDrives=True,
-        includeItemsFromAllDrives=True).execute()
-    items = results.get('files', [])
-    if not items:
-        raise RemoteFileNotFoundError(
-            f"No files listed in folder ID: {folder_id}")
+        includeItemsFromAllDrives=True)
+
+
+def list_data_files(drive_service, folder_id, page_size=LIST_PAGE_SIZE,
+                    first_page=None):
+    """Get a list of data files for the given folder id
+
+    The files are yielded as each page of the listing arrives so that the
+    downloads can start before the listing is done. first_page is the
+    response of the first list_request if it was already executed.
+    """
+    page_token = None
+    found = False
     while True:
-        for item in items:
+        if first_page is not None:
+            results, first_page = first_page, None
+        else:
+            with tracing.span('list_page', 'datadrop'):
+                results = list_request(drive_service, folder_id, page_size,
+                                       page_token).execute()
+        for item in results.get('files', []):
+            found = True
             logging.info("Found file: %s", item['name'])
             yield item
-        if results.get('nextPageToken', None) is None:
+        page_token = results.get('nextPageToken', None)
+        if page_token is None:
             break
+    if not found:
+        raise RemoteFileNotFoundError(
+            f"No files listed in folder ID: {folder_id}")
 
 
-def download_data_files(drive_service, folder_id):
-    """Download the data files from the given Google Drive folder id"""
+def batch_execute(drive_service, drive_requests):
+    """Send the given Drive requests in a single batch HTTP request.
+
+    Returns the responses in the order of the requests. The first error of
+    the batch is raised.
+    """
+    responses = {}
+
+    def callback(request_id, response, exception):
+        responses[request_id] = (response, exception)
+    batch = drive_service.new_batch_http_request(callback=callback)
+    for index, request in enumerate(drive_requests):
+        batch.add(request, request_id=str(index))
+    start = timer()
+    batch.execute()
+    logging.debug("Batch of %d requests in %.3fs", len(drive_requests),
+                  timer() - start)
+    results = []
+    for index in range(len(drive_requests)):
+        response, exception = responses[str(index)]
+        if exception is not None:
+            raise exception
+        results.append(response)
+    return results
+
+
+def load_manifest(data_dir=None):
+    """Load the manifest of the downloaded files."""
+    path = os.path.join(data_dir or DATA_DIR, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'files': {}, 'plotted': False}
+    with open(path, encoding='utf-8') as file_handle:
+        return json.load(file_handle)
+
+
+def save_manifest(manifest, data_dir=None):
+    """Save the manifest of the downloaded files."""
+    data_dir = data_dir or DATA_DIR
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file_handle:
+        json.dump(manifest, file_handle, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_unchanged(item, entry, download_path):
+    """Check if the remote file is the same as the downloaded file.
+
+    The checksum is compared when Drive provides one. Google Docs files do not
+    have a checksum so their modified time is compared instead.
+    """
+    if not entry or not os.path.exists(download_path):
+        return False
+    if 'size' in item and os.path.getsize(download_path) != int(item['size']):
+        return False
+    if item.get('md5Checksum'):
+        return item['md5Checksum'] == entry.get('md5Checksum')
+    return bool(item.get('modifiedTime')) and (
+        item['modifiedTime'] == entry.get('modifiedTime'))
+
+
+def mark_plotted(plotted=True):
+    """Record whether the charts were generated from the downloaded files."""
+    manifest = load_manifest()
+    manifest['plotted'] = plotted
+    save_manifest(manifest)
+
+
+def is_plotted():
+    """Check if the charts were generated from the downloaded files."""
+    return load_manifest().get('plotted', False)
+
+
+def download_data_files(drive_service, folder_id,
+                        workers=DEFAULT_DOWNLOAD_WORKERS,
+                        chunksize=DEFAULT_CHUNK_SIZE, service_factory=None,
+                        first_page=None, retries=DEFAULT_RETRIES):
+    """Download the data files from the given Google Drive folder id
+
+    The files are downloaded by a pool of threads as these are listed. Each
+    thread uses its own service from service_factory. If service_factory is
+    not given, the files are downloaded one at a time with drive_service.
+    Files that have not changed since they were last downloaded are skipped.
+    first_page is the first page of the listing if it was already fetched.
+    Each failed chunk is retried the given number of times. Returns the local
+    paths of the downloaded files.
+    """
+    # pylint: disable=too-many-arguments
     if not os.path.exists(DATA_DIR):
         os.mkdir(DATA_DIR)
-    items = list_data_files(drive_service, folder_id)
-    # These do not follow the naming convention of the rest of the files.
-    oddballs = ["Changelog.xlsx", "DOH Data Drop.xlsx"]
-    for item in items:
+    if service_factory is None:
+        workers = 1
+    thread_local = threading.local()
+    manifest = load_manifest()
+    manifest_lock = threading.Lock()
+
+    def thread_service():
+        if service_factory is None:
+            return drive_service
+        if not hasattr(thread_local, 'service'):
+            thread_local.service = service_factory()
+        return thread_local.service
+
+    def download_item(item):
         item_file_name = item['name']
-        if "READ ME" in item_file_name:
-            file_name = trim_readme_name(item_file_name)
-        elif any(x in item_file_name for x in oddballs):
-            file_name = trim_oddball_file_name(item_file_name)
-        else:
-            file_name = trim_data_file_name(item_file_name)
+        file_name = data_file_name(item_file_name)
         download_path = os.path.join(DATA_DIR, file_name)
+        with manifest_lock:
+            entry = manifest['files'].get(file_name)
+        if is_unchanged(item, entry, download_path):
+            logging.info("Skipping unchanged %s", item_file_name)
+            return None, 0
         try:
-            download_gdrive_file(drive_service, item['id'], download_path)
+            size = download_gdrive_file(
+                thread_service(), item['id'], download_path,
+                chunksize=chunksize,
+                expected_size=int(item['size']) if 'size' in item else None,
+                expected_md5=item.get('md5Checksum'), retries=retries)
         except errors.HttpError as error:
             if "Changelog" in item_file_name:
                 logging.info("Failed to download %s", item_file_name)
-            else:
-                raise error
+                return None, 0
+            raise error
+        with manifest_lock:
+            manifest['files'][file_name] = item
+            manifest['plotted'] = False
+        return download_path, size
+
+    start = timer()
+    downloaded = []
+    total_size = 0
+    items = list_data_files(drive_service, folder_id, first_page=first_page)
+    if service_factory is None:
+        # The service is not thread safe so list everything before the
+        # download thread starts using it.
+        items = list(items)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            try:
+                # Downloads are started while the next pages are listed.
+                for item in items:
+                    futures.append(executor.submit(download_item, item))
+                for future in as_completed(futures):
+                    download_path, size = future.result()
+                    if download_path:
+                        downloaded.append(download_path)
+                        total_size += size
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        # Keep the files that completed even if the others failed.
+        save_manifest(manifest)
+    log_throughput(len(downloaded), total_size, timer() - start)
+    return downloaded
+
+
+def log_throughput(count, size, elapsed):
+    """Log the aggregate download throughput."""
+    logging.info("Downloaded %d files (%.1f MB) in %s, %.2f MB/s", count,
+                 size / 1e6, timedelta(seconds=elapsed),
+                 size / 1e6 / elapsed if elapsed else 0)
 
 
 def extract_datadrop_link(filename):
     """Extract the data drop link from the given PDF file"""
+    import PyPDF2
     pdf = PyPDF2.PdfFileReader(filename)
     for page in range(pdf.numPages):
         logging.debug("Reading PDF page: %s", page)
-        pdf_page = pdf.getPage(page)
-        page_object = pdf_page.getObject()
-        if '/Annots' in page_object.keys():
-            annotations = page_object['/Annots']
-            for annotation in annotations:
-                urls = annotation.getObject()
-                if '/URI' in urls['/A'].keys():
-                    url = urls['/A']['/URI']
-                    logging.debug("URL: %s", url)
-                    if "DataDropArchives" not in url and "mailto:" not in url:
-                        return url
+        page_object = pdf.getPage(page).getObject()
+        for annotation in page_object.get('/Annots', []):
+            action = annotation.getObject().get('/A', {})
+            url = action.get('/URI')
+            if url is None:
+                continue
+            logging.debug("URL: %s", url)
+            if "DataDropArchives" not in url and "mailto:" not in url:
+                return url
     raise PDFParsingError(f"Failed to extract datadrop link from {filename}")
 
 
-def get_full_url(url):
+def get_full_url(url, http_transport=None):
     """Get full URL from the given URL"""
-    return requests.head(url).headers['location']
-
-
-def get_datadrop_url(drive_service):
-    """Get the data drop URL"""
-    readme_file_id = get_readme_id(drive_service)
-    download_gdrive_file(drive_service, readme_file_id, README_FILE_NAME)
-    extracted_url = extract_datadrop_link(README_FILE_NAME)
-    os.remove(README_FILE_NAME)
-    return extracted_url
-
-
-def download(folder_id=None):
-    """Download the data drop files"""
-    drive_service = build_gdrive_service(CLIENT_KEY_PATH, TOKEN, ACCESS_SCOPES)
+    if http_transport is not None:
+        return http_transport.head(url).headers['location']
+    import requests
+    return requests.head(url, timeout=URL_TIMEOUT).headers['location']
+
+
+def readme_key(readme):
+    """Return the Drive metadata that identifies a version of the README."""
+    return {key: readme.get(key) for key in ('id', 'modifiedTime',
+                                             'md5Checksum')}
+
+
+def resolve_folder_id(drive_service, readme=None, http_transport=None):
+    """Get the folder id of the latest data drop.
+
+    The folder id is extracted from the README file and saved in the manifest
+    together with the README version. The README is only downloaded and
+    parsed again once it has changed. readme is the Drive metadata of the
+    README if it was already listed.
+    """
+    readme = readme or get_readme(drive_service)
+    key = readme_key(readme)
+    cached = load_manifest().get('folder')
+    if cached and cached.get('readme') == key:
+        logging.info("Using the cached data drop folder ID %s",
+                     cached['folder_id'])
+        return cached['folder_id']
+    download_gdrive_file(drive_service, readme['id'], README_FILE_NAME)
+    try:
+        url = extract_datadrop_link(README_FILE_NAME)
+    finally:
+        os.remove(README_FILE_NAME)
+    # The link is usually a short URL that redirects to the folder.
+    folder_id = get_gdrive_id(url) or get_gdrive_id(
+        get_full_url(url, http_transport))
     if not folder_id:
-        datadrop_short_url = get_datadrop_url(drive_service)
-        datadrop_full_url = get_full_url(datadrop_short_url)
-        folder_id = get_gdrive_id(datadrop_full_url)
-    download_data_files(drive_service, folder_id)
+        raise PDFParsingError(f"No folder ID in data drop link {url}")
+    logging.info("Resolved the data drop folder ID %s", folder_id)
+    manifest = load_manifest()
+    manifest['folder'] = {'readme': key, 'folder_id': folder_id}
+    save_manifest(manifest)
+    return folder_id
+
+
+def lookup_folder(drive_service, http_transport=None):
+    """Get the folder id of the latest data drop and the first page of its
+    listing if it was fetched.
+
+    If a folder id was cached, the README is listed in the same batch request
+    as the first page of the cached folder. The page is used if the README
+    has not changed which saves a round trip.
+    """
+    cached = load_manifest().get('folder')
+    if not cached:
+        return resolve_folder_id(drive_service,
+                                 http_transport=http_transport), None
+    readme_results, first_page = batch_execute(drive_service, [
+        readme_request(drive_service),
+        list_request(drive_service, cached['folder_id'])])
+    readme = get_readme(drive_service, readme_results)
+    folder_id = resolve_folder_id(drive_service, readme, http_transport)
+    if folder_id != cached['folder_id']:
+        first_page = None
+    return folder_id, first_page
+
+
+def download(folder_id=None, workers=DEFAULT_DOWNLOAD_WORKERS,
+             chunksize=DEFAULT_CHUNK_SIZE, service_factory=None, retries=None):
+    """Download the data drop files
+
+    service_factory returns the Drive service of each download thread. By
+    default these are Google Drive services authorized with the client
+    secret. Any service with the parts of the Drive API used here, like
+    localdrive.LocalDrive, can be used instead.
+
+    retries is the number of retries of a failed chunk. By default, the
+    chunks are not retried with the Google Drive services since their pooled
+    transport already retries each request, and are retried DEFAULT_RETRIES
+    times with the services of service_factory.
+    """
+    # pylint: disable=too-many-arguments
+    if service_factory is not None:
+        return _download(service_factory, folder_id, workers, chunksize,
+                         retries=(DEFAULT_RETRIES if retries is None
+                                  else retries))
+    from covid19trackerph import transport
+    credentials = get_credentials(CLIENT_KEY_PATH, TOKEN, ACCESS_SCOPES)
+    # A connection for each download thread and one for the listing.
+    with transport.Transport(credentials,
+                             pool_size=workers + 1) as http_transport:
+        try:
+            # The pooled transport already retries every request so the
+            # chunks are not retried again on top of it.
+            return _download(
+                gdrive_service_factory(credentials, http_transport),
+                folder_id, workers, chunksize,
+                retries=0 if retries is None else retries,
+                http_transport=http_transport)
+        finally:
+            http_transport.stats.log()
+
+
+def _download(service_factory, folder_id, workers, chunksize, retries,
+              http_transport=None):
+    """Download the data drop files with the services of service_factory."""
+    # pylint: disable=too-many-arguments
+    with tracing.span('download', 'datadrop', workers=workers):
+        drive_service = service_factory()
+        first_page = None
+        if not folder_id:
+            with tracing.span('lookup_folder', 'datadrop'):
+                folder_id, first_page = lookup_folder(drive_service,
+                                                      http_transport)
+        return download_data_files(drive_service, folder_id,
+                                   workers=workers, chunksize=chunksize,
+                                   service_factory=service_factory,
+                                   first_page=first_page, retries=retries)
 
 
 def main():
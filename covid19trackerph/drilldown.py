@@ -0,0 +1,296 @@
+"""
+Drill-down pages of each region and city or municipality.
+
+Filtering the case information and running the national chart functions for
+each of the 1,600+ areas would group the whole data set again for every
+area. Instead, the daily confirmed, recovered, died and active counts of all
+of the areas of a level are aggregated with one groupby per series and the
+aggregate is partitioned by area with its groupby indices. Each area then
+only slices its rows out of the shared aggregate.
+
+The pages are rendered in batches by the task graph in the worker pool, the
+largest areas first. If a time budget is given, no batch is started once it
+runs out and the remaining areas are rendered in the next run. The
+fingerprint of the series of each rendered area is kept in a manifest in the
+data directory so that the next run only renders the areas whose data
+changed.
+
+The charts, tables and pages of each level are kept in their own
+directories since the names of the regions and of the cities or
+municipalities can have the same slug.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import unicodedata
+
+import pandas as pd
+import plotly.graph_objects as go
+
+from covid19trackerph import outputsink
+from covid19trackerph import taskgraph
+from covid19trackerph import tracing
+from covid19trackerph import trackerchart as tc
+
+
+# The keys of the areas of each level. The municipalities are keyed by
+# province too since their names are not unique. The cases without a province
+# or city/municipality are only in the region pages.
+AREA_LEVELS = {
+    'regions': [tc.REGION],
+    'municipalities': [tc.REGION, 'ProvRes', tc.CITY_MUN],
+}
+NO_DATA = 'No Data'
+SERIES = ['Confirmed', 'Active', 'Recovered', 'Deaths']
+# Sub-directory of the charts and tables of the areas.
+AREA_DIR = "areas"
+PAGE_OUTPUT = os.path.join(tc.SCRIPT_DIR, "tracker", "areas")
+PAGE_LAYOUT = "tracker_area"
+# Fingerprints of the rendered areas. Saved in the data directory.
+MANIFEST = "drilldown-manifest.json"
+# Number of areas rendered by each task.
+BATCH_SIZE = 25
+
+
+def daily_counts(ci_data, keys):
+    """Return the daily counts of SERIES of every area with the given keys,
+    indexed by the keys and the date.
+
+    The cases are confirmed on their onset date, recovered and died on the
+    date of their recovery and death, and are active until they are
+    closed.
+    """
+    closed = tc.filter_case_status(ci_data, 'CLOSED')
+    counts = {
+        'Confirmed': ci_data.groupby(keys + ['DateOnset']).size(),
+        'Recovered': tc.filter_recovered(ci_data).groupby(
+            keys + ['DateRecover']).size(),
+        'Deaths': tc.filter_died(ci_data).groupby(keys + ['DateDied']).size(),
+        'Closed': closed.groupby(keys + [tc.DATE_CLOSED]).size(),
+    }
+    for series in counts.values():
+        series.index = series.index.set_names(keys + ['date'])
+    daily = pd.concat(counts, axis=1).fillna(0).astype(int).sort_index()
+    cumulative = daily.groupby(level=keys).cumsum()
+    daily['Active'] = cumulative['Confirmed'] - cumulative['Closed']
+    return daily[SERIES]
+
+
+def slugify(text):
+    """Return the lower case file name of the text. The accented letters
+    are replaced by their ASCII letters, e.g. PARAÑAQUE is paranaque."""
+    text = unicodedata.normalize('NFKD', str(text)).encode(
+        'ascii', 'ignore').decode('ascii')
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def area_info(level, key):
+    """Return the slug, title, region and level of an area from its key."""
+    if level == 'regions':
+        return {'level': level, 'slug': slugify(key), 'title': key,
+                'region': key}
+    region, province, city = key
+    return {'level': level, 'slug': slugify(f"{province} {city}"),
+            'title': f"{city}, {province}", 'region': region}
+
+
+def fingerprint(series):
+    """Return the hash of the data of an area."""
+    return hashlib.sha1(
+        pd.util.hash_pandas_object(series).to_numpy().tobytes()).hexdigest()
+
+
+def chart_name(area):
+    """Return the name of the chart and the table of the area."""
+    return f"{AREA_DIR}/{area['level']}/{area['slug']}"
+
+
+def page_path(area):
+    """Return the path of the page of the area."""
+    return os.path.join(PAGE_OUTPUT, area['level'], f"{area['slug']}.md")
+
+
+def render_page(area):
+    """Return the Jekyll page of the area."""
+    name = chart_name(area)
+    return (f"---\n"
+            f"layout: {PAGE_LAYOUT}\n"
+            f"title: \"{area['title']}\"\n"
+            f"description: \"COVID-19 cases in {area['title']}\"\n"
+            f"chart: \"{name}\"\n"
+            f"table: \"tracker/charts/{name}.html\"\n"
+            f"---\n\n"
+            f"Region: {area['region']}\n\n"
+            f"[All regions and cities/municipalities]"
+            f"({{{{ 'tracker/areas' | relative_url }}}})\n")
+
+
+def plot_area(area, series):
+    """Write the chart, the summary table and the page of an area.
+
+    The figure is built from graph objects since plotly express takes about
+    ten times as long, which adds up over all of the areas.
+    """
+    name = chart_name(area)
+    fig = go.Figure([go.Scatter(x=series.index, y=series[column].to_numpy(),
+                                mode='lines', name=column)
+                     for column in SERIES])
+    fig.update_layout(title=f"Daily Cases in {area['title']}",
+                      xaxis_title="Date", yaxis_title="Cases")
+    tc.write_chart(fig, name)
+    header = ['Statistic', 'Total']
+    body = [["Confirmed Cases", f"{series['Confirmed'].sum():,}"],
+            ["Active Cases", f"{series['Active'].iloc[-1]:,}"],
+            ["Recoveries", f"{series['Recovered'].sum():,}"],
+            ["Deaths", f"{series['Deaths'].sum():,}"],
+            ["Last Onset", series.index.max().strftime("%Y-%m-%d")]]
+    tc.write_table(header, body, name)
+    page = render_page(area)
+    tc.get_output_sink().submit(page_path(area), lambda: page)
+
+
+def plot_area_batch(batch):
+    """Write the pages of the (area, series) pairs of a batch."""
+    for area, series in batch:
+        plot_area(area, series)
+
+
+def render_index(areas):
+    """Return the Jekyll page that links to the pages of the given
+    areas."""
+    def link(area):
+        url = f"tracker/areas/{area['level']}/{area['slug']}"
+        return f"* [{area['title']}]({{{{ '{url}' | relative_url }}}})\n"
+    regions = sorted((area for area in areas if area['level'] == 'regions'),
+                     key=lambda area: area['title'])
+    lines = ["---\n", "layout: tracker_default\n",
+             "title: \"Regions and Cities/Municipalities\"\n",
+             "description: \"COVID-19 cases by area\"\n", "---\n\n",
+             "## Regions\n\n"]
+    lines.extend(link(area) for area in regions)
+    lines.append("\n## Cities and Municipalities\n")
+    municipalities = sorted(
+        (area for area in areas if area['level'] == 'municipalities'),
+        key=lambda area: (area['region'], area['title']))
+    region = None
+    for area in municipalities:
+        if area['region'] != region:
+            region = area['region']
+            lines.append(f"\n### {region}\n\n")
+        lines.append(link(area))
+    return "".join(lines)
+
+
+def load_manifest(path):
+    """Load the fingerprints of the rendered areas."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as file_handle:
+            return json.load(file_handle)
+    except ValueError:
+        logging.warning("Ignoring invalid drill-down manifest %s", path)
+        return {}
+
+
+def save_manifest(path, manifest):
+    """Save the fingerprints of the rendered areas."""
+    outputsink.atomic_write(path, json.dumps(manifest, indent=1,
+                                             sort_keys=True))
+
+
+def is_rendered(area, digest, manifest):
+    """Check if the files of the area are up to date with its data."""
+    entry = manifest.get(f"{area['level']}/{area['slug']}")
+    chart = os.path.join(tc.CHART_OUTPUT,
+                         f"{chart_name(area)}.{tc.output_formats[0]}")
+    return (entry is not None and entry['fingerprint'] == digest and
+            os.path.exists(chart) and os.path.exists(page_path(area)))
+
+
+def build_area_graph(ci_data, manifest):
+    """Create the task graph of the areas that are not up to date.
+
+    Returns the graph, the areas of each task with their fingerprints and
+    all of the areas by their manifest key.
+    """
+    graph = taskgraph.TaskGraph()
+    batches = {}
+    areas = {}
+    for level, keys in AREA_LEVELS.items():
+        known = (ci_data[keys[1:]] != NO_DATA).all(axis=1)
+        with tracing.span('area_counts', level=level):
+            daily = daily_counts(ci_data[known], keys)
+            partitions = daily.groupby(level=keys).indices
+        changed = []
+        for key, positions in partitions.items():
+            area = area_info(level, key)
+            if f"{level}/{area['slug']}" in areas:
+                # Keep the page of each area apart, e.g. for names that
+                # only differ in their punctuation.
+                area['slug'] += "-" + hashlib.sha1(
+                    repr(key).encode()).hexdigest()[:8]
+                logging.warning("Slug of %s collides with another area, "
+                                "using %s", key, area['slug'])
+            series = daily.iloc[positions].droplevel(keys)
+            digest = fingerprint(series)
+            areas[f"{level}/{area['slug']}"] = area
+            if not is_rendered(area, digest, manifest):
+                changed.append((area, series, digest))
+        # The largest areas go first so that these are rendered within the
+        # time budget.
+        changed.sort(key=lambda item: -item[1]['Confirmed'].sum())
+        logging.info("%d of %d %s changed", len(changed), len(partitions),
+                     level)
+        for start in range(0, len(changed), BATCH_SIZE):
+            batch = changed[start:start + BATCH_SIZE]
+            name = f"{level}[{start}:{start + len(batch)}]"
+            graph.add(name, tc.run_task, plot_area_batch,
+                      [(area, series) for area, series, _ in batch],
+                      kind='area', cost=len(batch))
+            batches[name] = [(area, digest) for area, _, digest in batch]
+    return graph, batches, areas
+
+
+def generate(ci_data, pool, data_dir, budget=None, rebuild=False):
+    """Render the pages of the areas whose data changed in the pool and
+    return the number of rendered and of remaining areas.
+
+    If budget is given, no more pages are started after that many seconds.
+    The pool must be created by trackerchart.create_pool.
+    """
+    start = time.time()
+    manifest_path = os.path.join(data_dir, MANIFEST)
+    manifest = {} if rebuild else load_manifest(manifest_path)
+    for level in AREA_LEVELS:
+        os.makedirs(os.path.join(PAGE_OUTPUT, level), exist_ok=True)
+        for directory in [tc.CHART_OUTPUT, tc.TABLE_OUTPUT]:
+            os.makedirs(os.path.join(directory, AREA_DIR, level),
+                        exist_ok=True)
+    with tracing.span('drilldown'):
+        graph, batches, areas = build_area_graph(ci_data, manifest)
+        if graph.tasks:
+            results = graph.run(pool, workers=pool.workers,
+                                deadline=start + budget if budget else None)
+        else:
+            results = {}
+    rendered = 0
+    for name in results:
+        for area, digest in batches[name]:
+            manifest[f"{area['level']}/{area['slug']}"] = {
+                'fingerprint': digest}
+            rendered += 1
+    # The areas that are no longer in the data are dropped.
+    manifest = {key: entry for key, entry in manifest.items()
+                if key in areas}
+    save_manifest(manifest_path, manifest)
+    outputsink.atomic_write(os.path.join(PAGE_OUTPUT, "index.md"),
+                            render_index([areas[key] for key in manifest]))
+    remaining = sum(len(batches[name]) for name in graph.skipped)
+    logging.info("Rendered %d area pages in %.1fs, %d left for the next run",
+                 rendered, time.time() - start, remaining)
+    return rendered, remaining
@@ -0,0 +1,341 @@
+"""
+The engines that prepare and aggregate the tracker data.
+
+The pandas engine runs the reference implementations of trackerchart. The
+other engines compute the same data some other way, usually faster, and are
+checked against the reference with the verify module before these are used
+for the published charts. An engine is registered by name with register.
+
+The polars engine is only registered when polars and pyarrow are installed.
+It reads, derives and aggregates the data as lazy Polars queries so that only
+the columns and rows that are needed are read and the work is spread over
+the threads of Polars. The data is handed over as pandas data frames so the
+charts are plotted the same way with every engine.
+"""
+
+import pathlib
+import functools
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from covid19trackerph import trackerchart as tc
+from covid19trackerph import tracing
+
+try:
+    import polars as pl
+    # Needed to convert the frames from and to pandas.
+    import pyarrow  # pylint: disable=unused-import
+except ImportError:  # pragma: no cover - depends on the environment
+    pl = None
+
+
+ENGINES = {}
+
+
+def register(engine):
+    """Register the engine under its name and return it."""
+    ENGINES[engine.name] = engine
+    return engine
+
+
+def get_engine(name):
+    """Return the registered engine of the given name."""
+    try:
+        return ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown engine: {name}, choose from "
+                         f"{', '.join(sorted(ENGINES))}") from None
+
+
+def read_files(data_dir, name):
+    """Read the files of the named data set of trackerchart.DATA_SOURCES in
+    the data directory.
+
+    Unlike trackerchart.prepare_data, no cache is written to the data
+    directory.
+    """
+    file_pattern, _ = tc.DATA_SOURCES[name]
+    paths = sorted(pathlib.Path(data_dir).glob(file_pattern))
+    if not paths:
+        raise FileNotFoundError(f"No {file_pattern} files in {data_dir}")
+    return pd.concat(map(pd.read_csv, paths))
+
+
+class PandasEngine:
+    """The reference engine."""
+
+    name = 'pandas'
+
+    def prepare(self, name, data, pool=None):
+        """Return the named data set of trackerchart.DATA_SOURCES prepared
+        from its files."""
+        if name == 'ci_data':
+            return self.calc_case_info_data(data, pool)
+        return self.calc_testing_aggregates_data(data, pool)
+
+    def load_data(self, name, data_dir, rebuild=False, pool=None):
+        """Read and prepare the named data set of trackerchart.DATA_SOURCES
+        in the data directory. See trackerchart.load_data.
+
+        The prepared data is cached in the data directory.
+        """
+        return tc.load_data(name, data_dir, rebuild, pool)
+
+    def calc_case_info_data(self, data, pool=None):
+        """Return the prepared Case Information. See
+        trackerchart.calc_case_info_data."""
+        return tc.apply_parallel(data, tc.calc_case_info_data, pool)
+
+    def calc_testing_aggregates_data(self, data, pool=None):
+        """Return the prepared Testing Aggregates. See
+        trackerchart.calc_testing_aggregates_data."""
+        return tc.apply_parallel(data, tc.calc_testing_aggregates_data, pool)
+
+    def agg_count_cumsum_by_date(self, data, cumsum, group, date):
+        """See trackerchart.agg_count_cumsum_by_date."""
+        return tc.agg_count_cumsum_by_date(data, cumsum, group, date)
+
+    def summary_metrics(self, ci_data, test_data):
+        """See trackerchart.summary_metrics."""
+        return tc.summary_metrics(ci_data, test_data)
+
+
+@tracing.traced()
+def calc_case_info_data_vectorized(data):
+    """Calculate the same columns as trackerchart.calc_case_info_data with
+    column operations instead of row-wise applies.
+
+    The quirks of the reference are kept: a missing DateRepConf is not
+    reported as 'Incomplete' since NaT is truthy, and the dates are compared
+    as-is so that a missing date never matches.
+    """
+    tc.clean_case_info_data(data)
+    max_date_rep_conf = data.DateRepConf.max()
+    specimen = data['DateSpecimen']
+    rep_conf = data['DateRepConf']
+    release = data['DateResultRelease']
+    with tracing.span('reporting_delays'):
+        data['SpecimenToRepConf'] = (rep_conf - specimen).dt.days.where(
+            specimen < rep_conf)
+        data['SpecimenToRelease'] = (release - specimen).dt.days.where(
+            specimen < release)
+        data['ReleaseToRepConf'] = (rep_conf - release).dt.days.where(
+            release < rep_conf)
+    with tracing.span('onset_proxy'):
+        onset = data['DateOnset']
+        data[tc.ONSET_PROXY] = np.select(
+            [onset.notna(), specimen.notna()],
+            ['No Proxy', 'DateSpecimen'], 'DateRepConf')
+        data['DateOnset'] = onset.fillna(specimen).fillna(rep_conf)
+    with tracing.span('recover_proxy'):
+        recover = data['DateRecover']
+        data[tc.RECOVER_PROXY] = np.where(
+            recover.notna(), 'No Proxy',
+            np.where(data[tc.ONSET_PROXY] == 'No Proxy', 'DateOnset+14',
+                     data[tc.ONSET_PROXY] + '+14'))
+        proxy = data['DateOnset'] + timedelta(days=14)
+        proxy = proxy.where(proxy < max_date_rep_conf, max_date_rep_conf)
+        data['DateRecover'] = recover.where(recover.notna(), proxy)
+    with tracing.span('case_report_type'):
+        data[tc.CASE_REP_TYPE] = np.where(rep_conf == max_date_rep_conf,
+                                          'New Case', 'Previous Case')
+    with tracing.span('case_status'):
+        closed = data['HealthStatus'].isin(["RECOVERED", "DIED"])
+        data[tc.CASE_STATUS] = np.where(closed, 'CLOSED', 'ACTIVE')
+        data[tc.DATE_CLOSED] = data['DateDied'].where(
+            data['HealthStatus'] == 'DIED', data['DateRecover'])
+    with tracing.span('region'):
+        data['Region'] = data['RegionRes'].str.split(':').str[0].fillna(
+            'No Data')
+    return data
+
+
+class VectorizedEngine(PandasEngine):
+    """Prepares the Case Information with column operations in the current
+    process."""
+
+    name = 'vectorized'
+
+    def calc_case_info_data(self, data, pool=None):
+        """Return the prepared Case Information. The pool is not used since
+        splitting the data costs more than the column operations."""
+        # pylint: disable=unused-argument
+        return calc_case_info_data_vectorized(data)
+
+    def load_data(self, name, data_dir, rebuild=False, pool=None):
+        """Read and prepare the named data set of trackerchart.DATA_SOURCES
+        in the data directory.
+
+        The files are prepared on every call since the cache of
+        trackerchart.load_data holds the data prepared by the reference.
+        """
+        # pylint: disable=unused-argument
+        return self.prepare(name, read_files(data_dir, name), pool)
+
+
+def scan_files(data_dir, name):
+    """Return the lazy frame of the files of the named data set of
+    trackerchart.DATA_SOURCES in the data directory.
+
+    The dates of the Case Information are read as text and parsed by
+    case_info_plan.
+    """
+    file_pattern, _ = tc.DATA_SOURCES[name]
+    paths = sorted(pathlib.Path(data_dir).glob(file_pattern))
+    if not paths:
+        raise FileNotFoundError(f"No {file_pattern} files in {data_dir}")
+    schema = ({column: pl.Utf8 for column in tc.CASE_DATE_COLUMNS}
+              if name == 'ci_data' else {'report_date': pl.Utf8})
+    return pl.concat([pl.scan_csv(path, schema_overrides=schema,
+                                  infer_schema_length=None)
+                      for path in paths], how='diagonal_relaxed')
+
+
+def parse_dates(*columns):
+    """Return the expressions that parse the text columns as dates. Invalid
+    dates are null like with pandas.to_datetime(errors='coerce')."""
+    return [pl.col(column).cast(pl.Utf8).str.to_datetime(
+        strict=False, time_unit='ns') for column in columns]
+
+
+def days_between(start, end):
+    """Return the expression of the days from start to end, null unless
+    start is before end."""
+    return pl.when(pl.col(start) < pl.col(end)).then(
+        (pl.col(end) - pl.col(start)).dt.total_days().cast(pl.Float64))
+
+
+def case_info_plan(cases):
+    """Return the lazy frame of the same columns as
+    trackerchart.calc_case_info_data from the lazy Case Information.
+
+    Like calc_case_info_data_vectorized, the quirks of the reference are
+    kept.
+    """
+    columns = cases.collect_schema().names()
+    max_date_rep_conf = pl.col('DateRepConf').max()
+    cases = cases.with_columns(
+        parse_dates(*tc.CASE_DATE_COLUMNS) +
+        [pl.col(column).fill_null('No Data')
+         for column in tc.CASE_FILL_COLUMNS])
+    onset = pl.col('DateOnset')
+    specimen = pl.col('DateSpecimen')
+    cases = cases.with_columns(
+        days_between('DateSpecimen', 'DateRepConf').alias(
+            'SpecimenToRepConf'),
+        days_between('DateSpecimen', 'DateResultRelease').alias(
+            'SpecimenToRelease'),
+        days_between('DateResultRelease', 'DateRepConf').alias(
+            'ReleaseToRepConf'),
+        pl.when(onset.is_not_null()).then(pl.lit('No Proxy'))
+        .when(specimen.is_not_null()).then(pl.lit('DateSpecimen'))
+        .otherwise(pl.lit('DateRepConf')).alias(tc.ONSET_PROXY),
+        pl.coalesce(onset, specimen, pl.col('DateRepConf')).alias(
+            'DateOnset'),
+        pl.when(pl.col('DateRepConf') == max_date_rep_conf)
+        .then(pl.lit('New Case')).otherwise(pl.lit('Previous Case'))
+        .alias(tc.CASE_REP_TYPE),
+        pl.when(pl.col('HealthStatus').is_in(["RECOVERED", "DIED"]))
+        .then(pl.lit('CLOSED')).otherwise(pl.lit('ACTIVE'))
+        .alias(tc.CASE_STATUS),
+        pl.col('RegionRes').str.split(':').list.first().fill_null(
+            'No Data').alias(tc.REGION))
+    recover = pl.col('DateRecover')
+    proxy = pl.col('DateOnset') + pl.duration(days=14)
+    cases = cases.with_columns(
+        pl.when(recover.is_not_null()).then(pl.lit('No Proxy'))
+        .when(pl.col(tc.ONSET_PROXY) == 'No Proxy')
+        .then(pl.lit('DateOnset+14'))
+        .otherwise(pl.concat_str([pl.col(tc.ONSET_PROXY), pl.lit('+14')]))
+        .alias(tc.RECOVER_PROXY),
+        pl.when(recover.is_not_null()).then(recover)
+        .when(proxy < max_date_rep_conf).then(proxy)
+        .otherwise(max_date_rep_conf).alias('DateRecover'))
+    cases = cases.with_columns(
+        pl.when(pl.col('HealthStatus') == 'DIED').then(pl.col('DateDied'))
+        .otherwise(pl.col('DateRecover')).alias(tc.DATE_CLOSED))
+    # The derived columns are in the order that the reference adds them.
+    return cases.select(columns + [
+        'SpecimenToRepConf', 'SpecimenToRelease', 'ReleaseToRepConf',
+        tc.ONSET_PROXY, tc.RECOVER_PROXY, tc.CASE_REP_TYPE, tc.CASE_STATUS,
+        tc.DATE_CLOSED, tc.REGION])
+
+
+@functools.lru_cache(maxsize=None)
+def load_test_facility():
+    """Return the region of each test facility as a Polars frame."""
+    return pl.from_pandas(tc.load_test_facility())
+
+
+def testing_plan(tests):
+    """Return the lazy frame of the same columns as
+    trackerchart.calc_testing_aggregates_data from the lazy Testing
+    Aggregates."""
+    tests = tests.with_columns(parse_dates('report_date')).filter(
+        pl.col('report_date') >= datetime.fromisoformat(tc.TESTING_START))
+    positive = pl.col('daily_output_positive_individuals')
+    unique = pl.col('daily_output_unique_individuals')
+    # The row index keeps the order of the rows through the join.
+    return tests.with_columns(
+        pl.when(unique == 0).then(pl.lit(0.0)).otherwise(positive / unique)
+        .alias('pct_positive_daily')).with_row_index('_row').join(
+            load_test_facility().lazy(), on='facility_name', how='left'
+        ).sort('_row').drop('_row').with_columns(
+            pl.col('REGION').fill_null('Unknown'))
+
+
+class PolarsEngine(PandasEngine):
+    """Reads, prepares and aggregates the data with lazy Polars queries in
+    the threads of Polars."""
+
+    name = 'polars'
+
+    def calc_case_info_data(self, data, pool=None):
+        """Return the prepared Case Information. The pool is not used."""
+        # pylint: disable=unused-argument
+        return case_info_plan(pl.from_pandas(data).lazy()).collect(
+            ).to_pandas()
+
+    def calc_testing_aggregates_data(self, data, pool=None):
+        """Return the prepared Testing Aggregates. The pool is not used."""
+        # pylint: disable=unused-argument
+        return testing_plan(pl.from_pandas(data).lazy()).collect().to_pandas()
+
+    def load_data(self, name, data_dir, rebuild=False, pool=None):
+        """Scan and prepare the named data set of trackerchart.DATA_SOURCES
+        in the data directory in one lazy query.
+
+        Nothing is cached since scanning the files takes about as long as
+        reading the pickled cache.
+        """
+        # pylint: disable=unused-argument
+        plan = case_info_plan if name == 'ci_data' else testing_plan
+        with tracing.span('polars_load_data', data=name):
+            return plan(scan_files(data_dir, name)).collect().to_pandas()
+
+    def agg_count_cumsum_by_date(self, data, cumsum, group, date):
+        """See trackerchart.agg_count_cumsum_by_date. The weekly counts are
+        aggregated by Polars and the weeks are filled by pandas."""
+        counted = [column for column in data.columns
+                   if column not in (group, date)]
+        weekday = pl.col(date).dt.weekday()
+        # The weeks end on Sunday like trackerchart.WEEKLY_FREQ.
+        week = pl.col(date).dt.truncate('1d') + pl.duration(days=7 - weekday)
+        agg = pl.from_pandas(data.reset_index(drop=True)).lazy().filter(
+            pl.col(group).is_not_null() & pl.col(date).is_not_null()
+        ).group_by([pl.col(group), week.alias(date)]).agg(
+            [pl.col(column).count().cast(pl.Int64) for column in counted]
+        ).collect().to_pandas().set_index([group, date]).sort_index()
+        return tc.fill_cumsum_by_date(agg, data, cumsum, group, date)
+
+
+register(PandasEngine())
+register(VectorizedEngine())
+if pl is not None:
+    register(PolarsEngine())
+
+
+# The reference engine that the others are compared with.
+REFERENCE = ENGINES['pandas']
@@ -0,0 +1,224 @@
+"""
+Execution backends of the data preparation and the chart tasks.
+
+The work is run in a WorkerPool which is a process pool by default. A thread
+pool or a serial pool that runs everything in the current process can be
+used instead, which is mostly useful for debugging and profiling. All of
+them have the apply_async and map methods of multiprocessing.Pool.
+
+The default number of workers is derived from the CPUs that the process may
+actually use. In a container, os.cpu_count() returns the CPUs of the host
+while the process is limited by its CPU affinity and the cgroup CPU quota.
+"""
+
+import os
+import math
+import logging
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+
+
+EXECUTORS = ['process', 'thread', 'serial']
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def cgroup_cpu_limit(root=CGROUP_ROOT):
+    """Return the cgroup CPU quota in CPUs, or None if there is no quota.
+
+    Both the cgroup v2 cpu.max file and the cgroup v1 CFS quota are read.
+    """
+    try:
+        with open(os.path.join(root, "cpu.max"), encoding='utf-8') as cpu_max:
+            quota, period = cpu_max.read().split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    for cpu_dir in ("cpu", "cpu,cpuacct"):
+        try:
+            with open(os.path.join(root, cpu_dir, "cpu.cfs_quota_us"),
+                      encoding='utf-8') as quota_file:
+                quota = int(quota_file.read())
+            with open(os.path.join(root, cpu_dir, "cpu.cfs_period_us"),
+                      encoding='utf-8') as period_file:
+                period = int(period_file.read())
+        except (OSError, ValueError):
+            continue
+        if quota > 0 and period > 0:
+            return quota / period
+        return None
+    return None
+
+
+def available_cpus(cgroup_root=CGROUP_ROOT):
+    """Return the number of CPUs that the current process can use."""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit(cgroup_root)
+    if limit is not None:
+        cpus = min(cpus, math.ceil(limit))
+    return max(1, cpus)
+
+
+def default_workers(cgroup_root=CGROUP_ROOT):
+    """Return the default number of workers.
+
+    We leave one CPU idle to avoid hogging all the resources.
+    """
+    cpus = available_cpus(cgroup_root)
+    return 1 if cpus <= 2 else cpus - 1
+
+
+class SerialResult:
+    """Result of a task run by the SerialPool."""
+
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    def ready(self):
+        """The task is always done."""
+        return True
+
+    def get(self, timeout=None):  # pylint: disable=unused-argument
+        """Return the result or raise the error of the task."""
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SerialPool:
+    """Pool that runs the tasks in the current process as these are
+    submitted."""
+
+    def __init__(self, initializer=None, initargs=()):
+        if initializer is not None:
+            initializer(*initargs)
+
+    @staticmethod
+    def apply_async(func, args=(), kwds=None, callback=None,
+                    error_callback=None):
+        """Run the task and call the callback with its result."""
+        # pylint: disable=too-many-arguments
+        try:
+            result = SerialResult(func(*args, **(kwds or {})))
+        except Exception as error:  # pylint: disable=broad-except
+            if error_callback is not None:
+                error_callback(error)
+            return SerialResult(error=error)
+        if callback is not None:
+            callback(result.value)
+        return result
+
+    @staticmethod
+    def map(func, iterable, chunksize=None):  # pylint: disable=unused-argument
+        """Apply the function to each item of the iterable."""
+        return [func(item) for item in iterable]
+
+    def close(self):
+        """Nothing to close."""
+
+    def join(self):
+        """Nothing to wait for."""
+
+    def terminate(self):
+        """Nothing to stop."""
+
+
+class WorkerPool:
+    """A pool of the given executor that is shared by all of the work of a
+    run.
+
+    The initializer is run by every worker, or once in the current process
+    for the in-process executors.
+    """
+
+    def __init__(self, executor='process', workers=None, start_method=None,
+                 initializer=None, initargs=()):
+        # pylint: disable=too-many-arguments
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor: {executor}")
+        self.executor = executor
+        self.workers = 1 if executor == 'serial' else (
+            workers or default_workers())
+        self.start_method = start_method
+        if executor == 'process':
+            self.pool = mp.get_context(start_method).Pool(
+                self.workers, initializer=initializer, initargs=initargs)
+        elif executor == 'thread':
+            self.pool = ThreadPool(self.workers, initializer=initializer,
+                                   initargs=initargs)
+        else:
+            self.pool = SerialPool(initializer=initializer, initargs=initargs)
+        self._pids = self._worker_pids()
+        self._lost = set()
+        logging.info("Started a %s pool with %d workers", executor,
+                     self.workers)
+
+    @property
+    def in_process(self):
+        """Whether the tasks run in the current process and share its
+        memory."""
+        return self.executor != 'process'
+
+    def _worker_pids(self):
+        """Return the process IDs of the live process workers."""
+        if self.in_process:
+            return set()
+        # pylint: disable=protected-access
+        return {worker.pid for worker in self.pool._pool
+                if worker.exitcode is None}
+
+    def lost_workers(self):
+        """Return the process IDs of the process workers that died, e.g.
+        killed for running out of memory.
+
+        multiprocessing.Pool replaces a dead worker but the task that it was
+        running is lost: its result never comes and the pool can't be joined.
+        """
+        pids = self._worker_pids()
+        self._lost.update(self._pids - pids)
+        self._pids = pids
+        return frozenset(self._lost)
+
+    def apply_async(self, func, args=(), kwds=None, callback=None,
+                    error_callback=None):
+        """Submit a task. See multiprocessing.Pool.apply_async."""
+        # pylint: disable=too-many-arguments
+        return self.pool.apply_async(func, args, kwds or {},
+                                     callback=callback,
+                                     error_callback=error_callback)
+
+    def map(self, func, iterable):
+        """Apply the function to each item. See multiprocessing.Pool.map."""
+        return self.pool.map(func, iterable)
+
+    def close(self):
+        """Wait for the submitted tasks then stop the workers.
+
+        The pool is terminated instead if a worker died since the tasks that
+        it lost would be waited for forever.
+        """
+        if self.lost_workers():
+            logging.warning("Terminating the pool, %d workers died",
+                            len(self._lost))
+            self.pool.terminate()
+            return
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        """Stop the workers right away."""
+        self.pool.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
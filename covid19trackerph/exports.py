@@ -0,0 +1,243 @@
+"""
+Export of the aggregates behind the charts as downloadable tables.
+
+The tables are computed by tasks added to the chart task graph so that these
+are written by the workers while the charts are rendered. Each table is
+partitioned by the columns in its partition_by, with a directory per value
+in the Hive style, e.g. exports/testing/REGION=NCR, and each partition is
+written as gzipped CSV and, when pyarrow is installed, as Parquet:
+
+* case_counts: the weekly and cumulative counts of the confirmed cases,
+  recoveries and deaths by region, city/municipality, age group and health
+  status, partitioned by series and dimension
+* active_cases: the weekly active cases by region
+* testing: the daily and cumulative testing aggregates by region
+* summary: the statistics of the summary table
+
+The partition columns are not repeated in the files. manifest.json lists the
+columns and their types, and the files of each table with their partition
+values so that a consumer can load only the slices that it needs.
+
+The tables are calculated from the inputs that trackerchart adds to its
+graph, the subsets of the data sets, its active trend and its summary
+statistics, so that this module does not import trackerchart.
+"""
+
+import os
+import gzip
+import json
+import logging
+import datetime
+from urllib.parse import quote
+
+import pandas as pd
+
+from covid19trackerph import tracing
+from covid19trackerph.outputsink import atomic_write
+
+try:
+    import pyarrow  # pylint: disable=unused-import
+except ImportError:  # pragma: no cover - depends on the environment
+    pyarrow = None
+
+
+EXPORT_OUTPUT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "exports")
+MANIFEST = "manifest.json"
+PARQUET_COMPRESSION = 'zstd'
+REGION = 'Region'
+# The series of the case counts and their dates.
+CASE_SERIES = {
+    'confirmed': 'DateOnset',
+    'recovered': 'DateRecover',
+    'deaths': 'DateDied',
+}
+CASE_DIMENSIONS = [REGION, 'CityMunRes', 'AgeGroup', 'HealthStatus']
+
+
+def formats():
+    """Return the file formats that the tables are written in."""
+    return ['csv.gz'] + (['parquet'] if pyarrow is not None else [])
+
+
+def weekly_counts(data, group, date, freq):
+    """Return the number of rows of each value of the group by week, with
+    the weeks of the given frequency, and their cumulative sum. The weeks
+    without rows are counted as 0."""
+    counts = data.groupby([group, pd.Grouper(key=date, freq=freq)]).size()
+    if counts.empty:
+        return pd.DataFrame(columns=['value', 'week', 'count', 'cumulative'])
+    weeks = counts.index.get_level_values(1)
+    index = pd.MultiIndex.from_product(
+        [counts.index.unique(level=0),
+         pd.date_range(weeks.min(), weeks.max(), freq=freq)],
+        names=['value', 'week'])
+    counts = counts.reindex(index, fill_value=0).rename('count').to_frame()
+    counts['cumulative'] = counts.groupby(level='value')['count'].cumsum()
+    return counts.reset_index()
+
+
+def calc_case_counts(confirmed, recovered, deaths, freq):
+    """Calculate the case_counts table from the confirmed, recovered and
+    died cases."""
+    tables = []
+    subsets = dict(zip(CASE_SERIES, [confirmed, recovered, deaths]))
+    for series, date in CASE_SERIES.items():
+        for dimension in CASE_DIMENSIONS:
+            counts = weekly_counts(subsets[series], dimension, date, freq)
+            counts.insert(0, 'dimension', dimension)
+            counts.insert(0, 'series', series)
+            tables.append(counts)
+    return pd.concat(tables, ignore_index=True)
+
+
+def calc_active_cases(active_trend):
+    """Calculate the active_cases table from the calc_active_trend data."""
+    active = active_trend.reset_index()[
+        ['date', REGION, 'CaseCode_x', 'CaseCode_y', 'ActiveCount']]
+    active.columns = ['week', REGION, 'confirmed_cumulative',
+                      'closed_cumulative', 'active']
+    return active
+
+
+def calc_testing(test_data, columns):
+    """Calculate the testing table of the given columns."""
+    return test_data.groupby(['REGION', 'report_date'])[
+        columns].sum().reset_index()
+
+
+def calc_summary(summary):
+    """Calculate the summary table from the summary statistics."""
+    return pd.DataFrame([summary])
+
+
+# The tables: the function that calculates each, the inputs that it takes,
+# the columns that it is partitioned by and its description.
+TABLES = {
+    'case_counts': (
+        calc_case_counts, ['confirmed', 'recovered', 'deaths', 'weekly_freq'],
+        ['series', 'dimension'],
+        "Weekly and cumulative counts of the confirmed cases (by DateOnset), "
+        "recoveries (by DateRecover) and deaths (by DateDied) of each value "
+        "of a dimension"),
+    'active_cases': (
+        calc_active_cases, ['active_trend'], [REGION],
+        "Weekly cumulative confirmed, closed and active cases by region"),
+    'testing': (
+        calc_testing, ['test_data', 'test_columns'], ['REGION'],
+        "Daily and cumulative testing aggregates by region"),
+    'summary': (
+        calc_summary, ['summary'], [],
+        "Statistics of the summary table"),
+}
+
+
+def column_type(dtype):
+    """Return the type of the column in the manifest."""
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'date'
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'integer'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'float'
+    return 'string'
+
+
+def partition_dir(partition):
+    """Return the relative directory of the partition values."""
+    if not partition:
+        return ""
+    return os.path.join(*[f"{column}={quote(str(value), safe='')}"
+                          for column, value in partition.items()])
+
+
+def write_part(path, frame, file_format):
+    """Write a partition of a table in the given format and return the
+    number of bytes written."""
+    if file_format == 'parquet':
+        return atomic_write(path, frame.to_parquet(
+            index=False, compression=PARQUET_COMPRESSION))
+    # mtime=0 so that the same table is written as the same bytes.
+    return atomic_write(path, gzip.compress(
+        frame.to_csv(index=False).encode('utf-8'), mtime=0))
+
+
+def remove_stale_files(directory, written):
+    """Remove the files of the partitions that are no longer in the
+    table."""
+    for root, _, files in os.walk(directory, topdown=False):
+        for name in files:
+            path = os.path.join(root, name)
+            if path not in written:
+                os.remove(path)
+        if root != directory and not os.listdir(root):
+            os.rmdir(root)
+
+
+def write_table(name, frame, partition_by):
+    """Write the partitions of the table and return its manifest entry."""
+    table_dir = os.path.join(EXPORT_OUTPUT, name)
+    if partition_by:
+        parts = frame.groupby(partition_by, sort=True, dropna=False)
+    else:
+        parts = [((), frame)]
+    files = []
+    written = set()
+    for values, part in parts:
+        values = values if isinstance(values, tuple) else (values,)
+        partition = dict(zip(partition_by, values))
+        directory = os.path.join(table_dir, partition_dir(partition))
+        os.makedirs(directory, exist_ok=True)
+        part = part.drop(columns=partition_by)
+        for file_format in formats():
+            path = os.path.join(directory, f"data.{file_format}")
+            size = write_part(path, part, file_format)
+            written.add(path)
+            files.append({
+                'path': os.path.relpath(path, EXPORT_OUTPUT).replace(
+                    os.sep, "/"),
+                'format': file_format, 'partition': partition,
+                'rows': len(part), 'bytes': size})
+    remove_stale_files(table_dir, written)
+    return {'rows': len(frame), 'partition_by': partition_by,
+            'columns': [{'name': column, 'type': column_type(dtype)}
+                        for column, dtype in frame.dtypes.items()],
+            'files': files}
+
+
+def export_table(name, *data):
+    """Calculate the named table of TABLES from the data and write it.
+
+    This is the function of the export tasks. Returns the manifest entry of
+    the table.
+    """
+    calc, _, partition_by, _ = TABLES[name]
+    with tracing.span('export_table', table=name):
+        return write_table(name, calc(*data), partition_by)
+
+
+def add_export_tasks(graph, inputs):
+    """Add the tasks that export the tables to the chart graph.
+
+    inputs maps the inputs of TABLES to their values, or to the
+    taskgraph.Dep of the value or task of the graph that holds them.
+    """
+    for name, (_, data, _, _) in TABLES.items():
+        graph.add(f"export:{name}", export_table, name,
+                  *[inputs[dep] for dep in data], kind='export')
+
+
+def write_manifest(graph, results):
+    """Write the manifest of the tables exported by the graph."""
+    tables = {}
+    for task in graph.names(kind='export'):
+        name = task.split(':', 1)[1]
+        tables[name] = {'description': TABLES[name][3], **results[task]}
+    manifest = {'generated': datetime.datetime.now().isoformat(
+        timespec='seconds'), 'formats': formats(), 'tables': tables}
+    atomic_write(os.path.join(EXPORT_OUTPUT, MANIFEST),
+                 json.dumps(manifest, indent=1, default=str))
+    logging.info("Exported %d tables in %s to %s", len(tables),
+                 " and ".join(formats()), EXPORT_OUTPUT)
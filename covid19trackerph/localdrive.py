@@ -0,0 +1,249 @@
+"""
+Local stand-in for the Google Drive service.
+
+datadrop only needs a small part of the Drive API from its services:
+
+* files().list(q=..., pageSize=..., pageToken=..., ...).execute()
+* files().get_media(fileId=...) returning a request with a uri, headers and
+  an httplib2 style http object that serves ranged GET requests
+* new_batch_http_request(callback=...) with add() and execute()
+
+LocalDrive implements these over a set of files given in memory or read from
+a fixture directory so that the downloads can be tested and benchmarked
+without OAuth credentials or network access. The latency of each request,
+the download bandwidth, the page size of the listing and failures can be
+configured to reproduce the conditions of the real data drop.
+"""
+
+import os
+import re
+import time
+import random
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+
+class LocalResponse(dict):
+    """httplib2 style response: a dict of headers with a status."""
+
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+        self.reason = ""
+
+
+class LocalHttp:
+    """Serves the content of the files by their URI, which is the file id."""
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def request(self, uri, method="GET", headers=None, **_):
+        """Serve a ranged GET request."""
+        assert method == "GET"
+        drive = self.drive
+        file_id = uri
+        headers = headers or {}
+        with drive.lock:
+            drive.media_requests.append(file_id)
+            drive.ranges.append(headers.get('range'))
+            transient = drive.transient.get(file_id, 0)
+            if transient:
+                drive.transient[file_id] = transient - 1
+            elif drive.fail_rate:
+                transient = drive.random.random() < drive.fail_rate
+        drive.wait(drive.latency)
+        if file_id in drive.failures:
+            return LocalResponse(404), b"not found"
+        if transient:
+            return LocalResponse(503), b"unavailable"
+        size = drive.size(file_id)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d+)-(\d+)", headers.get('range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1)
+        if start >= size > 0:
+            return LocalResponse(416, {'content-range': f"bytes */{size}"}), b""
+        content = drive.read(file_id, start, end)
+        if drive.bandwidth:
+            drive.wait(len(content) / drive.bandwidth)
+        return (LocalResponse(206, {
+            'content-range': f"bytes {start}-{end}/{size}"}), content)
+
+
+class LocalRequest:
+    """Request object returned by the service methods."""
+
+    def __init__(self, drive, result=None, uri=None, http=None):
+        self.drive = drive
+        self.result = result
+        self.uri = uri
+        self.http = http
+        self.headers = {}
+
+    def execute(self):
+        """Return the result of the request."""
+        self.drive.wait(self.drive.latency)
+        return self.result
+
+
+class LocalBatch:
+    """Batch request of the service. It costs a single round trip."""
+
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        """Add a request to the batch."""
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        """Execute the requests and pass their results to the callback."""
+        with self.drive.lock:
+            self.drive.batches.append(len(self.requests))
+        self.drive.wait(self.drive.latency)
+        for request_id, request in self.requests:
+            self.callback(request_id, request.result, None)
+
+
+class LocalFiles:
+    """The files() resource of the service."""
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q=None, pageToken=None, pageSize=100, **_):
+        # pylint: disable=invalid-name
+        """List the files one page at a time.
+
+        The page size is capped by the page size of the drive. If the drive
+        has a folder id, only the queries for that folder list any files.
+        """
+        drive = self.drive
+        with drive.lock:
+            drive.list_requests.append({'q': q, 'pageToken': pageToken,
+                                        'pageSize': pageSize})
+        items = drive.items
+        if drive.folder_id and drive.folder_id not in (q or ""):
+            items = []
+        start = int(pageToken or 0)
+        end = start + min(pageSize, drive.page_size or pageSize)
+        result = {'files': items[start:end]}
+        if end < len(items):
+            result['nextPageToken'] = str(end)
+        return LocalRequest(drive, result)
+
+    def get_media(self, fileId):
+        # pylint: disable=invalid-name
+        """Return the media request of the given file."""
+        return LocalRequest(self.drive, uri=fileId, http=LocalHttp(self.drive))
+
+
+class LocalDrive:
+    """Drive service that serves the given files.
+
+    files is a dict of the file names and either their content or the path
+    of a local file. latency is the delay in seconds of every request and
+    bandwidth the transfer rate of the media requests in bytes per second.
+    The listing returns at most page_size files per page. The files named in
+    failures are not found. The media requests of the files in transient fail
+    with a 503 for the given number of times and any other media request
+    fails with a probability of fail_rate.
+
+    The requests are recorded in list_requests, media_requests, ranges and
+    batches.
+    """
+
+    def __init__(self, files, folder_id=None, latency=0.0, bandwidth=None,
+                 page_size=None, failures=(), transient=None, fail_rate=0.0,
+                 seed=0):
+        # pylint: disable=too-many-arguments,too-many-instance-attributes
+        self.lock = threading.Lock()
+        self.folder_id = folder_id
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.page_size = page_size
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.contents = {}
+        self.items = []
+        for index, (name, content) in enumerate(files.items()):
+            file_id = f"id{index}"
+            self.contents[file_id] = content
+            self.items.append({'id': file_id, 'name': name})
+            self._update_item(self.items[-1])
+        self.failures = {item['id'] for item in self.items
+                         if item['name'] in failures}
+        transient = transient or {}
+        self.transient = {item['id']: transient[item['name']]
+                          for item in self.items if item['name'] in transient}
+        self.list_requests = []
+        self.media_requests = []
+        self.ranges = []
+        self.batches = []
+
+    @classmethod
+    def from_directory(cls, directory, **kwargs):
+        """Serve the files in the given directory. These are read on demand."""
+        files = {name: os.path.join(directory, name)
+                 for name in sorted(os.listdir(directory))
+                 if os.path.isfile(os.path.join(directory, name))}
+        return cls(files, **kwargs)
+
+    def _update_item(self, item):
+        content = self.contents[item['id']]
+        if isinstance(content, bytes):
+            md5 = hashlib.md5(content).hexdigest()
+            modified = "2021-10-10T00:00:00.000Z"
+        else:
+            md5 = hashlib.md5()
+            with open(content, 'rb') as file_handle:
+                for block in iter(lambda: file_handle.read(1024 * 1024), b""):
+                    md5.update(block)
+            md5 = md5.hexdigest()
+            modified = datetime.fromtimestamp(
+                os.path.getmtime(content), timezone.utc).strftime(
+                    "%Y-%m-%dT%H:%M:%S.000Z")
+        item.update({'md5Checksum': md5, 'size': str(self.size(item['id'])),
+                     'modifiedTime': modified})
+
+    def size(self, file_id):
+        """Return the size of the given file."""
+        content = self.contents[file_id]
+        if isinstance(content, bytes):
+            return len(content)
+        return os.path.getsize(content)
+
+    def read(self, file_id, start, end):
+        """Read the given byte range of the file."""
+        content = self.contents[file_id]
+        if isinstance(content, bytes):
+            return content[start:end + 1]
+        with open(content, 'rb') as file_handle:
+            file_handle.seek(start)
+            return file_handle.read(end + 1 - start)
+
+    @staticmethod
+    def wait(seconds):
+        """Simulate the time taken by a request."""
+        if seconds:
+            time.sleep(seconds)
+
+    def update(self, name, content):
+        """Replace the content of the given file."""
+        for item in self.items:
+            if item['name'] == name:
+                self.contents[item['id']] = content
+                self._update_item(item)
+
+    def new_batch_http_request(self, callback):
+        """Return a new batch request."""
+        return LocalBatch(self, callback)
+
+    def files(self):
+        """Return the files resource."""
+        return LocalFiles(self)
@@ -0,0 +1,322 @@
+"""
+Memory accounting of the data preparation and the chart generation.
+
+The runs are limited by memory rather than by CPU so the timing report alone
+does not show why a run failed. When memory accounting is started, each stage
+of a run records:
+
+* the peak resident set size (RSS) of the main process and of the main
+  process together with its workers, sampled while the stage runs
+* the deep memory usage of the data frames at the stage boundaries
+* the pickled size of the arguments sent to the process workers
+* optionally, the top allocations traced by tracemalloc in the main process
+
+The peak RSS of each worker is always returned with its task results and is
+included in the report. Like tracing, the recording functions do nothing
+while memory accounting is off.
+"""
+
+import os
+import sys
+import pickle
+import logging
+import threading
+import contextlib
+import tracemalloc
+from timeit import default_timer as timer
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+
+# Seconds between the RSS samples of a stage.
+SAMPLE_INTERVAL = 0.05
+# Number of entries listed in the report.
+REPORT_TOP = 10
+PROC_DIR = "/proc"
+
+# Report of the current process. Memory accounting is off while it is None.
+_report = None
+
+
+def rss(pid="self"):
+    """Return the current RSS in bytes of the given process, or None if it is
+    not known."""
+    try:
+        with open(os.path.join(PROC_DIR, str(pid), "statm"),
+                  encoding='utf-8') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """Return the peak RSS in bytes of the current process, or None if it is
+    not known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def child_pids():
+    """Return the process ids of the children of the current process."""
+    pids = []
+    task_dir = os.path.join(PROC_DIR, "self", "task")
+    try:
+        tasks = os.listdir(task_dir)
+    except OSError:
+        return pids
+    for task in tasks:
+        try:
+            with open(os.path.join(task_dir, task, "children"),
+                      encoding='utf-8') as children:
+                pids.extend(int(pid) for pid in children.read().split())
+        except (OSError, ValueError):
+            continue
+    return pids
+
+
+def total_rss():
+    """Return the RSS in bytes of the current process and its children."""
+    own = rss()
+    if own is None:
+        return None
+    return own + sum(rss(pid) or 0 for pid in child_pids())
+
+
+def frame_bytes(df):
+    """Return the deep memory usage of the data frame in bytes."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def pickled_bytes(value):
+    """Return the size in bytes of the value pickled as the pool does."""
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def measured(func, *args):
+    """Call the function and return its result together with the process id
+    and the peak RSS of the process that ran it.
+
+    This wraps the functions mapped over a pool.
+    """
+    result = func(*args)
+    return result, os.getpid(), peak_rss()
+
+
+class RssSampler:
+    """Samples the RSS of the current process and its children in a thread
+    and keeps the peaks."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = rss()
+        self.peak_total = total_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="rss-sampler")
+
+    def sample(self):
+        """Take a sample and update the peaks."""
+        own, total = rss(), total_rss()
+        if own is not None:
+            self.peak = max(self.peak or 0, own)
+        if total is not None:
+            self.peak_total = max(self.peak_total or 0, total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+class MemoryReport:
+    """Memory usage recorded during a run."""
+
+    def __init__(self, tracemalloc_top=0):
+        self.tracemalloc_top = tracemalloc_top
+        self.stages = {}
+        self.frames = []
+        self.workers = {}
+        self.task_args = {}
+        self._stage = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Record the peak RSS and the allocations of the with block."""
+        previous, self._stage = self._stage, name
+        if self.tracemalloc_top and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        start_time = timer()
+        sampler = RssSampler()
+        try:
+            with sampler:
+                yield
+        finally:
+            self._stage = previous
+            usage = {'seconds': timer() - start_time, 'peak_rss': sampler.peak,
+                     'peak_total_rss': sampler.peak_total, 'end_rss': rss()}
+            if self.tracemalloc_top and tracemalloc.is_tracing():
+                usage['traced_peak'] = tracemalloc.get_traced_memory()[1]
+                usage['allocations'] = top_allocations(self.tracemalloc_top)
+            self.stages[name] = usage
+
+    def add_frame(self, label, df):
+        """Record the memory usage of a data frame in the current stage."""
+        with self._lock:
+            self.frames.append({'stage': self._stage, 'label': label,
+                                'rows': len(df), 'bytes': frame_bytes(df)})
+
+    def add_worker(self, pid, peak):
+        """Record the peak RSS reported by a worker."""
+        if peak is None:
+            return
+        with self._lock:
+            self.workers[pid] = max(self.workers.get(pid, 0), peak)
+
+    def add_task_args(self, name, size):
+        """Record the pickled size of the arguments of a pool task."""
+        with self._lock:
+            self.task_args[name] = size
+
+    def summary(self):
+        """Return the report as a dict."""
+        with self._lock:
+            return {'stages': dict(self.stages), 'frames': list(self.frames),
+                    'workers': dict(self.workers),
+                    'task_args': dict(self.task_args)}
+
+    def log(self):
+        """Log the report."""
+        logging.info("Memory usage")
+        for name, usage in self.stages.items():
+            logging.info("  %s: peak RSS %s, with workers %s, %s at the end",
+                         name, format_bytes(usage['peak_rss']),
+                         format_bytes(usage['peak_total_rss']),
+                         format_bytes(usage['end_rss']))
+            if 'traced_peak' in usage:
+                logging.info("    traced peak %s, top allocations:",
+                             format_bytes(usage['traced_peak']))
+                for location, size, count in usage['allocations']:
+                    logging.info("      %s: %s in %d blocks", location,
+                                 format_bytes(size), count)
+        for frame in self.frames:
+            logging.info("  %s %s: %d rows, %s", frame['stage'],
+                         frame['label'], frame['rows'],
+                         format_bytes(frame['bytes']))
+        if self.workers:
+            logging.info("  Worker peak RSS: max %s, total %s of %d workers",
+                         format_bytes(max(self.workers.values())),
+                         format_bytes(sum(self.workers.values())),
+                         len(self.workers))
+        if self.task_args:
+            largest = sorted(self.task_args.items(), key=lambda item: item[1],
+                             reverse=True)
+            logging.info("  Pickled task arguments: %s in %d tasks, largest:",
+                         format_bytes(sum(self.task_args.values())),
+                         len(self.task_args))
+            for name, size in largest[:REPORT_TOP]:
+                logging.info("    %s: %s", name, format_bytes(size))
+
+
+def format_bytes(size):
+    """Format a size in bytes in kB or MB."""
+    if size is None:
+        return "n/a"
+    if size < 1e6:
+        return f"{size / 1e3:.1f} kB"
+    return f"{size / 1e6:.1f} MB"
+
+
+def top_allocations(limit):
+    """Return the locations of the largest allocations traced by
+    tracemalloc with their size and number of blocks."""
+    statistics = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ]).statistics('lineno')
+    return [(str(stat.traceback), stat.size, stat.count)
+            for stat in statistics[:limit]]
+
+
+def start(tracemalloc_top=0):
+    """Start the memory accounting of the current process.
+
+    If tracemalloc_top is not zero, the allocations are traced and that
+    many of the largest are listed for each stage.
+    """
+    global _report  # pylint: disable=global-statement
+    _report = MemoryReport(tracemalloc_top)
+    if tracemalloc_top and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _report
+
+
+def stop():
+    """Stop the memory accounting and return the report."""
+    global _report  # pylint: disable=global-statement
+    report, _report = _report, None
+    if report is not None and report.tracemalloc_top:
+        tracemalloc.stop()
+    return report
+
+
+def is_enabled():
+    """Whether the memory accounting is started."""
+    return _report is not None
+
+
+def current():
+    """Return the report of the current process or None."""
+    return _report
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Record the memory usage of the with block as a stage."""
+    if _report is None:
+        yield
+        return
+    with _report.stage(name):
+        yield
+
+
+def record_frame(label, df):
+    """Record the memory usage of a data frame in the current stage."""
+    if _report is not None:
+        _report.add_frame(label, df)
+
+
+def record_worker(pid, peak):
+    """Record the peak RSS of a worker."""
+    if _report is not None:
+        _report.add_worker(pid, peak)
+
+
+def record_task_args(name, value):
+    """Record the pickled size of the arguments of a pool task."""
+    if _report is not None:
+        _report.add_task_args(name, pickled_bytes(value))
+
+
+def log_report():
+    """Log the report of the current process and start a new one.
+
+    A watch mode process reports each of its runs separately.
+    """
+    if _report is None:
+        return
+    _report.log()
+    start(_report.tracemalloc_top)
@@ -0,0 +1,213 @@
+"""
+Background writer for the generated chart and table files.
+
+Rendering a chart to PNG and HTML is handed off to a small thread pool so that
+the plotting process can continue with the next chart right away. Every file
+is first written to a temporary file in the destination directory and then
+renamed into place so an interrupted run never leaves a half-written file in
+the directories published by Jekyll.
+"""
+
+import os
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+
+import plotly.io as pio
+
+from covid19trackerph import tracing
+
+
+# Kaleido serializes the PNG rendering internally so there is little to gain
+# from a lot of writer threads.
+DEFAULT_WRITERS = 2
+CHART_FORMATS = ['html', 'png', 'svg', 'json']
+DEFAULT_CHART_FORMATS = ['html', 'png']
+
+
+def _current_umask():
+    # The umask can only be read by setting it, so it is read once on import
+    # before the writer threads are started.
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# mkstemp creates the files readable by the owner only. The written files get
+# the mode that open() would give them so a web server can read them.
+FILE_MODE = 0o666 & ~_current_umask()
+
+
+def render_chart(fig_dict, chart_format, width=None, height=None):
+    """Render the figure dict to the given format.
+
+    The figure was already validated when it was built so it is not validated
+    again when rendered.
+    """
+    with tracing.span(f"render_{chart_format}", 'output'):
+        return _render_chart(fig_dict, chart_format, width, height)
+
+
+def _render_chart(fig_dict, chart_format, width, height):
+    if chart_format == 'html':
+        return pio.to_html(fig_dict, include_plotlyjs='cdn', full_html=False,
+                           validate=False)
+    if chart_format == 'json':
+        return pio.to_json(fig_dict, validate=False)
+    if chart_format in ['png', 'svg']:
+        return pio.to_image(fig_dict, format=chart_format, width=width,
+                            height=height, validate=False)
+    raise ValueError(f"Unsupported chart format: {chart_format}")
+
+
+def atomic_write(path, data):
+    """Write the data to the given path atomically.
+
+    The data is written to a temporary file in the same directory which is
+    then renamed to the target path. Returns the number of bytes written.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    directory, basename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or ".",
+                                    prefix=f".{basename}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as file_handle:
+            file_handle.write(data)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(data)
+
+
+class OutputSink:
+    """Thread pool backed writer of the finished figures and tables."""
+
+    def __init__(self, max_workers=DEFAULT_WRITERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="outputsink")
+        self._lock = threading.Lock()
+        # The queued writes of each submitting thread. With the thread
+        # executor, the chart tasks share the sink and each one only waits
+        # for, and gets the errors of, its own files.
+        self._futures = {}
+        self._pending = 0
+        self._max_pending = 0
+        self._files_written = 0
+        self._bytes_written = 0
+        self._write_time = 0.0
+        self._start = timer()
+
+    def _write(self, path, render_fn):
+        start = timer()
+        try:
+            data = render_fn()
+            with tracing.span('write_file', 'output',
+                              path=os.path.basename(path)):
+                written = atomic_write(path, data)
+        finally:
+            with self._lock:
+                self._pending -= 1
+        with self._lock:
+            self._files_written += 1
+            self._bytes_written += written
+            self._write_time += timer() - start
+        logging.debug("Wrote %s (%d bytes)", path, written)
+
+    def submit(self, path, render_fn):
+        """Queue the output of render_fn to be written to the given path.
+
+        render_fn is called on a writer thread and must return str or bytes.
+        """
+        with self._lock:
+            self._pending += 1
+            self._max_pending = max(self._max_pending, self._pending)
+            self._futures.setdefault(threading.get_ident(), []).append(
+                self._executor.submit(self._write, path, render_fn))
+
+    def submit_chart(self, fig, directory, filename, formats=None,
+                     width=None, height=None):
+        """Queue the files of the given figure in each of the given formats.
+
+        The figure is copied before returning so the caller is free to modify
+        it afterwards.
+        """
+        with tracing.span('figure_dict', 'output', filename=filename):
+            fig_dict = fig.to_dict()
+        for chart_format in formats or DEFAULT_CHART_FORMATS:
+            self.submit(os.path.join(directory, f"{filename}.{chart_format}"),
+                        lambda chart_format=chart_format: render_chart(
+                            fig_dict, chart_format, width, height))
+
+    def submit_table(self, html, directory, filename):
+        """Queue the HTML file of a table."""
+        self.submit(os.path.join(directory, f"{filename}.html"), lambda: html)
+
+    @property
+    def queue_depth(self):
+        """Number of files waiting to be written."""
+        with self._lock:
+            return self._pending
+
+    def flush(self):
+        """Wait until the files queued by the current thread are written.
+
+        The first error raised by a writer of these files is raised again
+        here.
+        """
+        with self._lock:
+            futures = self._futures.pop(threading.get_ident(), [])
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """Write the remaining files of every thread and stop the writer
+        threads."""
+        try:
+            with self._lock:
+                futures, self._futures = self._futures, {}
+            for future in [future for queued in futures.values()
+                           for future in queued]:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def metrics(self):
+        """Return the queue and throughput metrics of the writer."""
+        with self._lock:
+            elapsed = timer() - self._start
+            return {
+                'queue_depth': self._pending,
+                'max_queue_depth': self._max_pending,
+                'files_written': self._files_written,
+                'bytes_written': self._bytes_written,
+                'write_seconds': self._write_time,
+                'files_per_second': (self._files_written / elapsed
+                                     if elapsed else 0.0),
+                'bytes_per_second': (self._bytes_written / self._write_time
+                                     if self._write_time else 0.0),
+            }
+
+
+def merge_metrics(metrics_list):
+    """Combine the metrics collected from several sinks."""
+    merged = {
+        'max_queue_depth': 0,
+        'files_written': 0,
+        'bytes_written': 0,
+        'write_seconds': 0.0,
+    }
+    for metrics in metrics_list:
+        merged['max_queue_depth'] = max(merged['max_queue_depth'],
+                                        metrics['max_queue_depth'])
+        for key in ['files_written', 'bytes_written', 'write_seconds']:
+            merged[key] += metrics[key]
+    merged['bytes_per_second'] = (
+        merged['bytes_written'] / merged['write_seconds']
+        if merged['write_seconds'] else 0.0)
+    return merged
@@ -0,0 +1,410 @@
+"""
+Local JSON query service over the prepared tracker data.
+
+Instead of scraping the chart tables or preparing the data drop again, other
+tools can query the numbers of the tracker over HTTP while updatetracker runs
+with '--serve'. The prepared data sets are loaded once and the case counts of
+each date column are aggregated by region, city or municipality, health
+status and case status the first time that the date column is queried. The
+queries then only filter and sum these aggregates.
+
+Endpoints, all GET and returning JSON:
+
+* /counts?date=DateRepConf&freq=daily|weekly: the count of the cases by
+  date and their cumulative count within the period, optionally
+  by=Region|CityMunRes|HealthStatus|CaseStatus
+* /top?area=Region|CityMunRes&n=10: the areas with the most cases
+* /summary: the statistics of the summary table
+* /metrics: the latency of each endpoint and the response cache hit rate
+
+/counts and /top take the filters region, city, health and status, and the
+period start=YYYY-MM-DD, end=YYYY-MM-DD or days=N, the latest N days. /top
+filters the period on the date column given with date, DateRepConf by
+default.
+
+The encoded responses are kept in an LRU cache that is cleared whenever the
+data is refreshed with set_data.
+"""
+
+import json
+import math
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from timeit import default_timer as timer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from covid19trackerph import trackerchart as tc
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8050
+DEFAULT_CACHE_SIZE = 256
+# Number of the latest requests of each endpoint kept for the latency
+# percentiles.
+LATENCY_WINDOW = 1000
+DATE_COLUMNS = ['DateRepConf', 'DateOnset', 'DateSpecimen',
+                'DateResultRelease', 'DateRecover', 'DateDied', tc.DATE_CLOSED]
+GROUP_COLUMNS = [tc.REGION, tc.CITY_MUN, 'HealthStatus', tc.CASE_STATUS]
+AREA_COLUMNS = [tc.REGION, tc.CITY_MUN]
+# Query parameters of the filters and the column that each one filters.
+FILTERS = {'region': tc.REGION, 'city': tc.CITY_MUN, 'health': 'HealthStatus',
+           'status': tc.CASE_STATUS}
+FREQS = {'daily': 'D', 'weekly': tc.WEEKLY_FREQ}
+DEFAULT_TOP = 10
+
+
+class QueryError(Exception):
+    """Invalid query parameters."""
+
+    status = 400
+
+
+class NotLoadedError(QueryError):
+    """The data is not loaded yet."""
+
+    status = 503
+
+
+def jsonable(value):
+    """Convert the value to the types that json can encode. Missing and
+    infinite numbers become null and dates become ISO strings."""
+    # pylint: disable=too-many-return-statements
+    if isinstance(value, dict):
+        return {str(key): jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    if isinstance(value, (np.integer, np.bool_)):
+        return value.item()
+    if isinstance(value, (float, np.floating)):
+        return float(value) if math.isfinite(value) else None
+    if value is pd.NaT or value is None:
+        return None
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, str) or not pd.isna(value):
+        return value
+    return None
+
+
+class ResponseCache:
+    """Thread safe LRU cache of the encoded responses."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the cached value of the key or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Cache the value, evicting the least recently used entry if the
+        cache is full."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all of the entries."""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        """Return the size and the hit rate of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'invalidations': self.invalidations}
+
+
+class Aggregates:
+    """The case counts of the prepared data, aggregated per date column on
+    first use."""
+
+    def __init__(self, ci_data, test_data):
+        self.ci_data = ci_data
+        self.test_data = test_data
+        self.loaded = datetime.now()
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._summary = None
+
+    def counts(self, date_column):
+        """Return the number of cases of each date of the column and each
+        combination of GROUP_COLUMNS. The rows without a date are kept."""
+        if date_column not in DATE_COLUMNS:
+            raise QueryError(f"date must be one of {', '.join(DATE_COLUMNS)}")
+        with self._lock:
+            if date_column not in self._counts:
+                start = timer()
+                counts = self.ci_data.groupby(
+                    [date_column] + GROUP_COLUMNS, dropna=False,
+                    observed=True)['CaseCode'].size()
+                self._counts[date_column] = counts.rename(
+                    'count').reset_index()
+                logging.info("Aggregated the cases by %s in %.2fs",
+                             date_column, timer() - start)
+            return self._counts[date_column]
+
+    def summary(self):
+        """Return the summary statistics."""
+        with self._lock:
+            if self._summary is None:
+                self._summary = jsonable(tc.summary_metrics(self.ci_data,
+                                                            self.test_data))
+            return self._summary
+
+
+def _single(query, name, default=None):
+    """Return the last value of the query parameter."""
+    values = query.get(name)
+    return values[-1] if values else default
+
+
+def _date(value, name):
+    try:
+        return pd.Timestamp(value)
+    except ValueError:
+        raise QueryError(f"{name} must be a date") from None
+
+
+def _positive_int(value, name):
+    try:
+        number = int(value)
+    except ValueError:
+        raise QueryError(f"{name} must be a number") from None
+    if number <= 0:
+        raise QueryError(f"{name} must be positive")
+    return number
+
+
+def _choice(value, name, choices):
+    if value not in choices:
+        raise QueryError(f"{name} must be one of {', '.join(choices)}")
+    return value
+
+
+def filter_counts(counts, date_column, query):
+    """Apply the filters and the period of the query to the counts. The
+    latest N days are counted back from the latest date of all of the
+    cases."""
+    latest = counts[date_column].max()
+    for name, column in FILTERS.items():
+        values = query.get(name)
+        if values:
+            counts = counts[counts[column].isin(values)]
+    start = _single(query, 'start')
+    end = _single(query, 'end')
+    days = _single(query, 'days')
+    if days is not None:
+        if start is not None:
+            raise QueryError("days cannot be used with start")
+        days = _positive_int(days, 'days')
+        if pd.notna(latest):
+            start = latest - pd.Timedelta(days=days - 1)
+    elif start is not None:
+        start = _date(start, 'start')
+    if start is not None:
+        counts = counts[counts[date_column] >= start]
+    if end is not None:
+        counts = counts[counts[date_column] <= _date(end, 'end')]
+    return counts
+
+
+class QueryService:
+    """Answers the queries from the aggregates of the current data."""
+
+    def __init__(self, frames=None, cache_size=DEFAULT_CACHE_SIZE):
+        self.cache = ResponseCache(cache_size)
+        self.version = 0
+        self._aggregates = None
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self.endpoints = {'/counts': self.counts, '/top': self.top,
+                          '/summary': self.summary}
+        if frames is not None:
+            self.set_data(frames)
+
+    def set_data(self, frames):
+        """Serve the given prepared data sets, ci_data and test_data, and
+        invalidate the cached responses."""
+        aggregates = Aggregates(frames['ci_data'], frames['test_data'])
+        with self._lock:
+            self._aggregates = aggregates
+            self.version += 1
+        self.cache.clear()
+        logging.info("Query service data refreshed (version %d)",
+                     self.version)
+
+    @property
+    def aggregates(self):
+        """The aggregates of the current data."""
+        with self._lock:
+            if self._aggregates is None:
+                raise NotLoadedError("The data is not loaded yet")
+            return self._aggregates
+
+    def counts(self, query):
+        """Return the case counts by date."""
+        date_column = _single(query, 'date', 'DateRepConf')
+        freq = _choice(_single(query, 'freq', 'daily'), 'freq', list(FREQS))
+        group = _single(query, 'by')
+        if group is not None:
+            _choice(group, 'by', GROUP_COLUMNS)
+        counts = filter_counts(self.aggregates.counts(date_column),
+                               date_column, query)
+        counts = counts[counts[date_column].notna()]
+        if group:
+            table = counts.pivot_table(
+                index=date_column, columns=counts[group].fillna('No Data'),
+                values='count', aggfunc='sum', fill_value=0)
+        else:
+            table = counts.groupby(date_column)[['count']].sum()
+        # The dates without cases are counted as zero.
+        table = table.resample(FREQS[freq]).sum()
+        cumulative = table.cumsum()
+        rows = []
+        for column in table.columns:
+            for day, count in table[column].items():
+                total = cumulative.at[day, column]
+                # The dates before the first case of a group are left out.
+                if group and not total:
+                    continue
+                row = {group: column} if group else {}
+                row.update(date=day, count=count, cumulative=total)
+                rows.append(row)
+        return {'date': date_column, 'freq': freq, 'counts': rows}
+
+    def top(self, query):
+        """Return the areas with the most cases."""
+        area = _choice(_single(query, 'area', tc.REGION), 'area',
+                       AREA_COLUMNS)
+        num = _positive_int(_single(query, 'n', str(DEFAULT_TOP)), 'n')
+        date_column = _single(query, 'date', 'DateRepConf')
+        counts = filter_counts(self.aggregates.counts(date_column),
+                               date_column, query)
+        top = counts.groupby(area)['count'].sum().nlargest(num)
+        return {'area': area,
+                'top': [{area: name, 'count': count}
+                        for name, count in top.items()]}
+
+    def summary(self, query):
+        """Return the summary statistics."""
+        # pylint: disable=unused-argument
+        return self.aggregates.summary()
+
+    def record_latency(self, endpoint, seconds):
+        """Record the latency of a request."""
+        with self._lock:
+            self._latencies.setdefault(
+                endpoint, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def metrics(self):
+        """Return the latencies of each endpoint and the cache statistics."""
+        with self._lock:
+            latencies = {endpoint: list(values)
+                         for endpoint, values in self._latencies.items()}
+            loaded = (self._aggregates.loaded if self._aggregates
+                      else None)
+        endpoints = {}
+        for endpoint, values in latencies.items():
+            endpoints[endpoint] = {
+                'requests': len(values),
+                'mean_ms': float(np.mean(values)) * 1000,
+                'p50_ms': float(np.percentile(values, 50)) * 1000,
+                'p95_ms': float(np.percentile(values, 95)) * 1000,
+                'max_ms': float(np.max(values)) * 1000}
+        return {'version': self.version,
+                'loaded': loaded.isoformat(timespec='seconds')
+                if loaded else None,
+                'cache': self.cache.stats(), 'endpoints': endpoints}
+
+    def handle(self, url):
+        """Answer the request of the given URL path and query. Returns the
+        HTTP status and the encoded JSON body."""
+        start = timer()
+        parts = urlsplit(url)
+        path = parts.path.rstrip('/') or '/'
+        if path == '/metrics':
+            return 200, json.dumps(self.metrics()).encode()
+        if path not in self.endpoints:
+            return 404, json.dumps({'error': f"Unknown path {path}"}).encode()
+        query = parse_qs(parts.query)
+        key = (self.version, path,
+               tuple(sorted((name, tuple(values))
+                            for name, values in query.items())))
+        body = self.cache.get(key)
+        status = 200
+        if body is None:
+            try:
+                body = json.dumps(jsonable(self.endpoints[path](query)))
+                body = body.encode()
+            except QueryError as error:
+                status = error.status
+                body = json.dumps({'error': str(error)}).encode()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Query %s failed", url)
+                status = 500
+                body = json.dumps({'error': "Internal error"}).encode()
+            else:
+                self.cache.put(key, body)
+        self.record_latency(path, timer() - start)
+        return status, body
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Passes the GET requests to the QueryService of the server."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer a query."""
+        status, body = self.server.service.handle(self.path)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Create the HTTP server of the service. Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def start_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Serve the service from a background thread and return the server.
+    Stop it with server.shutdown() then server.server_close()."""
+    server = create_server(service, host, port)
+    thread = threading.Thread(target=server.serve_forever,
+                              name="queryservice", daemon=True)
+    thread.start()
+    logging.info("Serving queries at http://%s:%d", *server.server_address)
+    return server
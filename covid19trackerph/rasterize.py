@@ -0,0 +1,133 @@
+"""
+Render the image files of the charts from the saved figure JSON files.
+
+Rasterizing through kaleido is the most expensive step of writing a chart.
+When updatetracker is run with '--formats html,json', the image files can be
+generated later, possibly on a different machine, with this command. Only the
+images that are missing or older than their JSON file are rendered unless
+'--force' is given.
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+import pathlib
+import traceback
+import multiprocessing as mp
+from datetime import timedelta
+from timeit import default_timer as timer
+
+from covid19trackerph import execution
+from covid19trackerph import outputsink
+
+
+SCRIPT_DIR = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
+CHART_OUTPUT = os.path.join(SCRIPT_DIR, "charts")
+IMAGE_FORMATS = ['png', 'svg']
+# Keep in sync with trackerchart.CHART_WIDTH and trackerchart.CHART_HEIGHT.
+# These are not imported so that this command does not load the data stack.
+CHART_WIDTH = 1000
+CHART_HEIGHT = CHART_WIDTH * 9 / 16
+
+
+def needs_render(json_path, image_path, force=False):
+    """Check if the image needs to be rendered from the JSON file."""
+    if force or not os.path.exists(image_path):
+        return True
+    return os.path.getmtime(json_path) > os.path.getmtime(image_path)
+
+
+def list_pending(chart_dir, image_format='png', force=False):
+    """List the JSON files whose image needs to be rendered."""
+    pending = []
+    for name in sorted(os.listdir(chart_dir)):
+        if name.startswith('.') or not name.endswith('.json'):
+            continue
+        json_path = os.path.join(chart_dir, name)
+        image_path = f"{json_path[:-len('.json')]}.{image_format}"
+        if needs_render(json_path, image_path, force):
+            pending.append((json_path, image_path))
+    return pending
+
+
+def render_file(paths, image_format='png'):
+    """Render the image of a figure JSON file. Returns the bytes written."""
+    json_path, image_path = paths
+    with open(json_path, encoding='utf-8') as file_handle:
+        fig_dict = json.load(file_handle)
+    image = outputsink.render_chart(fig_dict, image_format,
+                                    width=CHART_WIDTH, height=CHART_HEIGHT)
+    return outputsink.atomic_write(image_path, image)
+
+
+def _render_png(paths):
+    """Render a PNG file. Defined on top level for multiprocessing."""
+    return render_file(paths, 'png')
+
+
+def _render_svg(paths):
+    """Render an SVG file. Defined on top level for multiprocessing."""
+    return render_file(paths, 'svg')
+
+
+def rasterize(chart_dir=CHART_OUTPUT, image_format='png', force=False,
+              processes=None):
+    """Render the pending images in the chart directory.
+
+    Every process runs its own kaleido instance so the images are rendered in
+    parallel. Returns the number of rendered images.
+    """
+    render_fn = {'png': _render_png, 'svg': _render_svg}[image_format]
+    pending = list_pending(chart_dir, image_format, force)
+    if not pending:
+        logging.info("All %s files are up to date", image_format)
+        return 0
+    processes = processes or execution.default_workers()
+    logging.info("Rendering %d %s files with %d processes", len(pending),
+                 image_format, processes)
+    start = timer()
+    written = 0
+    with mp.Pool(min(processes, len(pending))) as pool:
+        for size in pool.imap_unordered(render_fn, pending):
+            written += size
+        pool.close()
+        pool.join()
+    logging.info("Rendered %d files (%.1f MB) in %s", len(pending),
+                 written / 1e6, timedelta(seconds=timer() - start))
+    return len(pending)
+
+
+def _parse_args():
+    """Parse the CLI arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument("--chart-dir", default=CHART_OUTPUT,
+                        help="directory of the saved figure JSON files")
+    parser.add_argument("--format", default='png', choices=IMAGE_FORMATS,
+                        help="image format to render")
+    parser.add_argument("--force", action="store_true",
+                        help="render all images even if these are up to date")
+    parser.add_argument("--processes", type=int,
+                        help=("number of rendering processes, default: one "
+                              "less than the available CPUs"))
+    parser.add_argument("--loglevel", default="INFO",
+                        help="set log level")
+    return parser.parse_args()
+
+
+def main():
+    """Main function"""
+    args = _parse_args()
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    rasterize(args.chart_dir, args.format, force=args.force,
+              processes=args.processes)
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:  # pylint: disable=broad-except
+        logging.error(traceback.format_exc())
+        sys.exit(1)
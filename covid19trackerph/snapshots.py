@@ -0,0 +1,342 @@
+"""
+Store of the daily Case Information drops as deltas.
+
+The data directory only holds the latest drop, and keeping every full drop
+to study the revisions would take gigabytes per drop. The snapshot store
+keeps a drop in full every BASE_INTERVAL drops, the first one included, and
+each drop in between as a delta from the drop before it:
+
+* <date>.base: all of the rows of the drop
+* <date>.upserts: the rows that were inserted or changed, by CaseCode
+* <date>.removed: the CaseCodes of the rows that were removed
+
+The files are compressed Parquet when pyarrow is installed so that a subset
+of the columns can be read without the rest, otherwise gzipped pickles,
+with a warning since these are read in full. pyarrow is installed with the
+parquet extra. The
+values are kept as the text of the CSV files so a drop is restored exactly
+as it was published. index.json lists the snapshots with their row counts
+and sizes.
+
+Restoring a drop reads its nearest base and applies the deltas after it.
+The storage ratio is logged when a drop is added and the time taken when
+one is restored.
+
+    python -m covid19trackerph.snapshots add data --store snapshots
+    python -m covid19trackerph.snapshots restore 2020-07-10 --store snapshots
+"""
+
+import os
+import io
+import sys
+import json
+import glob
+import logging
+import argparse
+import traceback
+from timeit import default_timer as timer
+
+import pandas as pd
+
+from covid19trackerph.outputsink import atomic_write
+
+try:
+    import pyarrow  # pylint: disable=unused-import
+except ImportError:  # pragma: no cover - depends on the environment
+    pyarrow = None
+
+
+KEY = 'CaseCode'
+INDEX = "index.json"
+CASE_INFORMATION_PATTERN = "*Case Information*.csv"
+# Every this many drops, one is stored in full so that restoring a drop
+# applies fewer deltas than this.
+BASE_INTERVAL = 30
+PARQUET_COMPRESSION = 'zstd'
+
+
+def default_format():
+    """Return the file format of a new store."""
+    return 'parquet' if pyarrow is not None else 'pickle'
+
+
+def write_frame(path, frame, file_format):
+    """Write the frame atomically and return the number of bytes
+    written."""
+    buffer = io.BytesIO()
+    if file_format == 'parquet':
+        frame.to_parquet(buffer, compression=PARQUET_COMPRESSION)
+    else:
+        frame.to_pickle(buffer, compression='gzip')
+    return atomic_write(path, buffer.getvalue())
+
+
+def read_frame(path, file_format, columns=None):
+    """Read the given columns, or all of them, of a frame."""
+    if file_format == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    frame = pd.read_pickle(path, compression='gzip')
+    return frame if columns is None else frame[columns]
+
+
+def read_drop(data_dir):
+    """Read the Case Information of the drop in the data directory as text,
+    indexed by CaseCode."""
+    paths = sorted(
+        glob.glob(os.path.join(data_dir, CASE_INFORMATION_PATTERN)))
+    if not paths:
+        raise FileNotFoundError(f"No Case Information in {data_dir}")
+    data = pd.concat(pd.read_csv(path, dtype=str) for path in paths)
+    data = data.set_index(KEY)
+    if not data.index.is_unique:
+        raise ValueError(f"The {KEY} of the drop in {data_dir} are not "
+                         f"unique")
+    return data
+
+
+def drop_date(data):
+    """Return the date of the drop, the latest DateRepConf."""
+    return pd.to_datetime(data['DateRepConf'], errors='coerce').max(
+        ).strftime("%Y-%m-%d")
+
+
+def diff(previous, current):
+    """Return the rows of current that are not in previous or differ from
+    it, and the keys of the rows of previous that are not in current."""
+    removed = previous.index.difference(current.index)
+    inserted = current.index.difference(previous.index)
+    common = current.index.intersection(previous.index)
+    columns = current.columns
+    before = previous.reindex(index=common, columns=columns)
+    after = current.loc[common, columns]
+    changed = ((before != after) & ~(before.isna() & after.isna())).any(
+        axis=1)
+    upserts = current.loc[inserted.append(common[changed.to_numpy()])]
+    return upserts, removed, len(inserted)
+
+
+def apply_delta(data, upserts, removed):
+    """Return the data with the rows of the delta removed, replaced or
+    inserted."""
+    replaced = data.index.isin(removed) | data.index.isin(upserts.index)
+    return pd.concat([data[~replaced], upserts])
+
+
+class SnapshotStore:
+    """The snapshots of the Case Information drops in a directory."""
+
+    def __init__(self, directory, file_format=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, INDEX)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file_handle:
+                index = json.load(file_handle)
+        else:
+            index = {'format': file_format or default_format(),
+                     'snapshots': []}
+            if index['format'] == 'pickle' and not file_format:
+                logging.warning("pyarrow is not installed, storing the "
+                                "snapshots in %s as gzipped pickles. Install "
+                                "the parquet extra to store them as Parquet",
+                                directory)
+        if file_format and file_format != index['format']:
+            raise ValueError(f"The store in {directory} is in the "
+                             f"{index['format']} format")
+        if index['format'] == 'parquet' and pyarrow is None:
+            raise ValueError("pyarrow is needed to read the Parquet store in "
+                             f"{directory}")
+        self.format = index['format']
+        self.snapshots = index['snapshots']
+
+    def _path(self, date, part):
+        suffix = "parquet" if self.format == 'parquet' else "pkl.gz"
+        return os.path.join(self.directory, f"{date}.{part}.{suffix}")
+
+    def _save_index(self):
+        atomic_write(os.path.join(self.directory, INDEX),
+                     json.dumps({'format': self.format,
+                                 'snapshots': self.snapshots}, indent=1))
+
+    def dates(self):
+        """Return the dates of the stored drops, oldest first."""
+        return [snapshot['date'] for snapshot in self.snapshots]
+
+    def _position(self, date):
+        try:
+            return self.dates().index(date)
+        except ValueError:
+            raise KeyError(f"No snapshot of {date}") from None
+
+    def add(self, data, date=None, source_bytes=0):
+        """Store the drop, indexed by CaseCode, under its date and return
+        its snapshot entry.
+
+        The date defaults to the latest DateRepConf of the drop. It must not
+        be before the latest stored drop. A drop of the same date as the
+        latest one replaces it.
+        """
+        data = data.rename_axis(KEY)
+        date = date or drop_date(data)
+        dates = self.dates()
+        if dates and date < dates[-1]:
+            raise ValueError(f"The drop of {date} is older than the latest "
+                             f"stored drop of {dates[-1]}")
+        replaced = None
+        if dates and date == dates[-1]:
+            replaced = self.snapshots.pop()
+        start = timer()
+        last_base = max((index for index, snapshot in
+                         enumerate(self.snapshots)
+                         if snapshot['kind'] == 'base'), default=None)
+        snapshot = {'date': date, 'rows': len(data),
+                    'columns': list(data.columns),
+                    'source_bytes': source_bytes}
+        if (last_base is None or
+                len(self.snapshots) - last_base >= BASE_INTERVAL):
+            snapshot['kind'] = 'base'
+            snapshot['stored_bytes'] = write_frame(
+                self._path(date, 'base'), data.reset_index(), self.format)
+        else:
+            previous = self.restore(self.snapshots[-1]['date'])
+            upserts, removed, inserted = diff(previous, data)
+            snapshot.update({
+                'kind': 'delta', 'inserted': inserted,
+                'changed': len(upserts) - inserted, 'removed': len(removed)})
+            snapshot['stored_bytes'] = (
+                write_frame(self._path(date, 'upserts'),
+                            upserts.reset_index(), self.format) +
+                write_frame(self._path(date, 'removed'),
+                            pd.DataFrame({KEY: removed}), self.format))
+        self.snapshots.append(snapshot)
+        self._save_index()
+        # The files of the replaced drop are only removed once the index no
+        # longer lists them.
+        if replaced is not None:
+            self._remove_files(replaced, keep=snapshot)
+        logging.info("Stored the %s of the drop of %s (%d rows) in %.1fs, "
+                     "%d bytes", snapshot['kind'], date, len(data),
+                     timer() - start, snapshot['stored_bytes'])
+        log_stats(self.stats())
+        return snapshot
+
+    def add_drop(self, data_dir, date=None):
+        """Store the Case Information drop in the data directory. See
+        add."""
+        source_bytes = sum(
+            os.path.getsize(path) for path in
+            glob.glob(os.path.join(data_dir, CASE_INFORMATION_PATTERN)))
+        return self.add(read_drop(data_dir), date, source_bytes)
+
+    def _parts(self, snapshot):
+        """Return the paths of the files of the snapshot."""
+        parts = (['base'] if snapshot['kind'] == 'base' else
+                 ['upserts', 'removed'])
+        return [self._path(snapshot['date'], part) for part in parts]
+
+    def _remove_files(self, snapshot, keep=None):
+        kept = self._parts(keep) if keep else []
+        for path in self._parts(snapshot):
+            if path not in kept and os.path.exists(path):
+                os.remove(path)
+
+    def restore(self, date, columns=None):
+        """Return the drop of the given date indexed by CaseCode, with only
+        the given columns if any.
+
+        The rows of a drop restored from deltas are not in the order of the
+        published file.
+        """
+        start = timer()
+        position = self._position(date)
+        first = max(index for index in range(position + 1)
+                    if self.snapshots[index]['kind'] == 'base')
+        columns = self.snapshots[position]['columns'] if columns is None \
+            else list(columns)
+        data = None
+        for snapshot in self.snapshots[first:position + 1]:
+            # The columns of the drops can differ.
+            read_columns = [KEY] + [column for column in columns
+                                    if column in snapshot['columns']]
+            if data is None:
+                data = read_frame(self._path(snapshot['date'], 'base'),
+                                  self.format, read_columns).set_index(KEY)
+                continue
+            upserts = read_frame(self._path(snapshot['date'], 'upserts'),
+                                 self.format, read_columns).set_index(KEY)
+            removed = read_frame(self._path(snapshot['date'], 'removed'),
+                                 self.format)[KEY]
+            data = apply_delta(data, upserts, removed)
+        data = data.reindex(columns=columns)
+        logging.info("Restored the drop of %s from %d snapshots in %.3fs",
+                     date, position - first + 1, timer() - start)
+        return data
+
+    def stats(self):
+        """Return the row counts and the sizes of the stored drops."""
+        source_bytes = sum(snapshot['source_bytes']
+                           for snapshot in self.snapshots)
+        stored_bytes = sum(snapshot['stored_bytes']
+                           for snapshot in self.snapshots)
+        return {'drops': len(self.snapshots),
+                'bases': sum(snapshot['kind'] == 'base'
+                             for snapshot in self.snapshots),
+                'source_bytes': source_bytes, 'stored_bytes': stored_bytes,
+                'ratio': source_bytes / stored_bytes if stored_bytes else 0}
+
+
+def log_stats(stats):
+    """Log the storage ratio of the store."""
+    logging.info("%d drops, %d in full, %.1f MB stored for %.1f MB of CSV, "
+                 "%.1fx smaller", stats['drops'], stats['bases'],
+                 stats['stored_bytes'] / 1e6, stats['source_bytes'] / 1e6,
+                 stats['ratio'])
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Store and restore the Case Information drops.")
+    parser.add_argument("--store", default="snapshots",
+                        help="directory of the store, default: %(default)s")
+    parser.add_argument("--loglevel", default="INFO", help="set log level")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser("add", help="store the drop of a directory")
+    add.add_argument("data_dir", help="directory of the drop")
+    add.add_argument("--date", help="date of the drop, default: the latest "
+                                    "DateRepConf")
+    restore = commands.add_parser("restore", help="restore a stored drop")
+    restore.add_argument("date", help="date of the drop")
+    restore.add_argument("--columns", type=lambda value: value.split(","),
+                         help="comma separated columns to restore")
+    restore.add_argument("--output", help="write the drop to this CSV file")
+    commands.add_parser("list", help="list the stored drops")
+    return parser.parse_args()
+
+
+def main():
+    """Main function"""
+    args = _parse_args()
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper()))
+    store = SnapshotStore(args.store)
+    if args.command == 'add':
+        store.add_drop(args.data_dir, args.date)
+    elif args.command == 'restore':
+        data = store.restore(args.date, args.columns)
+        if args.output:
+            data.reset_index().to_csv(args.output, index=False)
+    else:
+        for snapshot in store.snapshots:
+            print(f"{snapshot['date']} {snapshot['kind']:5} "
+                  f"{snapshot['rows']:>9} rows {snapshot['stored_bytes']:>11}"
+                  f" bytes")
+        log_stats(store.stats())
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception as e:  # pylint: disable=broad-except
+        logging.error(e)
+        logging.error(traceback.format_exc())
+        sys.exit(1)
@@ -0,0 +1,426 @@
+"""
+Task graph scheduler for the chart generation.
+
+The charts are generated as many small tasks instead of a few large ones so
+that the pool is not held up by the largest task while the other workers are
+idle. Tasks may depend on the results of other tasks, like a filtered subset
+of the case information that is shared by several charts. A task is only
+submitted once all of its dependencies are done and the ready tasks are
+submitted longest first, where the length of a task is its own cost plus the
+cost of the longest chain of tasks that depend on it.
+
+The results that are needed by other tasks are not sent back and forth
+through the pool. These are written to a spill directory by the worker that
+produced them and only a reference is passed around. Each worker loads a
+shared value once and keeps it for the rest of the run.
+"""
+
+import os
+import json
+import heapq
+import fnmatch
+import pickle
+import logging
+import queue
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from covid19trackerph import memory
+from covid19trackerph import tracing
+
+
+# Number of tasks listed in the timing report.
+REPORT_TOP = 10
+
+
+class Dep:
+    """Placeholder for the result of another task in the task arguments."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"Dep({self.name!r})"
+
+
+class Ref:
+    """Reference to a value written to the spill directory."""
+
+    def __init__(self, path, run_id):
+        self.path = path
+        self.run_id = run_id
+
+    def __repr__(self):
+        return f"Ref({self.path!r})"
+
+
+class Task:
+    """A node in the task graph."""
+
+    def __init__(self, name, func, args, kwargs, deps, cost, kind):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.deps = deps
+        self.cost = cost
+        self.kind = kind
+
+
+# Values loaded by the current process. See resolve.
+_cache = {}
+_cache_run = None
+_cache_lock = threading.Lock()
+
+
+def resolve(value):
+    """Return the value referred to by the given Ref.
+
+    Values are loaded once per process and per run. Any other value is
+    returned as is.
+    """
+    global _cache_run  # pylint: disable=global-statement
+    if not isinstance(value, Ref):
+        return value
+    with _cache_lock:
+        if _cache_run != value.run_id:
+            # Drop the values of the previous run of a persistent pool.
+            _cache.clear()
+            _cache_run = value.run_id
+        if value.path not in _cache:
+            with tracing.span('load_shared_value', 'taskgraph',
+                              path=os.path.basename(value.path)), \
+                    open(value.path, 'rb') as file_handle:
+                _cache[value.path] = pickle.load(file_handle)
+        return _cache[value.path]
+
+
+def spill(value, spill_dir, key, run_id):
+    """Write the value to the spill directory and return its reference."""
+    path = os.path.join(spill_dir, f"{key}.pkl")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as file_handle:
+        pickle.dump(value, file_handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return Ref(path, run_id)
+
+
+def execute(func, args, kwargs, spill_to=None, name=None):
+    """Run a task function. This is the function submitted to the pool.
+
+    If spill_to is given as a (spill_dir, key, run_id) tuple, the result is
+    written to the spill directory and its reference is returned instead.
+    name is the name of the task in the trace. Returns the result, the start
+    and end times, the process id and the peak RSS of the process.
+    """
+    start = time.time()
+    with tracing.span(name or func.__name__, 'task'):
+        args = [resolve(arg) for arg in args]
+        kwargs = {key: resolve(value) for key, value in kwargs.items()}
+        result = func(*args, **kwargs)
+        if spill_to:
+            with tracing.span('spill', 'taskgraph'):
+                result = spill(result, *spill_to)
+    return result, start, time.time(), os.getpid(), memory.peak_rss()
+
+
+class TaskGraph:
+    """Graph of the tasks to run and their dependencies."""
+
+    def __init__(self):
+        self.tasks = {}
+        self.values = {}
+        self.timings = {}
+        self.skipped = []
+        self.wall_time = 0.0
+
+    def add_value(self, name, value):
+        """Add an already computed value that tasks can depend on."""
+        if name in self.tasks or name in self.values:
+            raise ValueError(f"Duplicate task name: {name}")
+        self.values[name] = value
+
+    def add(self, name, func, *args, deps=(), cost=1.0, kind='data',
+            **kwargs):
+        """Add a task to the graph.
+
+        Dep placeholders in the positional and keyword arguments are replaced
+        by the results of the named tasks. These are added to the
+        dependencies of the task together with the given deps. The cost is
+        the estimated duration of the task used when the previous timings are
+        not available.
+        """
+        if name in self.tasks or name in self.values:
+            raise ValueError(f"Duplicate task name: {name}")
+        all_deps = list(deps) + [
+            arg.name for arg in list(args) + list(kwargs.values())
+            if isinstance(arg, Dep)]
+        self.tasks[name] = Task(name, func, args, kwargs,
+                                list(dict.fromkeys(all_deps)), cost, kind)
+
+    def set_value(self, name, value):
+        """Set the value of a value added with add_value."""
+        if name not in self.values:
+            raise KeyError(name)
+        self.values[name] = value
+
+    def select(self, only=None, exclude=None, kind='chart', depends_on=None):
+        """Return a new graph with only the selected tasks of the given kind
+        and the tasks and values that these depend on.
+
+        A task is selected if its name matches any of the 'only' glob
+        patterns, or if no 'only' patterns are given, and does not match any
+        of the 'exclude' patterns. If depends_on is given, a task is only
+        selected if it depends, directly or not, on any of the named tasks
+        or values.
+        """
+        def matches(name, patterns):
+            return any(fnmatch.fnmatchcase(name, pattern)
+                       for pattern in patterns)
+        selected = [name for name in self.names(kind)
+                    if (not only or matches(name, only))
+                    and not (exclude and matches(name, exclude))]
+        if depends_on is not None:
+            selected = [name for name in selected
+                        if self.closure([name]) & set(depends_on)]
+        if not selected:
+            raise ValueError(f"No {kind} tasks match the selection")
+        needed = self.closure(selected)
+        subgraph = TaskGraph()
+        subgraph.values = {name: value for name, value in self.values.items()
+                           if name in needed}
+        subgraph.tasks = {name: task for name, task in self.tasks.items()
+                          if name in needed}
+        return subgraph
+
+    def closure(self, names):
+        """Return the given names and the tasks and values these depend on."""
+        needed = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name in needed:
+                continue
+            needed.add(name)
+            if name in self.tasks:
+                stack.extend(self.tasks[name].deps)
+        return needed
+
+    def names(self, kind=None):
+        """Return the names of the tasks of the given kind."""
+        return [name for name, task in self.tasks.items()
+                if kind is None or task.kind == kind]
+
+    def _dependents(self):
+        dependents = {name: [] for name in self.tasks}
+        for task in self.tasks.values():
+            for dep in task.deps:
+                if dep in dependents:
+                    dependents[dep].append(task.name)
+                elif dep not in self.values:
+                    raise ValueError(
+                        f"Unknown dependency {dep} of task {task.name}")
+        return dependents
+
+    def _estimate(self, name, estimates):
+        return estimates.get(name, self.tasks[name].cost)
+
+    def ranks(self, estimates=None):
+        """Return the length of the longest chain of tasks from each task.
+
+        The estimated durations are taken from the given estimates, usually
+        the timings of the previous run, or from the cost of the task.
+        """
+        estimates = estimates or {}
+        dependents = self._dependents()
+        ranks = {}
+
+        def rank(name):
+            if name not in ranks:
+                ranks[name] = self._estimate(name, estimates) + max(
+                    (rank(dependent) for dependent in dependents[name]),
+                    default=0)
+            return ranks[name]
+        for name in self.tasks:
+            rank(name)
+        return ranks
+
+    def _resolve_args(self, task, results):
+        def replace(arg):
+            if isinstance(arg, Dep):
+                return (self.values[arg.name] if arg.name in self.values
+                        else results[arg.name])
+            return arg
+        return ([replace(arg) for arg in task.args],
+                {key: replace(value) for key, value in task.kwargs.items()})
+
+    def _spill_values(self, spill_dir, run_id):
+        values = {}
+        for index, (name, value) in enumerate(self.values.items()):
+            if spill_dir:
+                value = spill(value, spill_dir, f"value{index}", run_id)
+            values[name] = value
+        return values
+
+    def run(self, pool, workers=1, estimates=None, spill_dir=None,
+            deadline=None):
+        """Run the tasks in the given pool and return their results.
+
+        At most 'workers' tasks are in the pool at any time so that the
+        order in which the tasks are started is decided here. If spill_dir is
+        None, the shared values are passed to the tasks directly which is
+        only sensible for pools that run in the current process.
+
+        If a deadline is given as a time.time() value, no task is started
+        after it. The tasks that were not run are listed in skipped and are
+        left out of the results.
+        """
+        # pylint: disable=too-many-arguments,too-many-statements
+        # pylint: disable=too-many-locals
+        dependents = self._dependents()
+        ranks = self.ranks(estimates)
+        run_id = uuid.uuid4().hex
+        values = self.values
+        self.values = self._spill_values(spill_dir, run_id)
+        remaining = {name: len([dep for dep in task.deps
+                                if dep not in self.values])
+                     for name, task in self.tasks.items()}
+        # Ties are broken by the order the tasks were added.
+        order = {name: index for index, name in enumerate(self.tasks)}
+        ready = [(-ranks[name], order[name], name)
+                 for name, count in remaining.items() if count == 0]
+        heapq.heapify(ready)
+        done = queue.Queue()
+        results = {}
+        pending_dependents = {name: len(dependents[name])
+                              for name in self.tasks}
+        in_flight = 0
+        finished = 0
+        self.timings = {}
+        self.skipped = []
+        run_start = time.time()
+        try:
+            while finished < len(self.tasks):
+                expired = deadline is not None and time.time() >= deadline
+                while ready and in_flight < max(1, workers) and not expired:
+                    _, _, name = heapq.heappop(ready)
+                    task = self.tasks[name]
+                    args, kwargs = self._resolve_args(task, results)
+                    spill_to = ((spill_dir, f"task{order[name]}", run_id)
+                                if spill_dir and dependents[name] else None)
+                    if spill_dir and memory.is_enabled():
+                        # Only the process pools pickle the arguments.
+                        memory.record_task_args(name, (task.func, args,
+                                                       kwargs))
+                    pool.apply_async(
+                        execute, (task.func, args, kwargs, spill_to, name),
+                        callback=lambda result, name=name: done.put(
+                            (name, result, None)),
+                        error_callback=lambda error, name=name: done.put(
+                            (name, None, error)))
+                    in_flight += 1
+                if not in_flight:
+                    break
+                name, result, error = done.get()
+                in_flight -= 1
+                finished += 1
+                if error is not None:
+                    logging.error("Task %s failed", name)
+                    raise error
+                results[name], start, end, pid, peak_rss = result
+                self.timings[name] = {'start': start - run_start,
+                                      'duration': end - start, 'pid': pid,
+                                      'peak_rss': peak_rss}
+                memory.record_worker(pid, peak_rss)
+                for dep in self.tasks[name].deps:
+                    if dep in pending_dependents:
+                        pending_dependents[dep] -= 1
+                        if pending_dependents[dep] == 0:
+                            # Nothing needs the intermediate result anymore.
+                            results[dep] = None
+                for dependent in dependents[name]:
+                    remaining[dependent] -= 1
+                    if remaining[dependent] == 0:
+                        heapq.heappush(ready, (-ranks[dependent],
+                                               order[dependent], dependent))
+        finally:
+            self.values = values
+        self.wall_time = time.time() - run_start
+        self.skipped = [name for name in self.tasks
+                        if name not in self.timings]
+        if self.skipped:
+            logging.warning("Skipped %d tasks after the deadline",
+                            len(self.skipped))
+        return results
+
+    def critical_path(self):
+        """Return the chain of tasks with the longest measured duration."""
+        finish = {}
+        previous = {}
+
+        def path_length(name):
+            if name not in finish:
+                task = self.tasks[name]
+                deps = [dep for dep in task.deps if dep in self.tasks]
+                longest = max(deps, key=path_length, default=None)
+                previous[name] = longest
+                finish[name] = self.timings[name]['duration'] + (
+                    path_length(longest) if longest else 0)
+            return finish[name]
+        timed = [name for name in self.tasks if name in self.timings]
+        if not timed:
+            return [], 0
+        last = max(timed, key=path_length)
+        path = []
+        name = last
+        while name:
+            path.append(name)
+            name = previous[name]
+        return list(reversed(path)), finish[last]
+
+    def report(self, workers=1):
+        """Log the task timings and the critical path of the last run."""
+        if not self.timings:
+            return
+        total = sum(timing['duration'] for timing in self.timings.values())
+        wall_time = self.wall_time
+        logging.info("Ran %d tasks in %s, %s of task time on %d workers "
+                     "(%.0f%% utilization)", len(self.timings),
+                     timedelta(seconds=wall_time), timedelta(seconds=total),
+                     workers,
+                     100 * total / (wall_time * workers) if wall_time else 0)
+        slowest = sorted(self.timings.items(),
+                         key=lambda item: item[1]['duration'], reverse=True)
+        logging.info("Slowest tasks:")
+        for name, timing in slowest[:REPORT_TOP]:
+            logging.info("  %s: %s", name,
+                         timedelta(seconds=timing['duration']))
+        path, length = self.critical_path()
+        logging.info("Critical path %s: %s", timedelta(seconds=length),
+                     " -> ".join(path))
+
+
+def load_timings(path):
+    """Load the task durations saved by save_timings."""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as file_handle:
+            return json.load(file_handle)
+    except ValueError:
+        logging.warning("Ignoring invalid task timings file %s", path)
+        return {}
+
+
+def save_timings(path, graph):
+    """Save the task durations of the last run as estimates for the next."""
+    durations = load_timings(path)
+    durations.update({name: timing['duration']
+                      for name, timing in graph.timings.items()})
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file_handle:
+        json.dump(durations, file_handle, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
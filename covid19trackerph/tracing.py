@@ -0,0 +1,232 @@
+"""
+Tracing of the data preparation, the chart generation and the downloads.
+
+The timing report of a run only gives the totals of each stage. A trace
+records a span for each step instead: the data preparation and its
+derivation steps, every task and plot function, the rendering of each chart
+file and each data drop download, with the process and thread that ran it.
+
+Tracing is off unless it is started with a trace directory. Each process
+appends its finished spans to its own file in the directory, so the pool
+workers only need to be started with the same directory. At the end of the
+run the files are merged into a single JSON file in the Chrome trace event
+format which can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import functools
+import contextlib
+import collections
+import time
+from datetime import timedelta
+
+
+# Number of span names listed in the trace summary.
+REPORT_TOP = 10
+EVENTS_SUFFIX = ".jsonl"
+
+# Trace directory of the current process. Tracing is off while it is None.
+_trace_dir = None
+_file = None
+_file_pid = None
+_named_threads = set()
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """Drop the trace file of the parent in a forked child."""
+    global _lock, _file, _file_pid  # pylint: disable=global-statement
+    _lock = threading.Lock()
+    _file = None
+    _file_pid = None
+    _named_threads.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def start(directory):
+    """Record the spans of the current process in the given directory."""
+    global _trace_dir  # pylint: disable=global-statement
+    with _lock:
+        _trace_dir = directory
+
+
+def stop():
+    """Stop recording the spans of the current process."""
+    global _trace_dir, _file, _file_pid  # pylint: disable=global-statement
+    with _lock:
+        _trace_dir = None
+        if _file is not None and _file_pid == os.getpid():
+            _file.close()
+        _file = None
+        _file_pid = None
+        _named_threads.clear()
+
+
+def trace_dir():
+    """Return the trace directory of the current process or None."""
+    return _trace_dir
+
+
+def is_enabled():
+    """Whether the spans of the current process are recorded."""
+    return _trace_dir is not None
+
+
+def now():
+    """Return the current time in microseconds.
+
+    The monotonic clock is shared by the processes of the machine so the
+    spans of the workers line up with those of the main process.
+    """
+    return time.perf_counter_ns() / 1000
+
+
+def _write(events):
+    """Append the events to the trace file of the current process."""
+    global _file, _file_pid  # pylint: disable=global-statement
+    with _lock:
+        if _trace_dir is None:
+            return
+        pid = os.getpid()
+        if _file is None or _file_pid != pid:
+            _file = open(  # pylint: disable=consider-using-with
+                os.path.join(_trace_dir, f"{pid}{EVENTS_SUFFIX}"), 'a',
+                encoding='utf-8')
+            _file_pid = pid
+        thread = threading.current_thread()
+        if thread.ident not in _named_threads:
+            _named_threads.add(thread.ident)
+            _file.write(json.dumps({
+                'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                'tid': thread.ident, 'args': {'name': thread.name}}) + "\n")
+        for event in events:
+            _file.write(json.dumps(event, default=str) + "\n")
+        # A worker may be terminated at any time so nothing is buffered.
+        _file.flush()
+
+
+@contextlib.contextmanager
+def span(name, category='trackerchart', **args):
+    """Record the time spent in the with block as a span.
+
+    The keyword arguments are shown with the span in the trace viewer.
+    """
+    if _trace_dir is None:
+        yield
+        return
+    start_time = now()
+    try:
+        yield
+    finally:
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start_time,
+                 'dur': now() - start_time, 'pid': os.getpid(),
+                 'tid': threading.get_ident()}
+        if args:
+            event['args'] = args
+        _write([event])
+
+
+def traced(category='trackerchart'):
+    """Decorator that records each call of the function as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(func.__name__, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def read_events(directory):
+    """Read the events written by every process to the trace directory."""
+    events = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(EVENTS_SUFFIX):
+            continue
+        with open(os.path.join(directory, file_name),
+                  encoding='utf-8') as file_handle:
+            for line in file_handle:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # The last line of a terminated worker may be cut off.
+                    logging.debug("Skipping a partial trace event in %s",
+                                  file_name)
+    return events
+
+
+def merge(directory, path, main_pid=None):
+    """Merge the events in the trace directory into a Chrome trace file.
+
+    Returns the events.
+    """
+    main_pid = main_pid or os.getpid()
+    events = read_events(directory)
+    pids = sorted({event['pid'] for event in events})
+    for pid in pids:
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'args': {'name': ("main" if pid == main_pid
+                                         else f"worker {pid}")}})
+        # The main process is listed first.
+        events.append({'name': 'process_sort_index', 'ph': 'M', 'pid': pid,
+                       'args': {'sort_index': 0 if pid == main_pid else pid}})
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file_handle:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                  file_handle)
+    os.replace(tmp_path, path)
+    return events
+
+
+def summarize(events):
+    """Return the count and the total duration in seconds of each span name,
+    longest first."""
+    totals = collections.defaultdict(lambda: [0, 0.0])
+    for event in events:
+        if event.get('ph') == 'X':
+            totals[event['name']][0] += 1
+            totals[event['name']][1] += event['dur'] / 1e6
+    return sorted(((name, count, seconds)
+                   for name, (count, seconds) in totals.items()),
+                  key=lambda item: item[2], reverse=True)
+
+
+def log_summary(events):
+    """Log the span names with the longest total duration."""
+    logging.info("Longest spans by total time:")
+    for name, count, seconds in summarize(events)[:REPORT_TOP]:
+        logging.info("  %s: %s in %d spans", name, timedelta(seconds=seconds),
+                     count)
+
+
+@contextlib.contextmanager
+def tracing(path):
+    """Trace the with block and the workers started in it to the given
+    Chrome trace file.
+
+    The workers must be started with the trace directory of trace_dir. Does
+    nothing if path is None.
+    """
+    if path is None:
+        yield
+        return
+    directory = tempfile.mkdtemp(prefix="trace-")
+    start(directory)
+    try:
+        yield
+    finally:
+        stop()
+        try:
+            events = merge(directory, path)
+            logging.info("Wrote %d trace events to %s", len(events), path)
+            log_summary(events)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
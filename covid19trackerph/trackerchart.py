@@ -13,18 +13,25 @@ mun: municipality
 
 import os
 from datetime import timedelta
+import functools
 import logging
 import shutil
 import pathlib
-import multiprocessing as mp
+import tempfile
+import threading
 import typing
 from timeit import default_timer as timer
 
 import pandas as pd
 import numpy as np
-from scipy.interpolate import interp1d
 import plotly.express as px
 
+from covid19trackerph import execution
+from covid19trackerph import memory
+from covid19trackerph import outputsink
+from covid19trackerph import taskgraph
+from covid19trackerph import tracing
+
 
 SCRIPT_DIR = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
 CHART_OUTPUT = os.path.join(SCRIPT_DIR, "charts")
@@ -36,6 +43,9 @@ TABLE_OUTPUT = os.path.join(SCRIPT_DIR, "_includes", "tracker", "charts")
 CHART_WIDTH = 1000
 CHART_HEIGHT = CHART_WIDTH * 9 / 16  # 16:9 aspect ratio
 
+# Task durations of the previous run. Saved in the data directory.
+TASK_TIMINGS = "taskgraph-timings.json"
+
 TEMPLATE = 'plotly_dark'
 PERIOD_DAYS = [14, 30]
 WEEKLY_FREQ = 'W-SUN'
@@ -57,25 +67,129 @@ AGE_GROUP_CATEGORY_ARRAY = ['0 to 4', '5 to 9', '10 to 14', '15 to 19',
 
 
 # Number of processes to launch when applying a parallel processing.
-# We leave one core idle to avoid hogging all the resources.
-num_processes = 1 if (mp.cpu_count() <= 2) else mp.cpu_count() - 1
+num_processes = execution.default_workers()
+
+# Each process writes its chart files through its own background sink.
+_output_sink = None
+# Chart file formats written by write_chart. See set_output_formats.
+output_formats = list(outputsink.DEFAULT_CHART_FORMATS)
+# Plotly figures share their template objects which are not thread safe, so
+# only one plot function runs at a time in a process. The process workers run
+# one task at a time anyway.
+_plot_lock = threading.Lock()
+
+
+def get_output_sink() -> outputsink.OutputSink:
+    """Return the output sink of the current process."""
+    global _output_sink  # pylint: disable=global-statement
+    if _output_sink is None:
+        _output_sink = outputsink.OutputSink()
+    return _output_sink
+
+
+def set_output_sink(sink):
+    """Replace the output sink of the current process and return the
+    previous one, which may be None."""
+    global _output_sink  # pylint: disable=global-statement
+    previous, _output_sink = _output_sink, sink
+    return previous
+
+
+def set_output_formats(formats):
+    """Set the chart file formats written by the current process.
+
+    This is called by the pool initializer so that the workers write the
+    same formats regardless of the multiprocessing start method.
+    """
+    global output_formats  # pylint: disable=global-statement,invalid-name
+    unsupported = set(formats) - set(outputsink.CHART_FORMATS)
+    if unsupported:
+        raise ValueError(f"Unsupported chart formats: {sorted(unsupported)}")
+    output_formats = list(formats)
+
+
+def run_task(func, *args, **kwargs):
+    """Run the plot function then wait for its files to be written.
+
+    This is the function submitted to the pool so that a task is only reported
+    as done once all of its files are in place. Returns the process id and the
+    output sink metrics of the worker.
+    """
+    with _plot_lock, tracing.span(func.__name__):
+        func(*args, **kwargs)
+    sink = get_output_sink()
+    with tracing.span('flush_output'):
+        sink.flush()
+    return os.getpid(), sink.metrics()
+
 
+def set_output_dirs(chart_output, table_output):
+    """Set the directories of the chart and table files of the current
+    process."""
+    global CHART_OUTPUT, TABLE_OUTPUT  # pylint: disable=global-statement
+    CHART_OUTPUT, TABLE_OUTPUT = chart_output, table_output
 
-def apply_parallel(df: pd.DataFrame, func, n_proc=num_processes):
+
+def init_worker(formats, trace_dir=None, output_dirs=None):
+    """Initialize a pool worker.
+
+    The workers write the given chart formats to the given (chart, table)
+    output directories and record their spans in the trace directory if one
+    is given.
+    """
+    set_output_formats(formats)
+    if output_dirs:
+        set_output_dirs(*output_dirs)
+    if trace_dir:
+        tracing.start(trace_dir)
+
+
+def create_pool(executor: str = 'process',
+                workers: typing.Optional[int] = None,
+                start_method: typing.Optional[str] = None,
+                formats: typing.Optional[typing.List[str]] = None):
+    """Create the worker pool of a run.
+
+    The workers write the given chart formats, HTML and PNG by default, so
+    the pool must be created with the formats passed to plot. The workers
+    write to the output directories of the current process, even when these
+    were changed after the import, since spawned workers import this module
+    again. If the current process is traced, the workers are traced to the
+    same directory.
+    """
+    return execution.WorkerPool(
+        executor, workers or num_processes, start_method,
+        initializer=init_worker,
+        initargs=(formats or outputsink.DEFAULT_CHART_FORMATS,
+                  tracing.trace_dir(), (CHART_OUTPUT, TABLE_OUTPUT)))
+
+
+def apply_parallel(df: pd.DataFrame, func,
+                   pool: typing.Optional[execution.WorkerPool] = None):
     """ Apply function to the dataframe using multiprocessing.
 
     The initial plan was to use modin but because there are still a lot of
     missing features and instability in modin, I've resorted to doing the
-    parallel processing in here.
+    parallel processing in here. The dataframe is split between the workers
+    of the given pool. A process pool is created for the call if none is
+    given.
     """
-    logging.info("Running multiprocessing on %s with %d processes",
-                 func.__name__, n_proc)
-    df_split = np.array_split(df, n_proc)
-    with mp.Pool(n_proc) as pool:
-        df = pd.concat(pool.map(func, df_split))
-        pool.close()
-        pool.join()
-    return df
+    if pool is None:
+        with create_pool() as new_pool:
+            return apply_parallel(df, func, new_pool)
+    logging.info("Running %s on %d %s workers", func.__name__, pool.workers,
+                 pool.executor)
+    with tracing.span('apply_parallel', func=func.__name__, rows=len(df),
+                      workers=pool.workers):
+        df_split = np.array_split(df, pool.workers)
+        if memory.is_enabled() and not pool.in_process:
+            for index, chunk in enumerate(df_split):
+                memory.record_task_args(f"{func.__name__}[{index}]", chunk)
+        results = pool.map(functools.partial(memory.measured, func),
+                           df_split)
+        for _, pid, peak_rss in results:
+            memory.record_worker(pid, peak_rss)
+        return pd.concat([result for result, _, _ in results])
 
 
 def write_table(header, body, filename):
@@ -86,21 +200,20 @@ def write_table(header, body, filename):
         row_html = "".join(f"<td>{cell}</td>" for cell in row)
         table += f"<tr>{row_html}</tr>"
     table = f"<div><table>{table}</table></div>"
-    with open(f"{TABLE_OUTPUT}/{filename}.html", 'w', encoding='utf-8') as file:
-        file.write(table)
+    get_output_sink().submit_table(table, TABLE_OUTPUT, filename)
 
 
 def write_chart(fig, filename):
     """Generate the chart files from the given figure object and filename."""
     logging.info("Writing %s", filename)
-    fig.update_layout(template=TEMPLATE)
-    fig.update_layout(margin=dict(l=5, r=5, b=50, t=70))
-    # Max width of the grid is 1000px. Change these values when the layout
-    # is changed.
-    fig.write_image(f"{CHART_OUTPUT}/{filename}.png",
-                    width=CHART_WIDTH, height=CHART_HEIGHT)
-    fig.write_html(f"{CHART_OUTPUT}/{filename}.html", include_plotlyjs='cdn',
-                   full_html=False)
+    with tracing.span('write_chart', filename=filename):
+        fig.update_layout(template=TEMPLATE)
+        fig.update_layout(margin=dict(l=5, r=5, b=50, t=70))
+        # Max width of the grid is 1000px. Change these values when the
+        # layout is changed.
+        get_output_sink().submit_chart(fig, CHART_OUTPUT, filename,
+                                       formats=output_formats,
+                                       width=CHART_WIDTH, height=CHART_HEIGHT)
 
 
 def plot_for_period(
@@ -178,6 +291,10 @@ def moving_average(data, column, days=7):
 
 def doubling_time(series):
     """Calculate the doubling time."""
+    # scipy.interpolate takes longer to import than pandas and is only needed
+    # here so it is not imported by every worker on start-up.
+    # pylint: disable=import-outside-toplevel
+    from scipy.interpolate import interp1d
     y = series.to_numpy()
     x = np.arange(y.shape[0])
     func = interp1d(y, x, fill_value="extrapolate")
@@ -203,6 +320,13 @@ def agg_count_cumsum_by_date(data, cumsum, group, date):
     day.
     """
     agg = data.groupby([group, weekly_grouper(date)]).count()
+    return fill_cumsum_by_date(agg, data, cumsum, group, date)
+
+
+def fill_cumsum_by_date(agg, data, cumsum, group, date):
+    """Fill the weeks missing from the weekly counts of each group with 0
+    and get the cumsum of the cumsum column. See agg_count_cumsum_by_date.
+    """
     # Create new index for filling empty days with 0
     unique_index = agg.index.unique(level=group)
     date_range = pd.DatetimeIndex(
@@ -374,84 +498,84 @@ def plot_pie_chart(data, agg_func=None, values=None, names=None, title=None,
     write_chart_fn(fig, filename)
 
 
+TEST_DAILY_COLUMNS = ['daily_output_samples_tested',
+                      'daily_output_unique_individuals',
+                      'daily_output_positive_individuals', ]
+TEST_CUMULATIVE_COLUMNS = ['cumulative_samples_tested',
+                           'cumulative_unique_individuals',
+                           'cumulative_positive_individuals']
+
+
+def plot_test_trend(test_data, column):
+    """Plot the trend of the given testing aggregates column."""
+    title = column.replace("daily_output_", "").replace("_", " ")
+    plot_trend_chart(test_data, agg_func='sum', x='report_date',
+                     y=column, title=title, filename=column, color='REGION')
+
+
 def plot_test(test_data):
     """Plot test data."""
     # daily
-    x = 'report_date'
-    daily_columns = ['daily_output_samples_tested',
-                     'daily_output_unique_individuals',
-                     'daily_output_positive_individuals', ]
-    for column in daily_columns:
-        title = column.replace("daily_output_", "").replace("_", " ")
-        plot_trend_chart(test_data, agg_func='sum', x=x,
-                         y=column, title=title,
-                         filename=column,
-                         color='REGION')
+    for column in TEST_DAILY_COLUMNS:
+        plot_test_trend(test_data, column)
     # cumulative
-    cumulative_columns = ['cumulative_samples_tested',
-                          'cumulative_unique_individuals',
-                          'cumulative_positive_individuals']
     filtered = filter_day_of_week(test_data, 'report_date')
-    for column in cumulative_columns:
-        title = column.replace("_", " ")
-        plot_trend_chart(filtered, agg_func='sum', x=x,
-                         y=column, title=title,
-                         filename=column, color='REGION')
+    for column in TEST_CUMULATIVE_COLUMNS:
+        plot_test_trend(filtered, column)
 
 
-def plot_reporting(ci_data, days=None):
-    """Plot reporting data."""
+REPORTING_CHARTS = [
+    ['SpecimenToRepConf', "Specimen Collection to Reporting"],
+    ['SpecimenToRelease', "Specimen Collection To Result Release"],
+    ['ReleaseToRepConf', "Result Release To Reporting"]
+]
+
+
+def plot_reporting_histogram(ci_data, column, title, days=None):
+    """Plot the histogram of the given reporting delay column."""
     def filter_by_rep_conf(df, days=days):
         return filter_latest(df, days, date_column='DateRepConf')
-    to_plot = [
-        ['SpecimenToRepConf', "Specimen Collection to Reporting"],
-        ['SpecimenToRelease', "Specimen Collection To Result Release"],
-        ['ReleaseToRepConf', "Result Release To Reporting"]
-    ]
-    for col_title in to_plot:
-        column = col_title[0]
-        title = col_title[1]
-        plot_for_period(ci_data, plot_histogram, filter_by_rep_conf,
-                        xaxis=column, xaxis_title=title)
+    plot_for_period(ci_data, plot_histogram, filter_by_rep_conf,
+                    xaxis=column, xaxis_title=title)
+
+
+def plot_reporting(ci_data, days=None):
+    """Plot reporting data."""
+    for column, title in REPORTING_CHARTS:
+        plot_reporting_histogram(ci_data, column, title, days=days)
+
+
+def case_trend_charts(title, filename, colors=None):
+    """Return the aggregate function, title, filename and color of each of
+    the case trend charts.
+    """
+    charts = []
+    for color in colors or [None]:
+        suffix = color or ""
+        charts.append(('count', title, f"{filename}{suffix}", color))
+        charts.append(('cumsum', f"{title} - Cumulative",
+                       f"{filename}Cumulative{suffix}", color))
+    return charts
 
 
 def plot_case_trend(ci_data, x, title="", filename="", colors=None,
                     vertical_marker=None, write_chart_fn=write_chart):
     """Generate plot case trend."""
-    y = 'CaseCode'
-    if colors:
-        def plot_fn_color(agg_func, title, filename, color):
-            return (
-                plot_trend_chart(ci_data, agg_func, x=x, y=y, title=title,
-                                 filename=filename, color=color,
-                                 vertical_marker=vertical_marker,
-                                 write_chart_fn=write_chart_fn))
-        for color in colors:
-            plot_fn_color('count', title, f"{filename}{color}", color)
-            plot_fn_color('cumsum', f"{title} - Cumulative",
-                          f"{filename}Cumulative{color}", color)
-    else:
-        def plot_fn(agg_func, title, filename):
-            return (
-                plot_trend_chart(ci_data, agg_func, x=x, y=y, title=title,
-                                 filename=filename,
-                                 vertical_marker=vertical_marker,
-                                 write_chart_fn=write_chart_fn))
-        plot_fn('count', title, f"{filename}")
-        plot_fn('cumsum', f"{title} - Cumulative", f"{filename}Cumulative")
+    for agg_func, chart_title, chart_filename, color in case_trend_charts(
+            title, filename, colors):
+        plot_trend_chart(ci_data, agg_func, x=x, y='CaseCode',
+                         title=chart_title, filename=chart_filename,
+                         color=color, vertical_marker=vertical_marker,
+                         write_chart_fn=write_chart_fn)
 
 
-def plot_active_cases(ci_data):
-    """Generate active cases charts."""
-    closed = None
-    active = None
-    for name, group in ci_data.groupby([CASE_STATUS]):
-        if name == 'CLOSED':
-            closed = group
-        elif name == 'ACTIVE':
-            active = group
-        else:
-            logging.warning("Ignoring group %s", name)
+def filter_case_status(data, status):
+    """Return only the rows with the given CaseStatus."""
+    return data[data[CASE_STATUS] == status]
+
+
+def calc_active_trend(ci_data, closed):
+    """Calculate the weekly active cases by region."""
     ci_agg = agg_count_cumsum_by_date(
         ci_data, 'CaseCode', REGION, 'DateOnset').reset_index()
     closed_agg = agg_count_cumsum_by_date(
@@ -471,26 +595,85 @@ def plot_active_cases(ci_data):
     # The active cases count is calculated by subtracting the number of closed
     # cases (CaseCode_y) from the number of confirmed cases (CaseCode_x).
     merged['ActiveCount'] = merged['CaseCode_x'] - merged['CaseCode_y']
-    # Plot the trend after calculating the number of active cases.
-    plot_trend_chart(merged, y='ActiveCount', title="Active Cases",
+    return merged
+
+
+def plot_active_trend(active_trend):
+    """Plot the active cases trend from the calc_active_trend data."""
+    plot_trend_chart(active_trend, y='ActiveCount', title="Active Cases",
                      filename="Active", color=REGION, vertical_marker=14)
-    # No need to filter these charts per period because the active cases are
-    # always at the present time.
-    for area in [CITY_MUN, REGION]:
-        filtered_active = filter_top(active, area, 'CaseCode')
-        plot_horizontal_bar(filtered_active, x='CaseCode', y=area,
-                            filename=f"TopActive{area}",
-                            title="Top 10 "+area,
-                            color="HealthStatus", order='total ascending')
+
+
+def plot_top_active(active, area):
+    """Plot the areas with the most active cases."""
+    filtered_active = filter_top(active, area, 'CaseCode')
+    plot_horizontal_bar(filtered_active, x='CaseCode', y=area,
+                        filename=f"TopActive{area}",
+                        title="Top 10 "+area,
+                        color="HealthStatus", order='total ascending')
+
+
+def plot_active_age_group(active):
+    """Plot the active cases by age group."""
     plot_horizontal_bar(
         active, x='CaseCode', y='AgeGroup', filename="ActiveAgeGroup",
         title="Active Cases by Age Group", color='HealthStatus',
         category_array=AGE_GROUP_CATEGORY_ARRAY)
+
+
+def plot_active_pie(active):
+    """Plot the health status of the active cases."""
     plot_pie_chart(active, agg_func='count', values='CaseCode',
                    names='HealthStatus', title='Active Cases Health Status',
                    filename='ActivePie')
 
 
+def plot_active_cases(ci_data):
+    """Generate active cases charts."""
+    active = filter_case_status(ci_data, 'ACTIVE')
+    closed = filter_case_status(ci_data, 'CLOSED')
+    # Plot the trend after calculating the number of active cases.
+    plot_active_trend(calc_active_trend(ci_data, closed))
+    # No need to filter these charts per period because the active cases are
+    # always at the present time.
+    for area in [CITY_MUN, REGION]:
+        plot_top_active(active, area)
+    plot_active_age_group(active)
+    plot_active_pie(active)
+
+
+def plot_top_area(data, area, area_file_name, area_color=None, top_num=10):
+    """Plot the areas with the most cases for the overall data and for each
+    period.
+    """
+    filtered_top = filter_top(data, area, 'CaseCode', num=top_num)
+    plot_for_period(
+        filtered_top, plot_horizontal_bar, filter_latest_by_onset,
+        x='CaseCode', y=area, filename=f"{area_file_name}{area}",
+        title=f"Top {top_num} {area}", color=area_color,
+        order='total ascending')
+
+
+def plot_age_group(data, title, age_group_file_name, age_group_color=None):
+    """Plot the cases by age group for the overall data and for each period."""
+    plot_for_period(data, plot_horizontal_bar, filter_latest_by_onset,
+                    x='CaseCode', y='AgeGroup', filename=age_group_file_name,
+                    title=f"{title} by Age Group", color=age_group_color,
+                    category_array=AGE_GROUP_CATEGORY_ARRAY)
+
+
+def plot_health_status(data, title, health_status_filename):
+    """Plot the health status of the cases for the overall data and for each
+    period.
+    """
+    plot_for_period(data, plot_pie_chart,
+                    lambda df, days: filter_latest(df, days, 'DateOnset'),
+                    agg_func='count',
+                    values='CaseCode', names='HealthStatus',
+                    title=f"{title} Health Status",
+                    filename=health_status_filename)
+
+
 def plot_cases(data, title, preprocess=None, trend_col=None, trend_colors=None,
                area_file_name=None, area_color=None,
                age_group_file_name=None, age_group_color=None,
@@ -504,27 +687,13 @@ def plot_cases(data, title, preprocess=None, trend_col=None, trend_colors=None,
     plot_case_trend(data, trend_col, title, trend_col,
                     colors=trend_colors, vertical_marker=14)
     # top area
-    top_num = 10
     for area in [CITY_MUN, REGION]:
-        filtered_top = filter_top(data, area, 'CaseCode', num=top_num)
-        plot_for_period(
-            filtered_top, plot_horizontal_bar, filter_latest_by_onset,
-            x='CaseCode', y=area, filename=f"{area_file_name}{area}",
-            title=f"Top {top_num} {area}", color=area_color,
-            order='total ascending')
+        plot_top_area(data, area, area_file_name, area_color)
     # by age group
-    plot_for_period(data, plot_horizontal_bar, filter_latest_by_onset,
-                    x='CaseCode', y='AgeGroup', filename=age_group_file_name,
-                    title=f"{title} by Age Group", color=age_group_color,
-                    category_array=AGE_GROUP_CATEGORY_ARRAY)
+    plot_age_group(data, title, age_group_file_name, age_group_color)
     # health status
     if optional and 'health_status' in optional:
-        plot_for_period(data, plot_pie_chart,
-                        lambda df, days: filter_latest(df, days, 'DateOnset'),
-                        agg_func='count',
-                        values='CaseCode', names='HealthStatus',
-                        title=f"{title} Health Status",
-                        filename=health_status_filename)
+        plot_health_status(data, title, health_status_filename)
 
 
 def filter_latest_by_onset(df, days):
@@ -535,186 +704,347 @@ def filter_latest_by_onset(df, days):
     return filter_latest(df, days, 'DateOnset')
 
 
-def plot_ci_async(pool, data):
-    """Generate charts asynchronously."""
-    return [
-        # confirmed cases
-        pool.apply_async(plot_cases, (data, 'Confirmed Cases',),
-                         dict(trend_col='DateOnset',
-                              trend_colors=[CASE_REP_TYPE,
-                                            'Region', ONSET_PROXY],
-                              area_file_name='TopConfirmedCase',
-                              area_color='HealthStatus',
-                              age_group_file_name='ConfirmedAgeGroup',
-                              age_group_color='HealthStatus',
-                              optional=['health_status'],
-                              health_status_filename='ConfirmedPie',
-                              )),
-        # recovery
-        pool.apply_async(plot_cases, (data, 'Recovery',),
-                         dict(preprocess=filter_recovered,
-                              trend_col='DateRecover', trend_colors=['Region', RECOVER_PROXY],
-                              area_file_name='TopRecovery',
-                              age_group_file_name='RecoveryAgeGroup')),
-        # death
-        pool.apply_async(plot_cases, (data, 'Death',),
-                         dict(preprocess=filter_died,
-                              trend_col='DateDied', trend_colors=['Region'],
-                              area_file_name='TopDeath', age_group_file_name='DeathAgeGroup'))
-    ]
+# The plot_cases arguments of the confirmed cases, recovery and death charts.
+CASE_CHARTS = [
+    # confirmed cases
+    dict(title='Confirmed Cases', trend_col='DateOnset',
+         trend_colors=[CASE_REP_TYPE, 'Region', ONSET_PROXY],
+         area_file_name='TopConfirmedCase', area_color='HealthStatus',
+         age_group_file_name='ConfirmedAgeGroup',
+         age_group_color='HealthStatus', optional=['health_status'],
+         health_status_filename='ConfirmedPie'),
+    # recovery
+    dict(title='Recovery', preprocess=filter_recovered,
+         trend_col='DateRecover', trend_colors=['Region', RECOVER_PROXY],
+         area_file_name='TopRecovery', age_group_file_name='RecoveryAgeGroup'),
+    # death
+    dict(title='Death', preprocess=filter_died,
+         trend_col='DateDied', trend_colors=['Region'],
+         area_file_name='TopDeath', age_group_file_name='DeathAgeGroup'),
+]
+
+# Estimated cost of a chart task in number of chart files. This is only used
+# when the task has no timing from a previous run.
+PERIOD_CHART_COST = len(PERIOD_DAYS) + 1
+
+
+def add_case_chart_tasks(graph, data, title, preprocess=None, trend_col=None,
+                         trend_colors=None, area_file_name=None,
+                         area_color=None, age_group_file_name=None,
+                         age_group_color=None, optional=None,
+                         health_status_filename=None):
+    """Add the tasks of the charts generated by plot_cases to the graph."""
+    # pylint: disable=too-many-arguments
+    if preprocess:
+        subset = f"ci_data:{preprocess.__name__}"
+        graph.add(subset, preprocess, data)
+        data = taskgraph.Dep(subset)
+    for agg_func, chart_title, filename, color in case_trend_charts(
+            title, trend_col, trend_colors):
+        graph.add(filename, run_task, plot_trend_chart, data, agg_func,
+                  x=trend_col, y='CaseCode', title=chart_title,
+                  filename=filename, color=color, vertical_marker=14,
+                  kind='chart', cost=PERIOD_CHART_COST)
+    for area in [CITY_MUN, REGION]:
+        graph.add(f"{area_file_name}{area}", run_task, plot_top_area, data,
+                  area, area_file_name, area_color, kind='chart',
+                  cost=PERIOD_CHART_COST)
+    graph.add(age_group_file_name, run_task, plot_age_group, data, title,
+              age_group_file_name, age_group_color, kind='chart',
+              cost=PERIOD_CHART_COST)
+    if optional and 'health_status' in optional:
+        graph.add(health_status_filename, run_task, plot_health_status, data,
+                  title, health_status_filename, kind='chart',
+                  cost=PERIOD_CHART_COST)
 
 
-def plot_summary(ci_data, test_data):
-    """Generate summary table."""
-    # Using the format key on the cells will apply the formatting to all of
-    # the columns and we don't want that applied to the first column so we need
-    # to do the formatting for now.
-    def format_num(num):
-        return f'{num:,}'
-    date_format = "%Y-%m-%d"
-    # confirmed cases
-    last_case_reported = ci_data['DateRepConf'].max().strftime(date_format)
-    total_confirmed = format_num(ci_data['CaseCode'].count())
-    total_active = format_num(
-        ci_data[ci_data[CASE_STATUS] == 'ACTIVE']['CaseCode'].count())
-    total_death = format_num(
-        ci_data[ci_data['HealthStatus'] == 'DIED']['CaseCode'].count())
-    new_confirmed = format_num(
-        ci_data[ci_data[CASE_REP_TYPE] == 'New Case']['CaseCode'].count())
+def build_chart_graph(ci_data=None, test_data=None) -> taskgraph.TaskGraph:
+    """Create the task graph of all of the tracker charts.
+
+    Each chart task is named after the file name of the chart it writes. The
+    tasks that compute the data shared by several charts are named after the
+    data they derive from. The data can be left out and set later on the
+    graph so that only the data needed by the selected charts is prepared.
+    """
+    graph = taskgraph.TaskGraph()
+    graph.add_value('ci_data', ci_data)
+    graph.add_value('test_data', test_data)
+    ci_dep = taskgraph.Dep('ci_data')
+    test_dep = taskgraph.Dep('test_data')
+    graph.add('summary', run_task, plot_summary, ci_dep, test_dep,
+              kind='chart')
+    # testing
+    for column in TEST_DAILY_COLUMNS:
+        graph.add(column, run_task, plot_test_trend, test_dep, column,
+                  kind='chart', cost=PERIOD_CHART_COST)
+    graph.add('test_data:weekly', filter_day_of_week, test_dep, 'report_date')
+    for column in TEST_CUMULATIVE_COLUMNS:
+        graph.add(column, run_task, plot_test_trend,
+                  taskgraph.Dep('test_data:weekly'), column, kind='chart',
+                  cost=PERIOD_CHART_COST)
+    # reporting
+    for column, title in REPORTING_CHARTS:
+        graph.add(column, run_task, plot_reporting_histogram, ci_dep, column,
+                  title, kind='chart', cost=PERIOD_CHART_COST)
+    # active cases
+    graph.add('ci_data:active', filter_case_status, ci_dep, 'ACTIVE')
+    graph.add('ci_data:closed', filter_case_status, ci_dep, 'CLOSED')
+    graph.add('ci_data:active_trend', calc_active_trend, ci_dep,
+              taskgraph.Dep('ci_data:closed'))
+    graph.add('Active', run_task, plot_active_trend,
+              taskgraph.Dep('ci_data:active_trend'), kind='chart',
+              cost=PERIOD_CHART_COST)
+    active_dep = taskgraph.Dep('ci_data:active')
+    for area in [CITY_MUN, REGION]:
+        graph.add(f"TopActive{area}", run_task, plot_top_active, active_dep,
+                  area, kind='chart')
+    graph.add('ActiveAgeGroup', run_task, plot_active_age_group, active_dep,
+              kind='chart')
+    graph.add('ActivePie', run_task, plot_active_pie, active_dep, kind='chart')
+    # confirmed cases, recovery and death
+    for case_chart in CASE_CHARTS:
+        add_case_chart_tasks(graph, ci_dep, **case_chart)
+    return graph
+
+
+def add_export_inputs(graph):
+    """Add the data of the tables of the exports module to the graph and
+    return the inputs of exports.add_export_tasks.
+
+    The data sets and the tasks that derive from these are only added if the
+    selected charts do not need them.
+    """
+    for name in DATA_SOURCES:
+        if name not in graph.values:
+            graph.add_value(name, None)
+    ci_dep = taskgraph.Dep('ci_data')
+    test_dep = taskgraph.Dep('test_data')
+    tasks = {
+        'ci_data:filter_recovered': (filter_recovered, ci_dep),
+        'ci_data:filter_died': (filter_died, ci_dep),
+        'ci_data:closed': (filter_case_status, ci_dep, 'CLOSED'),
+        'ci_data:active_trend': (calc_active_trend, ci_dep,
+                                 taskgraph.Dep('ci_data:closed')),
+        'summary_metrics': (summary_metrics, ci_dep, test_dep),
+    }
+    for name, (func, *args) in tasks.items():
+        if name not in graph.tasks:
+            graph.add(name, func, *args)
+    return {'confirmed': ci_dep,
+            'recovered': taskgraph.Dep('ci_data:filter_recovered'),
+            'deaths': taskgraph.Dep('ci_data:filter_died'),
+            'active_trend': taskgraph.Dep('ci_data:active_trend'),
+            'test_data': test_dep, 'summary': taskgraph.Dep('summary_metrics'),
+            'weekly_freq': WEEKLY_FREQ,
+            'test_columns': TEST_DAILY_COLUMNS + TEST_CUMULATIVE_COLUMNS}
+
+
+def summary_metrics(ci_data, test_data):
+    """Calculate the statistics of the summary table."""
     ci_agg = ci_data.groupby('DateOnset').count()
     ci_agg_filtered = filter_latest(ci_agg, 14, return_latest=False)
     cumsum = ci_agg_filtered['CaseCode'].cumsum()
-    case_doubling_time = doubling_time(cumsum)[-1]
-    # test
-    last_test_report = test_data['report_date'].max().strftime(date_format)
     latest_test_data = filter_latest(test_data, 1, date_column='report_date')
-    samples = int(test_data['daily_output_samples_tested'].sum())
-    samples_str = format_num(samples)
-    latest_samples = int(latest_test_data['daily_output_samples_tested'].sum())
-    latest_samples_str = format_num(latest_samples)
     individuals = int(test_data['daily_output_unique_individuals'].sum())
-    individuals_str = format_num(individuals)
     latest_individuals = int(
         latest_test_data['daily_output_unique_individuals'].sum())
-    latest_individuals_str = format_num(latest_individuals)
     positive = int(test_data['daily_output_positive_individuals'].sum())
-    positive_str = format_num(positive)
     latest_positive = int(
         latest_test_data['daily_output_positive_individuals'].sum())
-    latest_positive_str = format_num(latest_positive)
-    positivity_rate = round((positive / individuals) * 100, 2)
-    latest_positivity_rate = round(
-        (latest_positive / latest_individuals) * 100, 2)
     test_agg = test_data.groupby('report_date').sum()
-    positive_doubling_time = doubling_time(
-        test_agg['cumulative_positive_individuals'])[-1]
-    # create table
+    return {
+        # confirmed cases
+        'last_case_reported': ci_data['DateRepConf'].max(),
+        'total_confirmed': ci_data['CaseCode'].count(),
+        'total_active':
+            ci_data[ci_data[CASE_STATUS] == 'ACTIVE']['CaseCode'].count(),
+        'total_death':
+            ci_data[ci_data['HealthStatus'] == 'DIED']['CaseCode'].count(),
+        'new_confirmed':
+            ci_data[ci_data[CASE_REP_TYPE] == 'New Case']['CaseCode'].count(),
+        'case_doubling_time': doubling_time(cumsum)[-1],
+        # test
+        'last_test_report': test_data['report_date'].max(),
+        'samples': int(test_data['daily_output_samples_tested'].sum()),
+        'latest_samples':
+            int(latest_test_data['daily_output_samples_tested'].sum()),
+        'individuals': individuals,
+        'latest_individuals': latest_individuals,
+        'positive': positive,
+        'latest_positive': latest_positive,
+        'positivity_rate': round((positive / individuals) * 100, 2),
+        'latest_positivity_rate':
+            round((latest_positive / latest_individuals) * 100, 2),
+        'positive_doubling_time':
+            doubling_time(test_agg['cumulative_positive_individuals'])[-1],
+    }
+
+
+def summary_table(metrics):
+    """Return the header and the body of the summary table of the given
+    summary_metrics."""
+    # Using the format key on the cells will apply the formatting to all of
+    # the columns and we don't want that applied to the first column so we need
+    # to do the formatting for now.
+    def format_num(num):
+        return f'{num:,}'
+    date_format = "%Y-%m-%d"
     header = ['Statistic', 'Cumulative', 'Latest Report']
     body = [
-        ["Last Case Reported", "-", last_case_reported],
-        ["Confirmed Cases", total_confirmed, new_confirmed],
-        ["Active Cases", "-", total_active],
-        ["Deaths", total_death, "-"],
-        ["Case Doubling Time (days)", "-", round(case_doubling_time, 2)],
-        ["Last Test Report", "-", last_test_report],
-        ["Samples Tested", samples_str, latest_samples_str],
-        ["Individuals Tested", individuals_str, latest_individuals_str],
-        ["Positive Individuals", positive_str, latest_positive_str],
-        ["Positivity Rate (%)", positivity_rate, latest_positivity_rate],
+        ["Last Case Reported", "-",
+         metrics['last_case_reported'].strftime(date_format)],
+        ["Confirmed Cases", format_num(metrics['total_confirmed']),
+         format_num(metrics['new_confirmed'])],
+        ["Active Cases", "-", format_num(metrics['total_active'])],
+        ["Deaths", format_num(metrics['total_death']), "-"],
+        ["Case Doubling Time (days)", "-",
+         round(metrics['case_doubling_time'], 2)],
+        ["Last Test Report", "-",
+         metrics['last_test_report'].strftime(date_format)],
+        ["Samples Tested", format_num(metrics['samples']),
+         format_num(metrics['latest_samples'])],
+        ["Individuals Tested", format_num(metrics['individuals']),
+         format_num(metrics['latest_individuals'])],
+        ["Positive Individuals", format_num(metrics['positive']),
+         format_num(metrics['latest_positive'])],
+        ["Positivity Rate (%)", metrics['positivity_rate'],
+         metrics['latest_positivity_rate']],
         ["Positive Individuals Doubling Time (days)",
-         "-", round(positive_doubling_time, 2)],
+         "-", round(metrics['positive_doubling_time'], 2)],
     ]
+    return header, body
+
+
+def plot_summary(ci_data, test_data):
+    """Generate summary table."""
+    header, body = summary_table(summary_metrics(ci_data, test_data))
     write_table(header, body, "summary")
 
 
+CASE_DATE_COLUMNS = ['DateSpecimen', 'DateRepConf', 'DateResultRelease',
+                     #        'DateOnset', 'DateRecover', 'DateDied', 'DateRepRem']
+                     # There is no DateRepRem column in the 2020-07-10 data.
+                     'DateOnset', 'DateRecover', 'DateDied']
+# The location and status columns whose empty values are filled.
+CASE_FILL_COLUMNS = [CITY_MUN, 'ProvRes', 'Quarantined', 'Admitted',
+                     'AgeGroup']
+# The testing started in April 2020 in the Philippines.
+TESTING_START = "2020-04-01"
+
+
+@tracing.traced()
+def clean_case_info_data(data):
+    """Convert the date columns of the Case Information and fill the empty
+    location and status columns."""
+    with tracing.span('convert_dates', rows=len(data)):
+        for column in CASE_DATE_COLUMNS:
+            logging.debug("Converting column %s to datetime", column)
+            # Some of the data are invalid.
+            data[column] = pd.to_datetime(data[column], errors='coerce')
+    logging.info("Filling empty data")
+    with tracing.span('fill_empty'):
+        for column in CASE_FILL_COLUMNS:
+            data[column].fillna('No Data', inplace=True)
+
+
+@tracing.traced()
 def calc_case_info_data(data):
     """Calculate data needed for the plots from the Case Information."""
-    convert_columns = ['DateSpecimen', 'DateRepConf', 'DateResultRelease',
-                       #        'DateOnset', 'DateRecover', 'DateDied', 'DateRepRem']
-                       # There is no DateRepRem column in the 2020-07-10 data.
-                       'DateOnset', 'DateRecover', 'DateDied']
-    for column in convert_columns:
-        logging.debug("Converting column %s to datetime", column)
-        # Some of the data are invalid.
-        data[column] = pd.to_datetime(data[column], errors='coerce')
-    logging.info("Filling empty data")
-    data[CITY_MUN].fillna('No Data', inplace=True)
-    data['ProvRes'].fillna('No Data', inplace=True)
-    data['Quarantined'].fillna('No Data', inplace=True)
-    data['Admitted'].fillna('No Data', inplace=True)
-    data['AgeGroup'].fillna('No Data', inplace=True)
+    clean_case_info_data(data)
     max_date_rep_conf = data.DateRepConf.max()
     # Some incomplete entries have no dates so we need to check first before
     # making a computation.
     logging.info("Calculating specimen to reporting data")
-    data['SpecimenToRepConf'] = data.apply(
-        lambda row: (row['DateRepConf'] - row['DateSpecimen']).days
-        if row['DateRepConf'] and row['DateSpecimen'] and row['DateSpecimen'] <
-        row['DateRepConf'] else np.NaN, axis=1)
-    data['SpecimenToRelease'] = data.apply(
-        lambda row: (row['DateResultRelease'] - row['DateSpecimen']).days
-        if row['DateResultRelease'] and
-        row['DateSpecimen'] and row['DateSpecimen'] <
-        row['DateResultRelease'] else np.NaN, axis=1)
-    data['ReleaseToRepConf'] = data.apply(
-        lambda row: (row['DateRepConf'] - row['DateResultRelease']).days
-        if
-        row['DateRepConf'] and
-        row['DateResultRelease'] and row['DateResultRelease'] <
-        row['DateRepConf'] else np.NaN, axis=1)
+    with tracing.span('reporting_delays'):
+        data['SpecimenToRepConf'] = data.apply(
+            lambda row: (row['DateRepConf'] - row['DateSpecimen']).days
+            if row['DateRepConf'] and row['DateSpecimen'] and
+            row['DateSpecimen'] < row['DateRepConf'] else np.NaN, axis=1)
+        data['SpecimenToRelease'] = data.apply(
+            lambda row: (row['DateResultRelease'] - row['DateSpecimen']).days
+            if row['DateResultRelease'] and
+            row['DateSpecimen'] and row['DateSpecimen'] <
+            row['DateResultRelease'] else np.NaN, axis=1)
+        data['ReleaseToRepConf'] = data.apply(
+            lambda row: (row['DateRepConf'] - row['DateResultRelease']).days
+            if
+            row['DateRepConf'] and
+            row['DateResultRelease'] and row['DateResultRelease'] <
+            row['DateRepConf'] else np.NaN, axis=1)
     logging.info("Setting date proxies")
-    data[ONSET_PROXY] = data.apply(
-        lambda row: 'No Proxy'
-        if not pd.isnull(row['DateOnset'])
-        else(
-            'DateSpecimen'
-            if not pd.isnull(row['DateSpecimen']) else 'DateRepConf'), axis=1)
-    data['DateOnset'] = data.apply(
-        lambda row: row['DateOnset']
-        if row[ONSET_PROXY] == 'No Proxy' else row[row[ONSET_PROXY]], axis=1)
-    data[RECOVER_PROXY] = data.apply(
-        lambda row: 'No Proxy'
-        if not pd.isnull(row['DateRecover'])
-        else(
-            'DateOnset+14'
-            if row[ONSET_PROXY] == 'No Proxy' else(row[ONSET_PROXY] + '+14')),
-        axis=1)
-    data['DateRecover'] = data.apply(
-        lambda row: row['DateRecover']
-        if row[RECOVER_PROXY] == 'No Proxy'
-        else(
-            row['DateOnset'] + timedelta(days=14)
-            if row['DateOnset'] + timedelta(days=14) < max_date_rep_conf else
-            max_date_rep_conf), axis=1)
+    with tracing.span('onset_proxy'):
+        data[ONSET_PROXY] = data.apply(
+            lambda row: 'No Proxy'
+            if not pd.isnull(row['DateOnset'])
+            else(
+                'DateSpecimen'
+                if not pd.isnull(row['DateSpecimen']) else 'DateRepConf'),
+            axis=1)
+        data['DateOnset'] = data.apply(
+            lambda row: row['DateOnset']
+            if row[ONSET_PROXY] == 'No Proxy' else row[row[ONSET_PROXY]],
+            axis=1)
+    with tracing.span('recover_proxy'):
+        data[RECOVER_PROXY] = data.apply(
+            lambda row: 'No Proxy'
+            if not pd.isnull(row['DateRecover'])
+            else(
+                'DateOnset+14'
+                if row[ONSET_PROXY] == 'No Proxy'
+                else(row[ONSET_PROXY] + '+14')),
+            axis=1)
+        data['DateRecover'] = data.apply(
+            lambda row: row['DateRecover']
+            if row[RECOVER_PROXY] == 'No Proxy'
+            else(
+                row['DateOnset'] + timedelta(days=14)
+                if row['DateOnset'] + timedelta(days=14) < max_date_rep_conf
+                else max_date_rep_conf), axis=1)
     # Add column for easily identifying newly reported cases.
     logging.info("Setting case report type")
-    data[CASE_REP_TYPE] = data.apply(
-        lambda row: 'Incomplete'
-        if not row['DateRepConf']
-        else (
-            'New Case'
-            if row['DateRepConf'] == max_date_rep_conf
-            else 'Previous Case'
-        ),
-        axis=1)
+    with tracing.span('case_report_type'):
+        data[CASE_REP_TYPE] = data.apply(
+            lambda row: 'Incomplete'
+            if not row['DateRepConf']
+            else (
+                'New Case'
+                if row['DateRepConf'] == max_date_rep_conf
+                else 'Previous Case'
+            ),
+            axis=1)
     # Add column for easily identifying closed and active cases.
     logging.info("Setting case status")
-    data[CASE_STATUS] = data.apply(lambda row:
-                                   'CLOSED' if row['HealthStatus'] in [
-                                       "RECOVERED", "DIED"] else 'ACTIVE',
-                                   axis=1)
-    data[DATE_CLOSED] = data.apply(
-        lambda row: row['DateDied']
-        if row['HealthStatus'] == 'DIED' else row['DateRecover'], axis=1)
+    with tracing.span('case_status'):
+        data[CASE_STATUS] = data.apply(lambda row:
+                                       'CLOSED' if row['HealthStatus'] in [
+                                           "RECOVERED", "DIED"] else 'ACTIVE',
+                                       axis=1)
+        data[DATE_CLOSED] = data.apply(
+            lambda row: row['DateDied']
+            if row['HealthStatus'] == 'DIED' else row['DateRecover'], axis=1)
     # Trim Region names for shorter chart legends.
     logging.info("Setting region")
-    data['Region'] = data.apply(lambda row:
-                                'No Data' if pd.isnull(row['RegionRes']) else (
-                                    row['RegionRes']).split(':')[0], axis=1)
+    with tracing.span('region'):
+        data['Region'] = data.apply(lambda row:
+                                    'No Data' if pd.isnull(row['RegionRes'])
+                                    else (row['RegionRes']).split(':')[0],
+                                    axis=1)
     logging.debug(data)
     return data
 
 
+@functools.lru_cache(maxsize=None)
+def load_test_facility():
+    """Return the region of each test facility.
+
+    The lookup is read once per process and reused by every chunk and data
+    drop that the process prepares.
+    """
+    logging.info("Reading test facility data")
+    return pd.read_csv(f"{SCRIPT_DIR}/resources/test-facility.csv")
+
+
+@tracing.traced()
 def calc_testing_aggregates_data(data):
     """Calculate data needed for the plots."""
     data['report_date'] = pd.to_datetime(data['report_date'], errors='coerce')
@@ -722,7 +1052,7 @@ def calc_testing_aggregates_data(data):
     # with invalid dates some are dating back to around 1900's.
     # To get around this we filter-out data that are earlier than April 2020
     # which is when the Philippines started testing.
-    data = filter_date_range(data, start=pd.to_datetime("2020-04-01"),
+    data = filter_date_range(data, start=pd.to_datetime(TESTING_START),
                              date_column='report_date')
     # Make a new copy of the slice and use this moving forward.
     # This is to avoid the warning SettingWithCopyWarning and be explicit that
@@ -735,9 +1065,8 @@ def calc_testing_aggregates_data(data):
             lambda row: row['daily_output_positive_individuals'] /
             row['daily_output_unique_individuals']
             if row['daily_output_unique_individuals'] else 0, axis=1)
-    logging.info("Reading test facility data")
-    test_facility = pd.read_csv(f"{SCRIPT_DIR}/resources/test-facility.csv")
-    data = pd.merge(data, test_facility, on='facility_name', how='left')
+    data = pd.merge(data, load_test_facility(), on='facility_name',
+                    how='left')
     data['REGION'].fillna('Unknown', inplace=True)
     logging.debug(data)
     return data
@@ -751,24 +1080,48 @@ def cache_needs_refresh(cache, file_paths):
 
 
 def prepare_data(data_dir, file_pattern, apply=None, rebuild=False,
-                 read_method=pd.read_csv):
+                 read_method=pd.read_csv, pool=None):
     """Load data from  the given file name.
 
     This function will load from cache if the cache is older than the file. It
-    also uses parallel processing to improve performance.
+    also uses parallel processing in the given pool to improve performance.
     """
+    # pylint: disable=too-many-arguments
     logging.info("Reading %s", file_pattern)
-    cache = pathlib.Path(f"{data_dir}/{file_pattern}.pkl")
-    matches = list(pathlib.Path(data_dir).glob(f"{file_pattern}"))
-    if not (cache_needs_refresh(cache, matches) or rebuild):
-        return pd.read_pickle(cache)
-    cache.unlink(missing_ok=True)
-    df_list = map(read_method, matches)
-    data = pd.concat(df_list)
-    if apply:
-        data = apply_parallel(data, apply)
-    data.to_pickle(cache)
-    return data
+    with tracing.span('prepare_data', pattern=file_pattern):
+        cache = pathlib.Path(f"{data_dir}/{file_pattern}.pkl")
+        matches = list(pathlib.Path(data_dir).glob(f"{file_pattern}"))
+        if not (cache_needs_refresh(cache, matches) or rebuild):
+            with tracing.span('read_cache'):
+                data = pd.read_pickle(cache)
+            memory.record_frame(f"{file_pattern} cached", data)
+            return data
+        cache.unlink(missing_ok=True)
+        with tracing.span('read_files', files=len(matches)):
+            df_list = map(read_method, matches)
+            data = pd.concat(df_list)
+        memory.record_frame(f"{file_pattern} read", data)
+        if apply:
+            data = apply_parallel(data, apply, pool)
+            memory.record_frame(f"{file_pattern} prepared", data)
+        with tracing.span('write_cache'):
+            data.to_pickle(cache)
+        return data
+
+
+# The data sets that the charts are generated from: the file pattern in the
+# data directory and the function applied to the loaded data.
+DATA_SOURCES = {
+    'ci_data': ("*Case Information*.csv", calc_case_info_data),
+    'test_data': ("*Testing Aggregates*.csv", calc_testing_aggregates_data),
+}
+
+
+def load_data(name, data_dir, rebuild=False, pool=None):
+    """Prepare the named data set of DATA_SOURCES."""
+    file_pattern, apply = DATA_SOURCES[name]
+    return prepare_data(data_dir, file_pattern, apply=apply, rebuild=rebuild,
+                        pool=pool)
 
 
 def create_dir(path: str, rebuild: bool):
@@ -782,35 +1135,134 @@ def create_dir(path: str, rebuild: bool):
         os.mkdir(path)
 
 
-def plot(script_dir: str, data_dir: str, rebuild: bool = False):
-    """Plot the charts."""
-    create_dir(CHART_OUTPUT, rebuild)
-    create_dir(TABLE_OUTPUT, rebuild)
+def list_charts():
+    """Return the names of the charts that can be selected in plot."""
+    return sorted(build_chart_graph().names(kind='chart'))
+
+
+def plot(script_dir: str, data_dir: str, rebuild: bool = False,
+         precompress: bool = False, optimize_png: bool = False,
+         formats: typing.Optional[typing.List[str]] = None,
+         only: typing.Optional[typing.List[str]] = None,
+         exclude: typing.Optional[typing.List[str]] = None,
+         pool: typing.Optional[execution.WorkerPool] = None,
+         data: typing.Optional[typing.Dict[str, pd.DataFrame]] = None,
+         depends_on: typing.Optional[typing.List[str]] = None,
+         export: bool = False):
+    """Plot the charts and return their names.
+
+    The charts are written in each of the given formats, HTML and PNG by
+    default. If precompress is True, compressed siblings of the text files are
+    written after plotting. If optimize_png is True, the PNG files are
+    optimized.
+
+    The charts can be selected with the 'only' and 'exclude' glob patterns
+    which are matched against the names returned by list_charts. Only the
+    data needed by the selected charts is prepared. If depends_on is given,
+    only the charts that depend on the named data sets are plotted. If
+    rebuild is True, the chart directories are only emptied when no charts
+    are left out.
+
+    data holds the data sets of DATA_SOURCES that are already prepared, by
+    name. The rest are prepared from the data directory. The data is
+    prepared and the charts are plotted in the given pool, which must be
+    created by create_pool with the same formats. A process pool is created
+    for the call if none is given.
+
+    If export is True, the aggregate tables of the exports module are also
+    written by tasks that run alongside the charts.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    formats = formats or outputsink.DEFAULT_CHART_FORMATS
+    if pool is None:
+        with create_pool(formats=formats) as new_pool:
+            return plot(script_dir, data_dir, rebuild=rebuild,
+                        precompress=precompress, optimize_png=optimize_png,
+                        formats=formats, only=only, exclude=exclude,
+                        pool=new_pool, data=data, depends_on=depends_on,
+                        export=export)
+    set_output_formats(formats)
+    graph = build_chart_graph().select(only=only, exclude=exclude,
+                                       depends_on=depends_on)
+    if only or exclude or depends_on:
+        logging.info("Selected %d charts", len(graph.names(kind='chart')))
+    if export:
+        # pylint: disable=import-outside-toplevel
+        from covid19trackerph import exports
+        exports.add_export_tasks(graph, add_export_inputs(graph))
+    # The other charts are in the same directories so these are only removed
+    # when all of the charts are plotted again.
+    partial = bool(only or exclude or depends_on)
+    if rebuild and partial:
+        logging.info("Keeping the other charts, only the selected charts are "
+                     "rebuilt")
+    create_dir(CHART_OUTPUT, rebuild and not partial)
+    create_dir(TABLE_OUTPUT, rebuild and not partial)
 
     start = timer()
     full_data_dir = f"{script_dir}/{data_dir}"
-    ci_data = prepare_data(full_data_dir, "*Case Information*.csv",
-                           apply=calc_case_info_data, rebuild=rebuild)
-    test_data = prepare_data(
-        full_data_dir, "*Testing Aggregates*.csv",
-        apply=calc_testing_aggregates_data, rebuild=rebuild)
+    for name in graph.values:
+        if data and name in data:
+            graph.set_value(name, data[name])
+        else:
+            with tracing.span('load_data', data=name), memory.stage(
+                    f"prepare {name}"):
+                graph.set_value(name,
+                                load_data(name, full_data_dir, rebuild, pool))
     prep_end = timer()
 
     plot_start = timer()
-    with mp.Pool(num_processes) as pool:
-        results = [
-            pool.apply_async(plot_summary, (ci_data, test_data)),
-            pool.apply_async(plot_active_cases, (ci_data,)),
-            pool.apply_async(plot_reporting, (ci_data,)),
-            pool.apply_async(plot_test, (test_data,))] + plot_ci_async(
-            pool, ci_data)
-        # Must wait for all tasks to be complete.
-        for result in results:
-            result.get()
-        pool.close()
-        pool.join()
+    timings_path = os.path.join(full_data_dir, TASK_TIMINGS)
+    # The in-process executors share the values without spilling these.
+    spill_dir = (None if pool.in_process
+                 else tempfile.mkdtemp(prefix="trackerchart-"))
+    try:
+        with tracing.span('run_chart_tasks', tasks=len(graph.tasks)), \
+                memory.stage('plot'):
+            results = graph.run(pool, workers=pool.workers,
+                                estimates=taskgraph.load_timings(timings_path),
+                                spill_dir=spill_dir)
+    finally:
+        if spill_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+    taskgraph.save_timings(timings_path, graph)
+    if export:
+        exports.write_manifest(graph, results)
     end = timer()
     logging.info("Execution times for trackerchart")
     logging.info("Data preparation: %s", timedelta(seconds=prep_end-start))
     logging.info("Plot: %s", timedelta(seconds=end-plot_start))
     logging.info("Total time: %s", timedelta(seconds=end-start))
+    graph.report(workers=pool.workers)
+    log_sink_metrics(chart_sink_metrics(graph, results))
+    memory.log_report()
+    if precompress or optimize_png:
+        # pylint: disable=import-outside-toplevel
+        from covid19trackerph import compress
+        compress.postprocess([CHART_OUTPUT, TABLE_OUTPUT],
+                             png=optimize_png and 'png' in formats,
+                             text=precompress)
+    return graph.names(kind='chart')
+
+
+def chart_sink_metrics(graph, results):
+    """Return the latest output sink metrics of each worker."""
+    sink_metrics = {}
+    for name in graph.names(kind='chart'):
+        pid, metrics = results[name]
+        # The metrics are cumulative per worker so keep only the latest.
+        if (pid not in sink_metrics or metrics['files_written'] >
+                sink_metrics[pid]['files_written']):
+            sink_metrics[pid] = metrics
+    return sink_metrics.values()
+
+
+def log_sink_metrics(metrics_list):
+    """Log the combined output sink metrics of the workers."""
+    merged = outputsink.merge_metrics(metrics_list)
+    logging.info("Output files written: %d (%.1f MB)", merged['files_written'],
+                 merged['bytes_written'] / 1e6)
+    logging.info("Output write time: %s, throughput %.1f MB/s",
+                 timedelta(seconds=merged['write_seconds']),
+                 merged['bytes_per_second'] / 1e6)
+    logging.info("Output max queue depth: %d", merged['max_queue_depth'])
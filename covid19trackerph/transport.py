@@ -0,0 +1,180 @@
+"""
+Pooled HTTP transport for the data drop downloads.
+
+The Google API client normally sends its requests through a new httplib2
+connection per service with no retry policy. Here all of the Drive services
+of a download share one keep-alive requests session whose connection pool is
+sized for the download threads. Requests that fail with a 429 or a 5xx status
+or a connection error are retried with an exponential backoff by urllib3
+before the response is returned to the caller.
+
+The short links of the data drop are resolved with a separate session that
+is not authorized so that the Drive token is only ever sent to Drive.
+
+The latency and the number of retries of every request are recorded so that
+a slow or throttled download is visible in the run log.
+"""
+
+import logging
+import threading
+from timeit import default_timer as timer
+
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+# Delays between the retries are 0.5, 1, 2... seconds.
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Timeout in seconds for connecting and for each read from the socket.
+DEFAULT_TIMEOUT = (10, 120)
+
+
+def retry_policy(retries=DEFAULT_RETRIES):
+    """Return the urllib3 retry policy of the session.
+
+    The Drive scope is read only so every method, including the POST of a
+    batch request, is safe to retry.
+    """
+    return Retry(total=retries, backoff_factor=BACKOFF_FACTOR,
+                 status_forcelist=RETRY_STATUSES, allowed_methods=None,
+                 respect_retry_after_header=True, raise_on_status=False)
+
+
+def make_session(credentials=None, pool_size=DEFAULT_POOL_SIZE,
+                 retries=DEFAULT_RETRIES):
+    """Create a pooled session. It is authorized if credentials are given."""
+    if credentials is not None:
+        # Imported here since it is only needed for the Drive requests.
+        # pylint: disable=import-outside-toplevel
+        from google.auth.transport.requests import AuthorizedSession
+        session = AuthorizedSession(credentials)
+    else:
+        session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry_policy(retries))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RequestStats:
+    """Latency and retry counts of the requests sent through a transport."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.retries = 0
+        self.retried_requests = 0
+
+    def record(self, latency, retries):
+        """Record a completed request."""
+        with self.lock:
+            self.latencies.append(latency)
+            self.retries += retries
+            self.retried_requests += bool(retries)
+
+    def summary(self):
+        """Return the aggregate statistics of the recorded requests."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            count = len(latencies)
+            return {
+                'requests': count,
+                'retries': self.retries,
+                'retried_requests': self.retried_requests,
+                'mean_latency': sum(latencies) / count if count else 0.0,
+                'p95_latency': (latencies[min(count - 1, int(count * 0.95))]
+                                if count else 0.0),
+                'max_latency': latencies[-1] if count else 0.0,
+            }
+
+    def log(self):
+        """Log the aggregate statistics."""
+        summary = self.summary()
+        if not summary['requests']:
+            return
+        logging.info("HTTP: %d requests, %d retries on %d requests, latency "
+                     "mean %.3fs, p95 %.3fs, max %.3fs", summary['requests'],
+                     summary['retries'], summary['retried_requests'],
+                     summary['mean_latency'], summary['p95_latency'],
+                     summary['max_latency'])
+
+
+def retry_count(response):
+    """Return the number of times urllib3 retried the given response."""
+    retries = getattr(response.raw, 'retries', None)
+    return len(retries.history) if retries is not None else 0
+
+
+class SessionHttp:
+    """httplib2 compatible wrapper of a requests session.
+
+    This is passed as the http object of the Google API client so that the
+    Drive requests go through the pooled session.
+    """
+
+    def __init__(self, session, stats=None, timeout=DEFAULT_TIMEOUT):
+        self.session = session
+        self.stats = stats
+        self.timeout = timeout
+
+    def request(self, uri, method="GET", body=None, headers=None,
+                redirections=None, connection_type=None):
+        """Send the request and return an httplib2 response and content."""
+        # pylint: disable=too-many-arguments,unused-argument
+        start = timer()
+        response = self.session.request(method, uri, data=body,
+                                        headers=headers, timeout=self.timeout)
+        content = response.content
+        latency = timer() - start
+        retries = retry_count(response)
+        if self.stats is not None:
+            self.stats.record(latency, retries)
+        logging.debug("%s %s: %d in %.3fs, %d retries", method, uri,
+                      response.status_code, latency, retries)
+        info = {key.lower(): value for key, value in response.headers.items()}
+        # requests already decoded the content.
+        info.pop('content-encoding', None)
+        info['content-length'] = str(len(content))
+        info['status'] = str(response.status_code)
+        return httplib2.Response(info), content
+
+
+class Transport:
+    """A pooled session with the statistics of its requests."""
+
+    def __init__(self, credentials=None, pool_size=DEFAULT_POOL_SIZE,
+                 retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT):
+        self.session = make_session(credentials, pool_size, retries)
+        # The links are resolved without the credentials since these can
+        # point to any host.
+        self.link_session = make_session(pool_size=1, retries=retries)
+        self.stats = RequestStats()
+        self.timeout = timeout
+
+    def http(self):
+        """Return an httplib2 compatible http object for a Drive service."""
+        return SessionHttp(self.session, self.stats, self.timeout)
+
+    def head(self, url):
+        """Send a HEAD request without the credentials."""
+        start = timer()
+        response = self.link_session.head(url, timeout=self.timeout)
+        self.stats.record(timer() - start, retry_count(response))
+        return response
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+        self.link_session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
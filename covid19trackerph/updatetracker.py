@@ -2,18 +2,34 @@
 
 import os
 import sys
+import signal
 import traceback
 import logging
 import argparse
 import pathlib
+import multiprocessing as mp
 
 from covid19trackerph import datadrop
-from covid19trackerph import trackerchart
+from covid19trackerph import execution
+from covid19trackerph import memory
+from covid19trackerph import outputsink
+from covid19trackerph import tracing
 
 
 SCRIPT_DIR = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
 
 
+def _formats(value):
+    """Parse a comma separated list of chart formats."""
+    formats = [chart_format.strip().lower() for chart_format in value.split(',')
+               if chart_format.strip()]
+    unsupported = set(formats) - set(outputsink.CHART_FORMATS)
+    if not formats or unsupported:
+        raise argparse.ArgumentTypeError(
+            f"choose from {', '.join(outputsink.CHART_FORMATS)}")
+    return formats
+
+
 def _parse_args():
     """Parse the CLI arguments."""
     parser = argparse.ArgumentParser()
@@ -21,10 +37,107 @@ def _parse_args():
                         help="skip download of data")
     parser.add_argument("--folder-id", nargs='?',
                         help="specify the folder id of the latest datadrop")
+    parser.add_argument("--download-workers", type=int,
+                        default=datadrop.DEFAULT_DOWNLOAD_WORKERS,
+                        help="number of files downloaded at the same time")
+    parser.add_argument("--chunk-size", type=int,
+                        default=datadrop.DEFAULT_CHUNK_SIZE // (1024 * 1024),
+                        help="download chunk size in MB, default: %(default)s")
     parser.add_argument("--data-dir", nargs='?', default=datadrop.DATA_DIR,
                         help="specify the directory of the data set")
     parser.add_argument("--rebuild", action="store_true",
                         help="rebuild chart directory")
+    parser.add_argument("--only", action="append", metavar="GLOB",
+                        help=("only generate the charts matching the glob "
+                              "pattern, can be given more than once"))
+    parser.add_argument("--exclude", action="append", metavar="GLOB",
+                        help=("do not generate the charts matching the glob "
+                              "pattern, can be given more than once"))
+    parser.add_argument("--list-charts", action="store_true",
+                        help="list the chart names that can be selected")
+    parser.add_argument("--formats", type=_formats,
+                        default=",".join(outputsink.DEFAULT_CHART_FORMATS),
+                        help=("comma separated chart formats to write "
+                              f"({','.join(outputsink.CHART_FORMATS)}), "
+                              "default: %(default)s"))
+    parser.add_argument("--workers", type=int,
+                        help=("number of workers, default: one less than the "
+                              "available CPUs"))
+    parser.add_argument("--executor", default="process",
+                        choices=execution.EXECUTORS,
+                        help="how the workers are run, default: %(default)s")
+    parser.add_argument("--start-method",
+                        choices=mp.get_all_start_methods(),
+                        help=("multiprocessing start method of the process "
+                              "workers, default: platform default"))
+    parser.add_argument("--precompress", action="store_true",
+                        help="write gzip and brotli copies of the text files")
+    parser.add_argument("--optimize-png", action="store_true",
+                        help="losslessly optimize the changed PNG files")
+    parser.add_argument("--watch", action="store_true",
+                        help=("keep running and regenerate the charts whose "
+                              "data changed"))
+    parser.add_argument("--watch-interval", type=float, default=600,
+                        help=("seconds between the checks for changes in "
+                              "watch mode, default: %(default)s"))
+    parser.add_argument("--serve", action="store_true",
+                        help=("keep serving JSON queries over the prepared "
+                              "data after plotting"))
+    parser.add_argument("--serve-host", default="127.0.0.1",
+                        help=("address of the query service, "
+                              "default: %(default)s"))
+    parser.add_argument("--serve-port", type=int, default=8050,
+                        help="port of the query service, default: %(default)s")
+    parser.add_argument("--drilldown", action="store_true",
+                        help=("also generate the pages of each region and "
+                              "city/municipality whose data changed"))
+    parser.add_argument("--drilldown-budget", type=float, metavar="SECONDS",
+                        help=("stop starting drill-down pages after the "
+                              "given seconds, the rest are generated in the "
+                              "next run"))
+    parser.add_argument("--trace", metavar="FILE",
+                        help=("write a Chrome trace of the run, including "
+                              "the workers, to the given JSON file"))
+    parser.add_argument("--memory", action="store_true",
+                        help=("report the memory usage of each stage and "
+                              "worker with the timing report"))
+    parser.add_argument("--tracemalloc", type=int, default=0, metavar="N",
+                        help=("also list the N largest allocations of each "
+                              "stage, implies --memory"))
+    parser.add_argument("--engine", default="pandas", metavar="ENGINE",
+                        help=("engine that prepares the data of the charts, "
+                              "e.g. vectorized or polars if installed, "
+                              "default: %(default)s"))
+    parser.add_argument("--verify", metavar="ENGINE",
+                        help=("compare the data and charts of the given "
+                              "engine with the reference pandas engine "
+                              "instead of plotting"))
+    parser.add_argument("--verify-rtol", type=float, default=1e-9,
+                        help=("relative tolerance of the verified numbers, "
+                              "default: %(default)s"))
+    parser.add_argument("--verify-atol", type=float, default=1e-9,
+                        help=("absolute tolerance of the verified numbers, "
+                              "default: %(default)s"))
+    parser.add_argument("--verify-output", metavar="FILE",
+                        help="write the verification report to a JSON file")
+    parser.add_argument("--backfill", metavar="ARCHIVE_DIR",
+                        help=("prepare each archived data drop in the "
+                              "directory and store its summary and daily "
+                              "counts instead of plotting"))
+    parser.add_argument("--backfill-store", default="backfill",
+                        metavar="DIR",
+                        help=("directory of the backfilled drops, "
+                              "default: %(default)s"))
+    parser.add_argument("--backfill-engine", default="vectorized",
+                        metavar="ENGINE",
+                        help=("engine that prepares the drops, "
+                              "default: %(default)s"))
+    parser.add_argument("--export", action="store_true",
+                        help=("also export the aggregates behind the charts "
+                              "as partitioned CSV and Parquet tables"))
+    parser.add_argument("--snapshot-store", metavar="DIR",
+                        help=("also keep the Case Information drop in the "
+                              "snapshot store in the given directory"))
     parser.add_argument("--deploy", action="store_true",
                         help="copy generated charts to the tracker directory")
     parser.add_argument("--loglevel", default="INFO",
@@ -38,18 +151,188 @@ def set_loglevel(loglevel):
     logging.basicConfig(level=numeric_level)
 
 
+def watch_charts(args, track_downloads):
+    """Run in watch mode until stopped or restarted."""
+    # pylint: disable=import-outside-toplevel
+    from covid19trackerph import engines
+    from covid19trackerph import trackerchart
+    from covid19trackerph import watch
+
+    def download():
+        datadrop.download(folder_id=args.folder_id,
+                          workers=args.download_workers,
+                          chunksize=args.chunk_size * 1024 * 1024)
+    selected = args.only or args.exclude
+    service = server = None
+    if args.serve:
+        from covid19trackerph import queryservice
+        service = queryservice.QueryService()
+        server = queryservice.start_server(service, args.serve_host,
+                                             args.serve_port)
+    # The trace covers every cycle until the watcher stops or restarts.
+    with tracing.tracing(args.trace), trackerchart.create_pool(
+            args.executor, args.workers, args.start_method,
+            args.formats) as pool:
+        watcher = watch.Watcher(
+            SCRIPT_DIR, args.data_dir, pool, interval=args.watch_interval,
+            download=None if args.skip_download else download,
+            is_current=(datadrop.is_plotted
+                        if track_downloads and not args.rebuild else None),
+            on_plotted=(datadrop.mark_plotted
+                        if track_downloads and not selected else None),
+            plot_options={'rebuild': args.rebuild,
+                          'precompress': args.precompress,
+                          'optimize_png': args.optimize_png,
+                          'formats': args.formats, 'only': args.only,
+                          'exclude': args.exclude, 'export': args.export},
+            on_prepared=service.set_data if service else None,
+            engine=engines.get_engine(args.engine))
+        try:
+            result = watcher.run()
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+    if result == watch.RELOAD:
+        watch.reexec()
+    return 0
+
+
+def verify_engine(args):
+    """Verify an engine against the reference on the data directory."""
+    # pylint: disable=import-outside-toplevel
+    from covid19trackerph import trackerchart
+    from covid19trackerph import verify
+    with trackerchart.create_pool(args.executor, args.workers,
+                                  args.start_method, args.formats) as pool:
+        verification = verify.verify(
+            os.path.join(SCRIPT_DIR, args.data_dir), args.verify, pool=pool,
+            rtol=args.verify_rtol, atol=args.verify_atol, only=args.only,
+            exclude=args.exclude)
+    verify.log_report(verification)
+    if args.verify_output:
+        verify.save_report(verification, args.verify_output)
+    return 0 if verification.passed else 1
+
+
+def backfill_drops(args):
+    """Backfill the archived data drops."""
+    # pylint: disable=import-outside-toplevel
+    from covid19trackerph import backfill
+    from covid19trackerph import trackerchart
+    with trackerchart.create_pool(args.executor, args.workers,
+                                  args.start_method, args.formats) as pool:
+        stats = backfill.backfill(
+            os.path.join(SCRIPT_DIR, args.backfill),
+            os.path.join(SCRIPT_DIR, args.backfill_store), pool,
+            engine=args.backfill_engine, rebuild=args.rebuild)
+    return 1 if stats['failed'] else 0
+
+
+def _interrupt(*_):
+    raise KeyboardInterrupt
+
+
+def serve_queries(args, frames):
+    """Serve queries over the prepared data sets until SIGINT or SIGTERM."""
+    # pylint: disable=import-outside-toplevel
+    from covid19trackerph import queryservice
+    service = queryservice.QueryService(frames)
+    server = queryservice.create_server(service, args.serve_host,
+                                        args.serve_port)
+    logging.info("Serving queries at http://%s:%d", *server.server_address)
+    previous = signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Stopping the query service")
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        server.server_close()
+    return 0
+
+
+def update_charts(args, track_downloads):
+    """Download the data drop then plot the charts."""
+    # pylint: disable=import-outside-toplevel
+    skip_plot = False
+    if not args.skip_download:
+        downloaded = datadrop.download(folder_id=args.folder_id,
+                                       workers=args.download_workers,
+                                       chunksize=args.chunk_size * 1024 * 1024)
+        if (track_downloads and not downloaded and datadrop.is_plotted()
+                and not args.rebuild):
+            logging.info("No changes in the data drop. Skipping the charts.")
+            skip_plot = True
+    if args.snapshot_store and not skip_plot:
+        from covid19trackerph import snapshots
+        snapshots.SnapshotStore(
+            os.path.join(SCRIPT_DIR, args.snapshot_store)).add_drop(
+                os.path.join(SCRIPT_DIR, args.data_dir))
+    if skip_plot and not args.serve:
+        return 0
+    from covid19trackerph import trackerchart
+    frames = None
+    remaining = 0
+    with trackerchart.create_pool(args.executor, args.workers,
+                                  args.start_method, args.formats) as pool:
+        if (args.serve or args.engine != 'pandas' or
+                (args.drilldown and not skip_plot)):
+            # The service and the drill-down pages use the data that the
+            # charts are plotted from.
+            from covid19trackerph import engines
+            engine = engines.get_engine(args.engine)
+            frames = {name: engine.load_data(
+                name, os.path.join(SCRIPT_DIR, args.data_dir),
+                rebuild=args.rebuild, pool=pool)
+                for name in trackerchart.DATA_SOURCES}
+        if not skip_plot:
+            trackerchart.plot(SCRIPT_DIR, args.data_dir, rebuild=args.rebuild,
+                              precompress=args.precompress,
+                              optimize_png=args.optimize_png,
+                              formats=args.formats, only=args.only,
+                              exclude=args.exclude, pool=pool, data=frames,
+                              export=args.export)
+            if args.drilldown:
+                from covid19trackerph import drilldown
+                _, remaining = drilldown.generate(
+                    frames['ci_data'], pool,
+                    os.path.join(SCRIPT_DIR, args.data_dir),
+                    budget=args.drilldown_budget, rebuild=args.rebuild)
+    # The data drop is only marked as plotted once all of the area pages
+    # are rendered, otherwise the next run would skip the rest of them.
+    if (track_downloads and not skip_plot and not remaining and
+            not (args.only or args.exclude)):
+        datadrop.mark_plotted()
+    if args.serve:
+        return serve_queries(args, frames)
+    return 0
+
+
 def main():
     """Main function"""
     args = _parse_args()
     if args.loglevel:
         set_loglevel(args.loglevel)
-    if not args.skip_download:
-        if args.folder_id:
-            datadrop.download(folder_id=args.folder_id)
-        else:
-            datadrop.download()
-    trackerchart.plot(SCRIPT_DIR, args.data_dir, rebuild=args.rebuild)
-    return 0
+    # The data stack is only imported once it is needed since it takes most
+    # of the start-up time.
+    # pylint: disable=import-outside-toplevel
+    if args.list_charts:
+        from covid19trackerph import trackerchart
+        print("\n".join(trackerchart.list_charts()))
+        return 0
+    # The downloads only affect the charts if these go to the plotted data.
+    track_downloads = os.path.normpath(args.data_dir) == datadrop.DATA_DIR
+    if args.memory or args.tracemalloc:
+        memory.start(args.tracemalloc)
+    if args.watch:
+        return watch_charts(args, track_downloads)
+    with tracing.tracing(args.trace):
+        if args.verify:
+            return verify_engine(args)
+        if args.backfill:
+            return backfill_drops(args)
+        return update_charts(args, track_downloads)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,331 @@
+"""
+Verify an engine against the reference pandas engine.
+
+The same data drop is prepared, aggregated and plotted by both engines and
+the results are compared within the given tolerances:
+
+* calc_case_info_data and calc_testing_aggregates_data: every column
+* agg_count_cumsum_by_date: the weekly cumulative counts of the trend charts
+* summary_metrics: the statistics of the summary table
+* figures: the trace data of each selected chart
+
+The aggregates and the summary are computed by both engines from the
+reference data so that a difference is reported at the step that introduced
+it. The figures are plotted from the data prepared by each engine. The rows
+are compared by position so the engines must keep the order of the rows.
+"""
+
+import json
+import logging
+import pathlib
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+from covid19trackerph import engines
+from covid19trackerph import execution
+from covid19trackerph import tracing
+from covid19trackerph import trackerchart as tc
+
+
+DEFAULT_RTOL = 1e-9
+DEFAULT_ATOL = 1e-9
+# Number of differing values listed for each mismatch.
+SAMPLE_SIZE = 5
+# The count and date columns of the agg_count_cumsum_by_date calls of the
+# trend charts.
+AGGREGATES = [(tc.REGION, 'DateOnset'), (tc.CASE_REP_TYPE, 'DateOnset'),
+              (tc.ONSET_PROXY, 'DateOnset'), (tc.REGION, 'DateRecover'),
+              (tc.RECOVER_PROXY, 'DateRecover'), (tc.REGION, 'DateDied')]
+
+
+def differences(reference, candidate, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """Return a boolean array of the elements of the two arrays that differ.
+
+    Numbers are compared within the tolerances and missing values are equal
+    to each other.
+    """
+    reference = np.asarray(reference)
+    candidate = np.asarray(candidate)
+    if reference.dtype.kind in 'biuf' and candidate.dtype.kind in 'biuf':
+        return ~np.isclose(reference.astype(float), candidate.astype(float),
+                           rtol=rtol, atol=atol, equal_nan=True)
+    reference = pd.Series(reference, dtype=object)
+    candidate = pd.Series(candidate, dtype=object)
+    equal = (reference == candidate) | (reference.isna() & candidate.isna())
+    return ~equal.to_numpy(dtype=bool)
+
+
+def compare_arrays(path, reference, candidate, rtol=DEFAULT_RTOL,
+                   atol=DEFAULT_ATOL):
+    """Return the mismatch of the two arrays as a list of at most one
+    mismatch."""
+    # pylint: disable=too-many-arguments
+    reference = np.asarray(reference)
+    candidate = np.asarray(candidate)
+    if reference.shape != candidate.shape:
+        return [{'path': path, 'count': 1,
+                 'sample': [{'reference': list(reference.shape),
+                             'candidate': list(candidate.shape)}]}]
+    differ = differences(reference.ravel(), candidate.ravel(), rtol, atol)
+    if not differ.any():
+        return []
+    positions = np.flatnonzero(differ)
+    return [{'path': path, 'count': len(positions),
+             'sample': [{'position': int(position),
+                         'reference': reference.ravel()[position],
+                         'candidate': candidate.ravel()[position]}
+                        for position in positions[:SAMPLE_SIZE]]}]
+
+
+def compare_frames(reference, candidate, rtol=DEFAULT_RTOL,
+                   atol=DEFAULT_ATOL, check_index=False):
+    """Return the mismatches of the columns of the two data frames, and of
+    their index if check_index is True."""
+    # pylint: disable=too-many-arguments
+    if len(reference) != len(candidate):
+        return [{'path': 'rows', 'count': 1,
+                 'sample': [{'reference': len(reference),
+                             'candidate': len(candidate)}]}]
+    mismatches = []
+    if check_index:
+        mismatches.extend(compare_arrays('index', reference.index.to_numpy(),
+                                         candidate.index.to_numpy(), rtol,
+                                         atol))
+    missing = reference.columns.symmetric_difference(candidate.columns)
+    if len(missing):
+        mismatches.append({
+            'path': 'columns', 'count': len(missing),
+            'sample': [{'reference': column in reference.columns,
+                        'candidate': column in candidate.columns,
+                        'column': column} for column in missing]})
+    for column in reference.columns.intersection(candidate.columns,
+                                                 sort=False):
+        mismatches.extend(compare_arrays(
+            str(column), reference[column].to_numpy(),
+            candidate[column].to_numpy(), rtol, atol))
+    return mismatches
+
+
+def compare_values(path, reference, candidate, rtol=DEFAULT_RTOL,
+                   atol=DEFAULT_ATOL):
+    """Return the mismatches of two nested dicts, lists, arrays or
+    scalars."""
+    # pylint: disable=too-many-arguments
+    if isinstance(reference, dict) and isinstance(candidate, dict):
+        mismatches = []
+        for key in list(dict.fromkeys(list(reference) + list(candidate))):
+            if key not in reference or key not in candidate:
+                mismatches.append({'path': f"{path}/{key}", 'count': 1,
+                                   'sample': [{'reference': key in reference,
+                                               'candidate': key in candidate}]
+                                   })
+            else:
+                mismatches.extend(compare_values(
+                    f"{path}/{key}", reference[key], candidate[key], rtol,
+                    atol))
+        return mismatches
+    if (isinstance(reference, (list, tuple)) and
+            isinstance(candidate, (list, tuple)) and
+            any(isinstance(value, (dict, list, tuple))
+                for value in list(reference) + list(candidate))):
+        if len(reference) != len(candidate):
+            return [{'path': path, 'count': 1,
+                     'sample': [{'reference': len(reference),
+                                 'candidate': len(candidate)}]}]
+        mismatches = []
+        for index, (ref_value, value) in enumerate(zip(reference,
+                                                       candidate)):
+            mismatches.extend(compare_values(f"{path}/{index}", ref_value,
+                                             value, rtol, atol))
+        return mismatches
+    return compare_arrays(path, np.atleast_1d(reference),
+                          np.atleast_1d(candidate), rtol, atol)
+
+
+class FigureCapture:
+    """Output sink that keeps the trace data of the figures instead of
+    writing the files."""
+
+    def __init__(self):
+        self.figures = {}
+
+    def submit_chart(self, fig, directory, filename, formats=None,
+                     width=None, height=None):
+        """Keep the trace data of the figure."""
+        # pylint: disable=too-many-arguments,unused-argument
+        self.figures[filename] = fig.to_dict()['data']
+
+    def submit_table(self, html, directory, filename):
+        """Tables are not kept. The summary is compared by its metrics."""
+
+    def flush(self):
+        """Nothing is queued."""
+
+    @staticmethod
+    def metrics():
+        """Return the metrics of a sink that writes nothing."""
+        return {'queue_depth': 0, 'max_queue_depth': 0, 'files_written': 0,
+                'bytes_written': 0, 'write_seconds': 0.0,
+                'files_per_second': 0.0, 'bytes_per_second': 0.0}
+
+
+def capture_figures(ci_data, test_data, only=None, exclude=None):
+    """Plot the selected charts in the current process and return the trace
+    data of each figure by file name."""
+    graph = tc.build_chart_graph(ci_data, test_data).select(only=only,
+                                                            exclude=exclude)
+    sink = FigureCapture()
+    previous = tc.set_output_sink(sink)
+    try:
+        graph.run(execution.SerialPool())
+    finally:
+        tc.set_output_sink(previous)
+    return sink.figures
+
+
+def read_data(data_dir, file_pattern):
+    """Read the files of the data drop matching the pattern."""
+    paths = sorted(pathlib.Path(data_dir).glob(file_pattern))
+    if not paths:
+        raise FileNotFoundError(f"No {file_pattern} files in {data_dir}")
+    return pd.concat(map(pd.read_csv, paths))
+
+
+def timed(func, *args):
+    """Call the function and return its result and duration in seconds."""
+    start = timer()
+    result = func(*args)
+    return result, timer() - start
+
+
+class Verification:
+    """The checks of an engine against the reference."""
+
+    def __init__(self, engine, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+        self.engine = engine
+        self.rtol = rtol
+        self.atol = atol
+        self.checks = []
+
+    def run(self, name, compare, func, *args):
+        """Run the named step with both engines and compare the results with
+        the given compare function. Returns the results of both engines."""
+        with tracing.span(f"verify_{name}", 'verify', engine='reference'):
+            reference, reference_seconds = timed(
+                getattr(engines.REFERENCE, func), *args)
+        with tracing.span(f"verify_{name}", 'verify',
+                          engine=self.engine.name):
+            candidate, engine_seconds = timed(getattr(self.engine, func),
+                                              *args)
+        self.add(name, compare(reference, candidate), reference_seconds,
+                 engine_seconds)
+        return reference, candidate
+
+    def add(self, name, mismatches, reference_seconds, engine_seconds):
+        """Add the result of a check."""
+        self.checks.append({
+            'name': name, 'mismatches': mismatches,
+            'reference_seconds': reference_seconds,
+            'engine_seconds': engine_seconds,
+            'speedup': (reference_seconds / engine_seconds
+                        if engine_seconds else 0.0)})
+
+    @property
+    def passed(self):
+        """Whether none of the checks has mismatches."""
+        return not any(check['mismatches'] for check in self.checks)
+
+    def report(self):
+        """Return the checks as a JSON serializable dict."""
+        return {'engine': self.engine.name, 'rtol': self.rtol,
+                'atol': self.atol, 'passed': self.passed,
+                'checks': self.checks}
+
+
+def verify(data_dir, engine, pool=None, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL,
+           only=None, exclude=None):
+    """Verify the engine against the reference on the data drop in the data
+    directory and return the Verification.
+
+    The data is prepared in the given pool. The charts can be selected with
+    the 'only' and 'exclude' glob patterns of trackerchart.plot.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    if isinstance(engine, str):
+        engine = engines.get_engine(engine)
+    verification = Verification(engine, rtol, atol)
+
+    def frames(reference, candidate):
+        return compare_frames(reference, candidate, rtol, atol)
+
+    def aggregates(reference, candidate):
+        return compare_frames(reference, candidate, rtol, atol,
+                              check_index=True)
+
+    prepared = {}
+    for name, func in [('ci_data', 'calc_case_info_data'),
+                       ('test_data', 'calc_testing_aggregates_data')]:
+        file_pattern, _ = tc.DATA_SOURCES[name]
+        raw = read_data(data_dir, file_pattern)
+        # Both engines get their own copy since the data is prepared in
+        # place.
+        with tracing.span(f"verify_{func}", 'verify', engine='reference'):
+            reference, reference_seconds = timed(
+                getattr(engines.REFERENCE, func), raw.copy(), pool)
+        with tracing.span(f"verify_{func}", 'verify', engine=engine.name):
+            candidate, engine_seconds = timed(getattr(engine, func), raw,
+                                              pool)
+        verification.add(func, frames(reference, candidate),
+                         reference_seconds, engine_seconds)
+        prepared[name] = (reference, candidate)
+    ci_data, _ = prepared['ci_data']
+    test_data, _ = prepared['test_data']
+    for group, date in AGGREGATES:
+        verification.run(f"agg_count_cumsum_by_date[{group},{date}]",
+                         aggregates, 'agg_count_cumsum_by_date', ci_data,
+                         'CaseCode', group, date)
+    verification.run(
+        'summary_metrics',
+        lambda reference, candidate: compare_values(
+            'summary', reference, candidate, rtol, atol),
+        'summary_metrics', ci_data, test_data)
+    figures = [
+        timed(capture_figures, ci, test, only, exclude)
+        for ci, test in zip(prepared['ci_data'], prepared['test_data'])]
+    (reference, reference_seconds), (candidate, engine_seconds) = figures
+    verification.add('figures', compare_values('', reference, candidate,
+                                               rtol, atol),
+                     reference_seconds, engine_seconds)
+    return verification
+
+
+def log_report(verification):
+    """Log the result and the speed-up of each check and samples of the
+    mismatches."""
+    logging.info("Verification of the %s engine (rtol=%g, atol=%g)",
+                 verification.engine.name, verification.rtol,
+                 verification.atol)
+    for check in verification.checks:
+        logging.info("%s: %s, %.3fs -> %.3fs (%.2fx)", check['name'],
+                     "MISMATCH" if check['mismatches'] else "OK",
+                     check['reference_seconds'], check['engine_seconds'],
+                     check['speedup'])
+        for mismatch in check['mismatches']:
+            logging.warning("  %s: %d differences", mismatch['path'] or "/",
+                            mismatch['count'])
+            for sample in mismatch['sample']:
+                logging.warning("    %s", sample)
+    if verification.passed:
+        logging.info("The %s engine matches the reference",
+                     verification.engine.name)
+    else:
+        logging.error("The %s engine does not match the reference",
+                      verification.engine.name)
+
+
+def save_report(verification, path):
+    """Write the report of the verification to a JSON file."""
+    with open(path, 'w', encoding='utf-8') as file_handle:
+        json.dump(verification.report(), file_handle, indent=1, default=str)
@@ -0,0 +1,203 @@
+"""
+Watch mode of updatetracker.
+
+Instead of being started many times a day while waiting for a new data drop,
+updatetracker can run as a long-lived process with '--watch'. The Watcher
+keeps the worker pool and the prepared data sets in memory and polls for
+changes. Every cycle it downloads the data drop, unless downloads are
+skipped, then compares the size and modification time of the files of each
+data set in the data directory with the previous cycle. Only the changed data
+sets are prepared again and only the charts that depend on them are plotted.
+
+The watcher stops after the current cycle on SIGINT or SIGTERM. When a
+module of the package or the project configuration changes, it stops so that
+the caller can close the pool and restart the process with reexec.
+"""
+
+import os
+import sys
+import signal
+import logging
+import pathlib
+import threading
+from timeit import default_timer as timer
+
+from covid19trackerph import trackerchart
+
+
+DEFAULT_INTERVAL = 600
+PACKAGE_DIR = pathlib.Path(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_FILES = [PACKAGE_DIR.parent / "pyproject.toml"]
+
+# Results of Watcher.run.
+STOPPED = 'stopped'
+RELOAD = 'reload'
+
+
+def file_fingerprint(paths):
+    """Return the names, sizes and modification times of the given files."""
+    fingerprint = []
+    for path in sorted(paths):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        fingerprint.append((str(path), stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
+
+
+def data_fingerprints(data_dir):
+    """Return the fingerprint of the files of each data set."""
+    return {name: file_fingerprint(pathlib.Path(data_dir).glob(file_pattern))
+            for name, (file_pattern, _) in trackerchart.DATA_SOURCES.items()}
+
+
+def code_fingerprint():
+    """Return the fingerprint of the package modules and the configuration."""
+    return file_fingerprint(list(PACKAGE_DIR.rglob("*.py")) + CONFIG_FILES)
+
+
+def reexec():
+    """Replace the current process with a new run of the same command."""
+    argv = getattr(sys, 'orig_argv', None) or [sys.executable] + sys.argv
+    logging.info("Restarting: %s", " ".join(argv))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, argv)
+
+
+class Watcher:
+    """Regenerates the charts whose data changed.
+
+    download is called at the start of every cycle if given. is_current is
+    called in the first cycle and returns True if the charts are already up
+    to date with the data, in which case the data is only prepared.
+    on_plotted is called after the charts were plotted. on_prepared is
+    called with the prepared data sets by name whenever any of these
+    changed. plot_options are passed to trackerchart.plot. The data sets
+    are prepared by the load_data of engine if given, e.g. an engine of the
+    engines module, otherwise by trackerchart.load_data.
+    """
+
+    def __init__(self, script_dir, data_dir, pool, interval=DEFAULT_INTERVAL,
+                 download=None, is_current=None, on_plotted=None,
+                 plot_options=None, on_prepared=None, engine=None):
+        # pylint: disable=too-many-arguments
+        self.script_dir = script_dir
+        self.data_dir = data_dir
+        self.full_data_dir = f"{script_dir}/{data_dir}"
+        self.pool = pool
+        self.interval = interval
+        self.download = download
+        self.is_current = is_current
+        self.on_plotted = on_plotted
+        self.on_prepared = on_prepared
+        self.plot_options = dict(plot_options or {})
+        self.load_data = (engine.load_data if engine is not None
+                          else trackerchart.load_data)
+        self.frames = {}
+        self.fingerprints = {}
+        self.code = code_fingerprint()
+        self.stop_event = threading.Event()
+
+    def changed_data(self):
+        """Return the names of the data sets whose files changed and the
+        new fingerprints."""
+        fingerprints = data_fingerprints(self.full_data_dir)
+        changed = [name for name, fingerprint in fingerprints.items()
+                   if fingerprint != self.fingerprints.get(name)]
+        return changed, fingerprints
+
+    def has_affected_charts(self, changed):
+        """Check if any of the selected charts depend on the changed data."""
+        try:
+            trackerchart.build_chart_graph().select(
+                only=self.plot_options.get('only'),
+                exclude=self.plot_options.get('exclude'),
+                depends_on=changed)
+        except ValueError:
+            return False
+        return True
+
+    def cycle(self, first=False):
+        """Check for changes and regenerate the affected charts.
+
+        The changes are only recorded once the charts were plotted so that
+        a failed cycle is retried in the next one. Returns the names of the
+        plotted charts.
+        """
+        if self.download is not None:
+            try:
+                self.download()
+            except Exception:  # pylint: disable=broad-except
+                # Try again in the next cycle.
+                logging.exception("Data drop download failed")
+        changed, fingerprints = self.changed_data()
+        if not changed:
+            logging.info("No changes in the data sets")
+            return []
+        start = timer()
+        rebuild = self.plot_options.get('rebuild', False)
+        for name in changed:
+            logging.info("Preparing the changed data set %s", name)
+            self.frames[name] = self.load_data(
+                name, self.full_data_dir, rebuild=rebuild, pool=self.pool)
+        if self.on_prepared is not None:
+            self.on_prepared(dict(self.frames))
+        plotted = []
+        if first and self.is_current is not None and self.is_current():
+            logging.info("The charts are up to date")
+        elif self.has_affected_charts(changed):
+            # All of the charts are plotted in the first cycle and when every
+            # data set changed, so that a rebuild empties the chart
+            # directories.
+            everything = (first or
+                          set(changed) >= set(trackerchart.DATA_SOURCES))
+            plotted = trackerchart.plot(
+                self.script_dir, self.data_dir, pool=self.pool,
+                data=self.frames, depends_on=None if everything else changed,
+                **self.plot_options)
+            logging.info("Regenerated %d charts for %s in %.1fs",
+                         len(plotted), ", ".join(changed), timer() - start)
+            if self.on_plotted is not None:
+                self.on_plotted()
+        self.fingerprints.update(fingerprints)
+        # Only the first run rebuilds the caches and the chart directories.
+        self.plot_options['rebuild'] = False
+        return plotted
+
+    def code_changed(self):
+        """Check if the code or the configuration changed."""
+        return code_fingerprint() != self.code
+
+    def stop(self, *_):
+        """Stop after the current cycle. A second call exits right away."""
+        if self.stop_event.is_set():
+            raise KeyboardInterrupt
+        logging.info("Stopping after the current cycle")
+        self.stop_event.set()
+
+    def run(self):
+        """Run the cycles until stopped or the code changes.
+
+        Returns STOPPED or RELOAD.
+        """
+        previous = {sig: signal.signal(sig, self.stop)
+                    for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            first = True
+            while True:
+                try:
+                    self.cycle(first=first)
+                    first = False
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("Chart update failed, retrying in the "
+                                      "next cycle")
+                if self.stop_event.wait(self.interval):
+                    return STOPPED
+                if self.code_changed():
+                    logging.info("The code or configuration changed")
+                    return RELOAD
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
@@ -0,0 +1,108 @@
+"""Unit tests for the backfill module."""
+# pylint: disable=missing-function-docstring
+
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import covid19trackerph.backfill as bf
+import covid19trackerph.trackerchart as tc
+from covid19trackerph.benchmarks import synthetic
+
+
+@pytest.fixture(name="archive")
+def fixture_archive(tmp_path):
+    archive = tmp_path / "archive"
+    # Each drop has the cases of the previous one and more recent ones.
+    for index, days in enumerate([40, 45, 50]):
+        synthetic.write_data_drop(archive / f"2020-07-{10 + index:02}",
+                                  200 + 20 * index, seed=4, days=days)
+    (archive / "notes").mkdir()
+    return archive
+
+
+def test_find_drops(archive):
+    assert [bf.drop_name(drop) for drop in bf.find_drops(archive)] == [
+        '2020-07-10', '2020-07-11', '2020-07-12']
+
+
+def test_backfill(archive, tmp_path):
+    store = tmp_path / "store"
+    with tc.create_pool('serial') as pool:
+        stats = bf.backfill(archive, store, pool)
+    assert stats['backfilled'] == 3 and not stats['failed']
+    assert stats['drops_per_minute'] > 0
+    summary = pd.read_csv(store / bf.SUMMARY, index_col='drop')
+    assert list(summary['total_confirmed']) == [200, 220, 240]
+    checkpoint = json.loads((store / bf.CHECKPOINT).read_text())
+    assert set(checkpoint) == {'2020-07-10', '2020-07-11', '2020-07-12'}
+
+    counts = bf.load_counts(store)
+    assert counts.index.names == ['drop', tc.REGION, 'date']
+    assert counts.loc['2020-07-11', 'Confirmed'].sum() == 220
+    confirmed = bf.revisions(store)
+    assert list(confirmed.columns) == ['2020-07-10', '2020-07-11',
+                                       '2020-07-12']
+    assert confirmed.sum().tolist() == [200, 220, 240]
+
+
+def test_backfill_resumes(archive, tmp_path):
+    store = tmp_path / "store"
+    with tc.create_pool('serial') as pool:
+        bf.backfill(archive, store, pool)
+        stats = bf.backfill(archive, store, pool)
+        assert stats['backfilled'] == 0 and stats['skipped'] == 3
+
+        # A changed drop and a drop without its counts are prepared again.
+        synthetic.write_data_drop(archive / "2020-07-11", 230, seed=4,
+                                  days=45)
+        os.remove(bf.counts_path(store, '2020-07-12'))
+        stats = bf.backfill(archive, store, pool)
+        assert stats['backfilled'] == 2 and stats['skipped'] == 1
+    summary = pd.read_csv(store / bf.SUMMARY, index_col='drop')
+    assert summary.loc['2020-07-11', 'total_confirmed'] == 230
+
+
+def test_backfill_failed_drop(archive, tmp_path):
+    broken = archive / "2020-07-13"
+    broken.mkdir()
+    (broken / synthetic.CASE_INFORMATION_FILE).write_text("CaseCode\nC1\n")
+    store = tmp_path / "store"
+    with tc.create_pool('serial') as pool:
+        stats = bf.backfill(archive, store, pool)
+    assert stats['backfilled'] == 3
+    assert stats['failed'] == ['2020-07-13']
+    assert '2020-07-13' not in json.loads(
+        (store / bf.CHECKPOINT).read_text())
+
+
+def test_backfill_process_pool(archive, tmp_path):
+    store = tmp_path / "store"
+    with tc.create_pool('process', workers=2) as pool:
+        stats = bf.backfill(archive, store, pool)
+    assert stats['backfilled'] == 3
+    assert bf.revisions(store, 'Deaths').shape[1] == 3
+
+
+def exit_on_last_drop(drop_dir, store_dir, engine=bf.DEFAULT_ENGINE,
+                      process_drop=bf.process_drop):
+    """Prepare the drop or kill the worker for the last drop."""
+    if drop_dir.endswith('2020-07-12'):
+        os._exit(1)  # pylint: disable=protected-access
+    return process_drop(drop_dir, store_dir, engine)
+
+
+def test_backfill_dead_worker(archive, tmp_path, monkeypatch):
+    # The workers are forked after the patch so they run it too.
+    monkeypatch.setattr(bf, 'process_drop', exit_on_last_drop)
+    monkeypatch.setattr(bf, 'WORKER_CHECK_SECONDS', 0.1)
+    store = tmp_path / "store"
+    with tc.create_pool('process', workers=2, start_method='fork') as pool:
+        stats = bf.backfill(archive, store, pool)
+        assert pool.lost_workers()
+    assert stats['backfilled'] == 2
+    assert stats['failed'] == ['2020-07-12']
+    assert '2020-07-12' not in json.loads(
+        (store / bf.CHECKPOINT).read_text())
@@ -0,0 +1,103 @@
+"""Unit tests for the compress module."""
+# pylint: disable=missing-function-docstring
+
+import gzip
+
+import covid19trackerph.compress as cp
+
+
+def test_postprocess_writes_siblings(tmp_path):
+    html = "<div>" + "chart data " * 1000 + "</div>"
+    (tmp_path / "Active.html").write_text(html, encoding='utf-8')
+    (tmp_path / "notes.txt").write_text("not compressed", encoding='utf-8')
+
+    stats = cp.postprocess([str(tmp_path)])
+
+    assert stats['processed'] == 1
+    compressed = (tmp_path / "Active.html.gz").read_bytes()
+    assert gzip.decompress(compressed).decode('utf-8') == html
+    original, size = stats['sizes']['.gz']
+    assert original == len(html)
+    assert size < original
+    assert not (tmp_path / "notes.txt.gz").exists()
+
+
+def test_postprocess_skips_unchanged(tmp_path):
+    (tmp_path / "Active.html").write_text("<div>1</div>", encoding='utf-8')
+    cp.postprocess([str(tmp_path)])
+
+    stats = cp.postprocess([str(tmp_path)])
+    assert stats['processed'] == 0
+    assert stats['skipped'] == 1
+
+    (tmp_path / "Active.html").write_text("<div>2</div>", encoding='utf-8')
+    stats = cp.postprocess([str(tmp_path)])
+    assert stats['processed'] == 1
+    compressed = (tmp_path / "Active.html.gz").read_bytes()
+    assert gzip.decompress(compressed) == b"<div>2</div>"
+
+
+def test_postprocess_recreates_missing_sibling(tmp_path):
+    (tmp_path / "Active.html").write_text("<div>1</div>", encoding='utf-8')
+    cp.postprocess([str(tmp_path)])
+    (tmp_path / "Active.html.gz").unlink()
+
+    stats = cp.postprocess([str(tmp_path)])
+    assert stats['processed'] == 1
+    assert (tmp_path / "Active.html.gz").exists()
+
+
+def test_postprocess_png_only_when_requested(tmp_path, mocker):
+    (tmp_path / "Active.png").write_bytes(b"png data")
+    optimize = mocker.patch.object(cp, 'optimize_png', return_value=4)
+
+    stats = cp.postprocess([str(tmp_path)])
+    optimize.assert_not_called()
+    assert stats['processed'] == 0
+
+    stats = cp.postprocess([str(tmp_path)], png=True)
+    optimize.assert_called_once()
+    assert stats['sizes']['.png'] == [len(b"png data"), 4]
+
+    stats = cp.postprocess([str(tmp_path)], png=True)
+    assert optimize.call_count == 1
+
+
+def test_postprocess_png_rewritten_with_the_same_bytes(tmp_path, mocker):
+    path = tmp_path / "Active.png"
+    path.write_bytes(b"png data")
+
+    def optimize(png_path, data):
+        with open(png_path, 'wb') as file_handle:
+            file_handle.write(data[:3])
+        return 3
+    optimize = mocker.patch.object(cp, 'optimize_png', side_effect=optimize)
+    cp.postprocess([str(tmp_path)], png=True)
+    assert path.read_bytes() == b"png"
+
+    # The chart is rendered again to the same unoptimized bytes.
+    path.write_bytes(b"png data")
+    stats = cp.postprocess([str(tmp_path)], png=True)
+    assert stats['processed'] == 1
+    assert path.read_bytes() == b"png"
+
+    stats = cp.postprocess([str(tmp_path)], png=True)
+    assert stats['skipped'] == 1
+    assert optimize.call_count == 2
+
+
+def test_postprocess_png_only(tmp_path, mocker):
+    (tmp_path / "Active.html").write_text("<div>1</div>", encoding='utf-8')
+    (tmp_path / "Active.png").write_bytes(b"png data")
+    mocker.patch.object(cp, 'optimize_png', return_value=4)
+    stats = cp.postprocess([str(tmp_path)], png=True, text=False)
+    assert stats['processed'] == 1
+    assert not (tmp_path / "Active.html.gz").exists()
+
+
+def test_postprocess_without_brotli(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(cp, 'brotli', None)
+    (tmp_path / "Active.html").write_text("<div>1</div>", encoding='utf-8')
+    cp.postprocess([str(tmp_path)])
+    assert "brotli is not installed" in caplog.text
+    assert not (tmp_path / "Active.html.br").exists()
@@ -0,0 +1,357 @@
+"""Unit tests for the datadrop module."""
+# pylint: disable=missing-function-docstring
+
+import threading
+
+import pytest
+from googleapiclient import errors
+
+import covid19trackerph.datadrop as dd
+from covid19trackerph.localdrive import LocalDrive
+
+
+PREFIX = "DOH COVID Data Drop_ 20211010 - "
+
+
+@pytest.fixture(name="data_dir")
+def fixture_data_dir(tmp_path, mocker):
+    mocker.patch.object(dd, 'DATA_DIR', str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("name, expected",
+                         [
+                             (PREFIX + "04 Case Information.csv",
+                              "04 Case Information.csv"),
+                             ("DOH Data Drop 20211010 - Changelog.xlsx",
+                              "Changelog.xlsx"),
+                             ("READ ME FIRST (10/10).pdf", "READ ME FIRST.pdf"),
+                         ])
+def test_data_file_name(name, expected):
+    assert dd.data_file_name(name) == expected
+
+
+def test_download_data_files_concurrently(data_dir):
+    files = {
+        PREFIX + "04 Case Information_batch_0.csv": b"a" * 1000,
+        PREFIX + "04 Case Information_batch_1.csv": b"b" * 2500,
+        PREFIX + "07 Testing Aggregates.csv": b"c" * 10,
+    }
+    drive = LocalDrive(files)
+    downloaded = dd.download_data_files(drive, "folder", workers=3,
+                                        chunksize=256,
+                                        service_factory=lambda: drive)
+    assert len(downloaded) == 3
+    assert (data_dir / "04 Case Information_batch_1.csv").read_bytes() == \
+        b"b" * 2500
+    assert (data_dir / "07 Testing Aggregates.csv").read_bytes() == b"c" * 10
+    # 1000 and 2500 bytes in 256 byte chunks.
+    assert len(drive.media_requests) == 4 + 10 + 1
+
+
+def test_download_retries(data_dir, mocker):
+    sleep = mocker.patch('time.sleep')
+    name = PREFIX + "07 Testing Aggregates.csv"
+    drive = LocalDrive({name: b"c" * 10}, transient={name: 2})
+    assert dd.download(folder_id="folder", service_factory=lambda: drive)
+    assert sleep.call_count == 2
+    assert (data_dir / "07 Testing Aggregates.csv").read_bytes() == b"c" * 10
+
+    name = PREFIX + "04 Case Information.csv"
+    drive = LocalDrive({name: b"a" * 10}, transient={name: 2})
+    with pytest.raises(errors.HttpError):
+        dd.download(folder_id="folder", service_factory=lambda: drive,
+                    retries=1)
+    assert len(drive.media_requests) == 2
+
+
+def test_download_data_files_without_factory(data_dir):
+    drive = LocalDrive({PREFIX + "07 Testing Aggregates.csv": b"c" * 10})
+    downloaded = dd.download_data_files(drive, "folder", workers=4)
+    assert len(downloaded) == 1
+    assert (data_dir / "07 Testing Aggregates.csv").exists()
+
+
+def test_download_data_files_changelog_failure(data_dir):
+    changelog = "DOH Data Drop 20211010 - Changelog.xlsx"
+    files = {changelog: b"x", PREFIX + "07 Testing Aggregates.csv": b"c"}
+    drive = LocalDrive(files, failures=[changelog])
+    downloaded = dd.download_data_files(drive, "folder",
+                                        service_factory=lambda: drive)
+    assert downloaded == [str(data_dir / "07 Testing Aggregates.csv")]
+
+
+def test_download_data_files_failure(data_dir):
+    name = PREFIX + "04 Case Information.csv"
+    drive = LocalDrive({name: b"x"}, failures=[name])
+    with pytest.raises(errors.HttpError):
+        dd.download_data_files(drive, "folder", service_factory=lambda: drive)
+    assert data_dir.exists()
+
+
+def test_download_data_files_skips_unchanged(data_dir):
+    case_info = PREFIX + "04 Case Information.csv"
+    testing = PREFIX + "07 Testing Aggregates.csv"
+    drive = LocalDrive({case_info: b"a" * 10, testing: b"b" * 10})
+    downloaded = dd.download_data_files(drive, "folder")
+    assert len(downloaded) == 2
+    assert not dd.is_plotted()
+    dd.mark_plotted()
+
+    requests = len(drive.media_requests)
+    assert not dd.download_data_files(drive, "folder")
+    assert len(drive.media_requests) == requests
+    assert dd.is_plotted()
+
+    drive.update(testing, b"c" * 12)
+    downloaded = dd.download_data_files(drive, "folder")
+    assert downloaded == [str(data_dir / "07 Testing Aggregates.csv")]
+    assert (data_dir / "07 Testing Aggregates.csv").read_bytes() == b"c" * 12
+    assert not dd.is_plotted()
+
+
+def test_download_data_files_missing_local_file(data_dir):
+    testing = PREFIX + "07 Testing Aggregates.csv"
+    drive = LocalDrive({testing: b"b" * 10})
+    dd.download_data_files(drive, "folder")
+    (data_dir / "07 Testing Aggregates.csv").unlink()
+    assert len(dd.download_data_files(drive, "folder")) == 1
+
+
+@pytest.mark.parametrize("item, entry, expected",
+                         [
+                             ({'md5Checksum': 'a', 'size': '3'},
+                              {'md5Checksum': 'a'}, True),
+                             ({'md5Checksum': 'b', 'size': '3'},
+                              {'md5Checksum': 'a'}, False),
+                             ({'md5Checksum': 'a', 'size': '4'},
+                              {'md5Checksum': 'a'}, False),
+                             ({'modifiedTime': 't1'},
+                              {'modifiedTime': 't1'}, True),
+                             ({'modifiedTime': 't2'},
+                              {'modifiedTime': 't1'}, False),
+                             ({}, {}, False),
+                             ({'md5Checksum': 'a'}, None, False),
+                         ])
+def test_is_unchanged(tmp_path, item, entry, expected):
+    path = tmp_path / "file.csv"
+    path.write_bytes(b"abc")
+    assert dd.is_unchanged(item, entry, str(path)) == expected
+
+
+def test_download_gdrive_file_resumes_partial(tmp_path):
+    content = bytes(range(256)) * 4
+    drive = LocalDrive({"file.csv": content})
+    path = tmp_path / "file.csv"
+    (tmp_path / "file.csv.part").write_bytes(content[:300])
+
+    size = dd.download_gdrive_file(
+        drive, "id0", str(path), chunksize=512, expected_size=len(content),
+        expected_md5=drive.items[0]['md5Checksum'])
+
+    assert size == len(content) - 300
+    assert path.read_bytes() == content
+    assert drive.ranges[0] == "bytes=300-811"
+    assert not (tmp_path / "file.csv.part").exists()
+
+
+def test_download_gdrive_file_restarts_stale_partial(tmp_path):
+    content = bytes(range(256)) * 4
+    drive = LocalDrive({"file.csv": content})
+    path = tmp_path / "file.csv"
+    # Left by an interrupted download of an older version of the file.
+    (tmp_path / "file.csv.part").write_bytes(b"x" * 300)
+
+    size = dd.download_gdrive_file(
+        drive, "id0", str(path), chunksize=512, expected_size=len(content),
+        expected_md5=drive.items[0]['md5Checksum'])
+
+    assert size == len(content)
+    assert path.read_bytes() == content
+    assert not (tmp_path / "file.csv.part").exists()
+
+
+def test_download_gdrive_file_retries(tmp_path, mocker):
+    sleep = mocker.patch('time.sleep')
+    drive = LocalDrive({"file.csv": b"abc"}, transient={"file.csv": 2})
+    path = tmp_path / "file.csv"
+    dd.download_gdrive_file(drive, "id0", str(path))
+    assert path.read_bytes() == b"abc"
+    assert sleep.call_count == 2
+    # exponential backoff
+    assert sleep.call_args_list[1][0][0] > sleep.call_args_list[0][0][0] / 2
+
+
+def test_download_gdrive_file_retries_exhausted(tmp_path, mocker):
+    mocker.patch('time.sleep')
+    drive = LocalDrive({"file.csv": b"abc"}, transient={"file.csv": 10})
+    path = tmp_path / "file.csv"
+    with pytest.raises(errors.HttpError):
+        dd.download_gdrive_file(drive, "id0", str(path), retries=3)
+    assert len(drive.media_requests) == 4
+    assert not path.exists()
+
+
+def test_download_gdrive_file_integrity_error(tmp_path):
+    drive = LocalDrive({"file.csv": b"abc"})
+    path = tmp_path / "file.csv"
+    path.write_bytes(b"previous")
+    with pytest.raises(dd.IntegrityError):
+        dd.download_gdrive_file(drive, "id0", str(path), expected_size=3,
+                                expected_md5="0" * 32)
+    # The previous file is kept and the corrupt download is discarded.
+    assert path.read_bytes() == b"previous"
+    assert not (tmp_path / "file.csv.part").exists()
+    with pytest.raises(dd.IntegrityError):
+        dd.download_gdrive_file(drive, "id0", str(path), expected_size=4)
+
+
+def test_download_gdrive_file_empty(tmp_path):
+    drive = LocalDrive({"file.csv": b""})
+    path = tmp_path / "file.csv"
+    assert dd.download_gdrive_file(drive, "id0", str(path)) == 0
+    assert path.read_bytes() == b""
+
+
+def test_list_data_files_pagination():
+    files = {f"file{index}.csv": b"x" for index in range(25)}
+    drive = LocalDrive(files, page_size=10)
+    names = [item['name'] for item in dd.list_data_files(drive, "folder")]
+    assert names == list(files)
+    assert [request['pageToken'] for request in drive.list_requests] == \
+        [None, "10", "20"]
+    assert all(request['pageSize'] == dd.LIST_PAGE_SIZE
+               for request in drive.list_requests)
+
+
+def test_list_data_files_is_lazy():
+    files = {f"file{index}.csv": b"x" for index in range(25)}
+    drive = LocalDrive(files, page_size=10)
+    items = dd.list_data_files(drive, "folder")
+    assert next(items)['name'] == "file0.csv"
+    assert len(drive.list_requests) == 1
+
+
+def test_list_data_files_empty():
+    with pytest.raises(dd.RemoteFileNotFoundError):
+        list(dd.list_data_files(LocalDrive({}), "folder"))
+
+
+def test_download_data_files_many_pages(data_dir):
+    files = {PREFIX + f"04 Case Information_batch_{index}.csv":
+             str(index).encode() for index in range(35)}
+    drive = LocalDrive(files, page_size=4)
+    downloaded = dd.download_data_files(drive, "folder", workers=4,
+                                        service_factory=lambda: drive)
+    assert len(downloaded) == 35
+    assert (data_dir / "04 Case Information_batch_34.csv").read_bytes() == \
+        b"34"
+
+
+def test_download_starts_before_listing_ends(data_dir, mocker):
+    files = {PREFIX + f"04 Case Information_batch_{index}.csv":
+             str(index).encode() for index in range(6)}
+    drive = LocalDrive(files, page_size=2)
+    started = threading.Event()
+    list_data_files = dd.list_data_files
+    download_gdrive_file = dd.download_gdrive_file
+
+    def slow_listing(*args, **kwargs):
+        for index, item in enumerate(list_data_files(*args, **kwargs)):
+            if index == 2:
+                # Wait for a download of the first page before listing more.
+                assert started.wait(timeout=5)
+            yield item
+
+    def signal_download(*args, **kwargs):
+        started.set()
+        return download_gdrive_file(*args, **kwargs)
+    mocker.patch.object(dd, 'list_data_files', side_effect=slow_listing)
+    mocker.patch.object(dd, 'download_gdrive_file',
+                        side_effect=signal_download)
+    downloaded = dd.download_data_files(drive, "folder", workers=2,
+                                        service_factory=lambda: drive)
+    assert len(downloaded) == 6
+    assert len(drive.list_requests) == 3
+
+
+README = "READ ME FIRST (10/10).pdf"
+FOLDER_ID = "1AbCdEfGhIjKlMnOpQrStUvWxYz"
+
+
+def test_resolve_folder_id_is_cached(data_dir, mocker):
+    drive = LocalDrive({README: b"%PDF"})
+    extract = mocker.patch.object(dd, 'extract_datadrop_link',
+                                  return_value="https://bit.ly/short")
+    full_url = mocker.patch.object(
+        dd, 'get_full_url',
+        return_value=f"https://drive.google.com/drive/folders/{FOLDER_ID}")
+    mocker.patch.object(dd, 'README_FILE_NAME',
+                        str(data_dir / "README.pdf"))
+    assert dd.resolve_folder_id(drive) == FOLDER_ID
+    assert dd.resolve_folder_id(drive) == FOLDER_ID
+    assert extract.call_count == 1
+    assert full_url.call_count == 1
+    assert not (data_dir / "README.pdf").exists()
+
+    # A new version of the README is parsed again.
+    drive.update(README, b"%PDF-2")
+    assert dd.resolve_folder_id(drive) == FOLDER_ID
+    assert extract.call_count == 2
+
+
+def test_resolve_folder_id_full_link(data_dir, mocker):
+    drive = LocalDrive({README: b"%PDF"})
+    mocker.patch.object(
+        dd, 'extract_datadrop_link',
+        return_value=f"https://drive.google.com/drive/folders/{FOLDER_ID}")
+    full_url = mocker.patch.object(dd, 'get_full_url')
+    mocker.patch.object(dd, 'README_FILE_NAME',
+                        str(data_dir / "README.pdf"))
+    assert dd.resolve_folder_id(drive) == FOLDER_ID
+    full_url.assert_not_called()
+
+
+class FakePDFObject(dict):
+    def getObject(self):  # pylint: disable=invalid-name
+        return self
+
+
+def test_extract_datadrop_link(mocker):
+    link = {'/A': {'/URI': "https://bit.ly/datadrop"}}
+    pages = [FakePDFObject(),
+             FakePDFObject({'/Annots': [
+                 FakePDFObject({'/Subtype': "/Highlight"}),
+                 FakePDFObject({'/A': {'/URI': "mailto:doh@example.com"}}),
+                 FakePDFObject(link)]}),
+             FakePDFObject({'/Annots': [FakePDFObject(
+                 {'/A': {'/URI': "https://bit.ly/other"}})]})]
+    reader = mocker.patch('PyPDF2.PdfFileReader')
+    reader.return_value.numPages = len(pages)
+    reader.return_value.getPage.side_effect = pages.__getitem__
+    # The first link of the PDF is the data drop link.
+    assert dd.extract_datadrop_link("README.pdf") == "https://bit.ly/datadrop"
+    assert reader.return_value.getPage.call_count == 2
+
+
+def test_lookup_folder_batches_cached_folder(data_dir, mocker):
+    drive = LocalDrive({README: b"%PDF", PREFIX + "04 Case Information.csv":
+                       b"data"})
+    mocker.patch.object(
+        dd, 'extract_datadrop_link',
+        return_value=f"https://drive.google.com/drive/folders/{FOLDER_ID}")
+    mocker.patch.object(dd, 'README_FILE_NAME',
+                        str(data_dir / "README.pdf"))
+    # Nothing is cached on the first run.
+    assert dd.lookup_folder(drive) == (FOLDER_ID, None)
+    assert not drive.batches
+
+    drive.list_requests.clear()
+    folder_id, first_page = dd.lookup_folder(drive)
+    assert folder_id == FOLDER_ID
+    assert drive.batches == [2]
+    downloaded = dd.download_data_files(drive, folder_id,
+                                        first_page=first_page)
+    assert len(downloaded) == 2
+    # The first page of the listing came with the batch.
+    assert len(drive.list_requests) == 2
@@ -0,0 +1,108 @@
+"""Unit tests for the drilldown module."""
+# pylint: disable=missing-function-docstring
+
+import os
+
+import pandas as pd
+import pytest
+
+import covid19trackerph.drilldown as dd
+import covid19trackerph.trackerchart as tc
+from covid19trackerph.benchmarks import synthetic
+
+
+@pytest.fixture(name="ci_data", scope="module")
+def fixture_ci_data():
+    data = synthetic.case_information(150, seed=3, days=40)
+    return tc.calc_case_info_data(data)
+
+
+@pytest.fixture(name="output")
+def fixture_output(tmp_path, monkeypatch):
+    monkeypatch.setattr(tc, 'CHART_OUTPUT', str(tmp_path / "charts"))
+    monkeypatch.setattr(tc, 'TABLE_OUTPUT', str(tmp_path / "tables"))
+    monkeypatch.setattr(dd, 'PAGE_OUTPUT', str(tmp_path / "areas"))
+    monkeypatch.setattr(dd, 'BATCH_SIZE', 4)
+    monkeypatch.setattr(tc, 'output_formats', ['html'])
+    return tmp_path
+
+
+def test_daily_counts():
+    data = pd.DataFrame({
+        'Region': ['A', 'A', 'B'],
+        'DateOnset': pd.to_datetime(['2020-03-01', '2020-03-02',
+                                     '2020-03-01']),
+        'HealthStatus': ['RECOVERED', 'DIED', 'MILD'],
+        'DateRecover': pd.to_datetime(['2020-03-03', '2020-03-16',
+                                       '2020-03-15']),
+        'DateDied': pd.to_datetime([None, '2020-03-04', None]),
+        tc.CASE_STATUS: ['CLOSED', 'CLOSED', 'ACTIVE'],
+        tc.DATE_CLOSED: pd.to_datetime(['2020-03-03', '2020-03-04', None]),
+    })
+    daily = dd.daily_counts(data, ['Region'])
+    region_a = daily.loc['A']
+    assert list(region_a['Confirmed']) == [1, 1, 0, 0]
+    assert list(region_a['Recovered']) == [0, 0, 1, 0]
+    assert list(region_a['Deaths']) == [0, 0, 0, 1]
+    assert list(region_a['Active']) == [1, 2, 1, 0]
+    assert daily.loc['B']['Active'].iloc[-1] == 1
+    assert daily['Confirmed'].sum() == 3
+
+
+def test_area_info():
+    assert dd.area_info('regions', 'NCR')['slug'] == 'ncr'
+    area = dd.area_info('municipalities',
+                        ('NCR', 'NCR SECOND DISTRICT', 'QUEZON CITY'))
+    assert area['slug'] == 'ncr-second-district-quezon-city'
+    assert area['title'] == 'QUEZON CITY, NCR SECOND DISTRICT'
+    assert dd.slugify("PARAÑAQUE CITY") == 'paranaque-city'
+
+
+def test_build_area_graph_slugs():
+    ci_data = tc.calc_case_info_data(synthetic.case_information(
+        20, seed=3, days=10))
+    # The region and the municipality have the same slug.
+    ci_data[tc.REGION] = ['LAGUNA STA CRUZ'] * 20
+    ci_data['ProvRes'] = ['LAGUNA'] * 20
+    ci_data[tc.CITY_MUN] = ['STA. CRUZ'] * 10 + ['STA CRUZ'] * 10
+    _, _, areas = dd.build_area_graph(ci_data, {})
+    names = sorted(dd.chart_name(area) for area in areas.values())
+    assert len(names) == 3
+    assert names[0] == 'areas/municipalities/laguna-sta-cruz'
+    assert names[1].startswith('areas/municipalities/laguna-sta-cruz-')
+    assert names[2] == 'areas/regions/laguna-sta-cruz'
+
+
+def test_generate_is_incremental(ci_data, output):
+    with tc.create_pool('serial') as pool:
+        rendered, remaining = dd.generate(ci_data, pool, str(output))
+        assert rendered > 0 and remaining == 0
+        page = output / "areas" / "regions" / "ncr.md"
+        assert "layout: tracker_area" in page.read_text()
+        assert (output / "charts" / "areas" / "regions" /
+                "ncr.html").exists()
+        assert (output / "tables" / "areas" / "regions" /
+                "ncr.html").exists()
+        assert "tracker/areas/regions/ncr" in (
+            output / "areas" / "index.md").read_text()
+
+        assert dd.generate(ci_data, pool, str(output)) == (0, 0)
+
+        # Only the areas of the changed cases are rendered again.
+        changed = ci_data.copy()
+        changed.loc[changed['Region'] == 'NCR', 'DateOnset'] += (
+            pd.Timedelta(days=1))
+        rendered_again, _ = dd.generate(changed, pool, str(output))
+        assert 0 < rendered_again < rendered
+
+        os.remove(page)
+        assert dd.generate(changed, pool, str(output)) == (1, 0)
+
+
+def test_generate_budget(ci_data, output, monkeypatch):
+    monkeypatch.setattr(dd, 'AREA_LEVELS', {'regions': [tc.REGION]})
+    with tc.create_pool('serial') as pool:
+        rendered, remaining = dd.generate(ci_data, pool, str(output),
+                                          budget=1e-9)
+        assert rendered == 0 and remaining > 0
+        assert dd.generate(ci_data, pool, str(output)) == (remaining, 0)
@@ -0,0 +1,107 @@
+"""Unit tests for the execution module."""
+# pylint: disable=missing-function-docstring
+
+import os
+import time
+
+import pytest
+
+import covid19trackerph.execution as ex
+import covid19trackerph.taskgraph as tg
+
+
+def write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+@pytest.mark.parametrize("files, expected",
+                         [
+                             ({"cpu.max": "200000 100000\n"}, 2.0),
+                             ({"cpu.max": "max 100000\n"}, None),
+                             ({"cpu/cpu.cfs_quota_us": "150000\n",
+                               "cpu/cpu.cfs_period_us": "100000\n"}, 1.5),
+                             ({"cpu,cpuacct/cpu.cfs_quota_us": "-1\n",
+                               "cpu,cpuacct/cpu.cfs_period_us": "100000\n"},
+                              None),
+                             ({}, None),
+                         ])
+def test_cgroup_cpu_limit(tmp_path, files, expected):
+    for name, content in files.items():
+        write(tmp_path / name, content)
+    assert ex.cgroup_cpu_limit(str(tmp_path)) == expected
+
+
+@pytest.mark.parametrize("affinity, quota, expected_cpus, expected_workers",
+                         [
+                             (8, None, 8, 7),
+                             (8, "150000 100000", 2, 1),
+                             (8, "400000 100000", 4, 3),
+                             (2, "400000 100000", 2, 1),
+                         ])
+def test_available_cpus(tmp_path, mocker, affinity, quota, expected_cpus,
+                        expected_workers):
+    # pylint: disable=too-many-arguments
+    mocker.patch.object(os, 'sched_getaffinity', create=True,
+                        return_value=set(range(affinity)))
+    if quota:
+        write(tmp_path / "cpu.max", quota)
+    assert ex.available_cpus(str(tmp_path)) == expected_cpus
+    assert ex.default_workers(str(tmp_path)) == expected_workers
+
+
+def square(value):
+    return value * value
+
+
+def fail():
+    raise RuntimeError("task failed")
+
+
+def exit_worker():
+    os._exit(1)  # pylint: disable=protected-access
+
+
+def test_serial_pool():
+    initialized = []
+    pool = ex.SerialPool(initializer=initialized.append, initargs=(1,))
+    assert initialized == [1]
+    results = []
+    errors = []
+    assert pool.apply_async(square, (3,), callback=results.append).get() == 9
+    pool.apply_async(fail, error_callback=errors.append)
+    assert results == [9]
+    assert isinstance(errors[0], RuntimeError)
+    assert pool.map(square, [1, 2]) == [1, 4]
+
+
+@pytest.mark.parametrize("executor", ex.EXECUTORS)
+def test_worker_pool_runs_task_graph(executor, tmp_path):
+    graph = tg.TaskGraph()
+    graph.add_value('base', 3)
+    graph.add('square', square, tg.Dep('base'))
+    graph.add('chart', square, tg.Dep('square'), kind='chart')
+    with ex.WorkerPool(executor, workers=2) as pool:
+        spill_dir = None if pool.in_process else str(tmp_path)
+        results = graph.run(pool, workers=pool.workers, spill_dir=spill_dir)
+        assert pool.map(square, [2, 3]) == [4, 9]
+    assert results['chart'] == 81
+    assert pool.workers == (1 if executor == 'serial' else 2)
+
+
+def test_worker_pool_lost_workers():
+    # Closing the pool terminates it instead of waiting for the lost task.
+    with ex.WorkerPool('process', workers=2) as pool:
+        assert not pool.lost_workers()
+        pool.apply_async(exit_worker)
+        deadline = time.monotonic() + 10
+        while not pool.lost_workers() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert len(pool.lost_workers()) == 1
+        # The dead worker is replaced.
+        assert pool.map(square, [2, 3]) == [4, 9]
+
+
+def test_unknown_executor():
+    with pytest.raises(ValueError):
+        ex.WorkerPool('cluster')
@@ -0,0 +1,101 @@
+"""Unit tests for the exports module."""
+# pylint: disable=missing-function-docstring
+
+import gzip
+import io
+import json
+import sys
+import subprocess
+
+import pandas as pd
+import pytest
+
+import covid19trackerph.exports as ex
+import covid19trackerph.trackerchart as tc
+from covid19trackerph.benchmarks import synthetic
+
+
+def read_csv_part(path):
+    with gzip.open(path, 'rt') as file_handle:
+        return pd.read_csv(io.StringIO(file_handle.read()))
+
+
+@pytest.fixture(name="output")
+def fixture_output(tmp_path, monkeypatch):
+    monkeypatch.setattr(ex, 'EXPORT_OUTPUT', str(tmp_path / "exports"))
+    return tmp_path / "exports"
+
+
+def test_does_not_import_trackerchart():
+    code = ("import sys; import covid19trackerph.exports; "
+            "print('covid19trackerph.trackerchart' in sys.modules)")
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    assert output.strip() == "False"
+
+
+def test_weekly_counts():
+    data = pd.DataFrame({
+        'Region': ['A', 'A', 'B', 'A'],
+        'DateOnset': pd.to_datetime(['2020-03-02', '2020-03-03',
+                                     '2020-03-10', '2020-03-17']),
+    })
+    counts = ex.weekly_counts(data, 'Region', 'DateOnset', tc.WEEKLY_FREQ)
+    region_a = counts[counts['value'] == 'A']
+    assert list(region_a['week'].dt.strftime('%m-%d')) == [
+        '03-08', '03-15', '03-22']
+    assert list(region_a['count']) == [2, 0, 1]
+    assert list(region_a['cumulative']) == [2, 2, 3]
+    assert list(counts[counts['value'] == 'B']['count']) == [0, 1, 0]
+
+
+def test_write_table(output):
+    frame = pd.DataFrame({'REGION': ['NCR', 'NCR', 'Region IV-A'],
+                          'report_date': pd.to_datetime(
+                              ['2020-05-01', '2020-05-02', '2020-05-01']),
+                          'tests': [1, 2, 3]})
+    entry = ex.write_table('testing', frame, ['REGION'])
+    assert entry['rows'] == 3
+    assert {'name': 'report_date', 'type': 'date'} in entry['columns']
+    paths = {file['path'] for file in entry['files']
+             if file['format'] == 'csv.gz'}
+    assert paths == {'testing/REGION=NCR/data.csv.gz',
+                     'testing/REGION=Region%20IV-A/data.csv.gz'}
+    part = read_csv_part(output / "testing" / "REGION=NCR" / "data.csv.gz")
+    assert list(part.columns) == ['report_date', 'tests']
+    assert list(part['tests']) == [1, 2]
+
+    # The partitions that are gone are removed.
+    ex.write_table('testing', frame.iloc[:2], ['REGION'])
+    assert not (output / "testing" / "REGION=Region%20IV-A").exists()
+    assert (output / "testing" / "REGION=NCR" / "data.csv.gz").exists()
+
+
+@pytest.mark.skipif(ex.pyarrow is None, reason="pyarrow is not installed")
+def test_write_table_parquet(output):
+    frame = pd.DataFrame({'series': ['a', 'b'], 'count': [1, 2]})
+    ex.write_table('counts', frame, ['series'])
+    part = pd.read_parquet(output / "counts" / "series=a" / "data.parquet")
+    assert list(part['count']) == [1]
+
+
+def test_plot_export(tmp_path, output, monkeypatch):
+    monkeypatch.setattr(tc, 'CHART_OUTPUT', str(tmp_path / "charts"))
+    monkeypatch.setattr(tc, 'TABLE_OUTPUT', str(tmp_path / "tables"))
+    synthetic.write_data_drop(tmp_path / "data", 500, seed=8, days=60)
+    with tc.create_pool('serial', formats=['json']) as pool:
+        charts = tc.plot(str(tmp_path), "data", formats=['json'],
+                         only=['summary'], pool=pool, export=True)
+    assert charts == ['summary']
+    manifest = json.loads((output / ex.MANIFEST).read_text())
+    assert set(manifest['tables']) == set(ex.TABLES)
+    counts = manifest['tables']['case_counts']
+    assert counts['partition_by'] == ['series', 'dimension']
+    part = read_csv_part(
+        output / "case_counts" / "series=confirmed" / "dimension=Region" /
+        "data.csv.gz")
+    assert part.groupby('value')['count'].sum().sum() == 500
+    summary = read_csv_part(output / "summary" / "data.csv.gz")
+    assert summary['total_confirmed'][0] == 500
+    assert manifest['tables']['active_cases']['rows'] > 0
+    assert manifest['tables']['testing']['rows'] > 0
@@ -0,0 +1,33 @@
+"""Unit tests for the import time benchmark and the lazy imports."""
+# pylint: disable=missing-function-docstring
+
+import sys
+import subprocess
+
+from covid19trackerph.benchmarks import importtime
+
+
+OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |   _io
+import time:      2000 |       2100 | io
+import time:       500 |        500 |     numpy.core
+import time:      1000 |       1500 |   numpy
+import time:      3000 |       4500 | pandas
+"""
+
+
+def test_parse_importtime():
+    total, top_level = importtime.parse_importtime(OUTPUT)
+    assert total == 0.0066
+    assert top_level == {'io': 0.0021, 'pandas': 0.0045}
+
+
+def test_cli_does_not_import_the_heavy_dependencies():
+    code = ("import sys; import covid19trackerph.updatetracker; "
+            "print(sorted({'pandas', 'plotly.express', 'scipy', "
+            "'googleapiclient.discovery', 'google_auth_oauthlib', 'PyPDF2', "
+            "'requests'} & set(sys.modules)))")
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    assert output.strip() == "[]"
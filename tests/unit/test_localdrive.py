@@ -0,0 +1,68 @@
+"""Unit tests for the localdrive module."""
+# pylint: disable=missing-function-docstring
+
+import hashlib
+
+import pytest
+
+import covid19trackerph.datadrop as dd
+from covid19trackerph.localdrive import LocalDrive
+
+
+PREFIX = "DOH COVID Data Drop_ 20211010 - "
+
+
+@pytest.fixture(name="fixture_dir")
+def fixture_fixture_dir(tmp_path):
+    fixture_dir = tmp_path / "fixtures"
+    fixture_dir.mkdir()
+    for index in range(5):
+        (fixture_dir / f"{PREFIX}04 Case Information_batch_{index}.csv") \
+            .write_bytes(bytes([index]) * (index * 100))
+    return fixture_dir
+
+
+def test_from_directory(fixture_dir):
+    drive = LocalDrive.from_directory(str(fixture_dir), folder_id="folder")
+    item = drive.items[2]
+    assert item['name'] == f"{PREFIX}04 Case Information_batch_2.csv"
+    assert item['size'] == "200"
+    assert item['md5Checksum'] == hashlib.md5(bytes([2]) * 200).hexdigest()
+    assert drive.read(item['id'], 10, 19) == bytes([2]) * 10
+
+
+def test_folder_filter(fixture_dir):
+    drive = LocalDrive.from_directory(str(fixture_dir), folder_id="folder")
+    assert len(list(dd.list_data_files(drive, "folder"))) == 5
+    with pytest.raises(dd.RemoteFileNotFoundError):
+        list(dd.list_data_files(drive, "other"))
+
+
+def test_download_from_directory(fixture_dir, tmp_path, mocker):
+    data_dir = tmp_path / "data"
+    mocker.patch.object(dd, 'DATA_DIR', str(data_dir))
+    drive = LocalDrive.from_directory(str(fixture_dir), folder_id="folder",
+                                      page_size=2)
+    downloaded = dd.download(folder_id="folder", workers=2, chunksize=64,
+                             service_factory=lambda: drive)
+    assert len(downloaded) == 5
+    assert (data_dir / "04 Case Information_batch_4.csv").read_bytes() == \
+        bytes([4]) * 400
+
+
+def test_fail_rate(mocker, tmp_path):
+    mocker.patch.object(dd, 'DATA_DIR', str(tmp_path))
+    mocker.patch.object(dd.time, 'sleep')
+    drive = LocalDrive({"a.csv": b"a" * 100}, fail_rate=0.5, seed=1)
+    dd.download_data_files(drive, "folder", chunksize=10)
+    assert (tmp_path / "a.csv").read_bytes() == b"a" * 100
+    # Some of the chunks were requested again after a failure.
+    assert len(drive.media_requests) > 10
+
+
+def test_latency_and_bandwidth(mocker):
+    wait = mocker.patch.object(LocalDrive, 'wait')
+    drive = LocalDrive({"a.csv": b"a" * 100}, latency=0.1, bandwidth=1000)
+    request = drive.files().get_media(fileId="id0")
+    request.http.request(request.uri, headers={'range': "bytes=0-49"})
+    assert [call.args[0] for call in wait.call_args_list] == [0.1, 0.05]
@@ -0,0 +1,115 @@
+"""Unit tests for the memory module."""
+# pylint: disable=missing-function-docstring
+
+import os
+import logging
+from multiprocessing.pool import ThreadPool
+
+import pandas as pd
+import pytest
+
+import covid19trackerph.memory as mem
+import covid19trackerph.taskgraph as tg
+import covid19trackerph.trackerchart as tc
+
+
+def add_one(df):
+    return df + 1
+
+
+def double(value):
+    return value * 2
+
+
+@pytest.fixture(name="report")
+def fixture_report():
+    report = mem.start()
+    yield report
+    mem.stop()
+
+
+def test_rss(tmp_path, monkeypatch):
+    (tmp_path / "self").mkdir()
+    (tmp_path / "self" / "statm").write_text("100 25 5 1 0 20 0\n")
+    monkeypatch.setattr(mem, 'PROC_DIR', str(tmp_path))
+    assert mem.rss() == 25 * os.sysconf('SC_PAGE_SIZE')
+    assert mem.rss(12345) is None
+    assert mem.child_pids() == []
+
+
+def test_peak_rss():
+    peak = mem.peak_rss()
+    assert peak is None or peak > 1e6
+
+
+def test_frame_bytes():
+    df = pd.DataFrame({'name': ['a' * 100] * 10, 'value': range(10)})
+    assert mem.frame_bytes(df) > 1000
+    assert mem.frame_bytes(df) > df.memory_usage().sum()
+
+
+def test_measured():
+    assert mem.measured(double, 2)[:2] == (4, os.getpid())
+
+
+def test_recording_is_noop_when_disabled():
+    assert not mem.is_enabled()
+    with mem.stage('ignored'):
+        mem.record_frame('frame', pd.DataFrame({'value': [1]}))
+        mem.record_worker(1, 100)
+        mem.record_task_args('task', [1])
+    assert mem.current() is None
+
+
+def test_stage(report):
+    df = pd.DataFrame({'value': range(100)})
+    with mem.stage('prepare'):
+        mem.record_frame('prepared', df)
+    mem.record_worker(1, 100)
+    mem.record_worker(1, 50)
+    mem.record_task_args('task', b"x" * 1000)
+    summary = report.summary()
+    assert set(summary['stages']) == {'prepare'}
+    assert summary['frames'] == [{'stage': 'prepare', 'label': 'prepared',
+                                  'rows': 100, 'bytes': mem.frame_bytes(df)}]
+    assert summary['workers'] == {1: 100}
+    assert summary['task_args']['task'] > 1000
+
+
+def test_stage_with_tracemalloc(caplog):
+    mem.start(tracemalloc_top=3)
+    try:
+        with mem.stage('allocate'):
+            data = [bytes(1000) for _ in range(1000)]
+        stage = mem.current().stages['allocate']
+        assert stage['traced_peak'] >= 1e6
+        assert 0 < len(stage['allocations']) <= 3
+        assert len(data) == 1000
+        with caplog.at_level(logging.INFO):
+            mem.log_report()
+        assert "top allocations" in caplog.text
+        # The next run starts with an empty report.
+        assert not mem.current().stages
+    finally:
+        mem.stop()
+
+
+def test_taskgraph_records_workers_and_args(report, tmp_path):
+    graph = tg.TaskGraph()
+    graph.add_value('base', 1)
+    graph.add('double', double, tg.Dep('base'))
+    with ThreadPool(2) as pool:
+        graph.run(pool, workers=2, spill_dir=str(tmp_path))
+    assert graph.timings['double']['peak_rss'] > 0
+    assert os.getpid() in report.workers
+    assert set(report.task_args) == {'double'}
+
+
+def test_apply_parallel_records_workers(report):
+    df = pd.DataFrame({'value': range(10)})
+    with tc.create_pool('serial') as pool:
+        result = tc.apply_parallel(df, add_one, pool)
+    pd.testing.assert_frame_equal(result, df + 1)
+    assert list(report.workers) == [os.getpid()]
+    # The in-process pools do not pickle the chunks.
+    assert not report.task_args
@@ -0,0 +1,93 @@
+"""Unit tests for the outputsink module."""
+# pylint: disable=missing-function-docstring
+
+import os
+import threading
+
+import pytest
+
+import covid19trackerph.outputsink as osink
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "table.html"
+    written = osink.atomic_write(str(path), "<table></table>")
+    assert written == len("<table></table>")
+    assert path.read_text(encoding='utf-8') == "<table></table>"
+    # No temporary files are left behind.
+    assert os.listdir(tmp_path) == ["table.html"]
+
+
+def test_atomic_write_mode(tmp_path):
+    path = tmp_path / "chart.html"
+    osink.atomic_write(str(path), "<div></div>")
+    plain = tmp_path / "plain.html"
+    with open(plain, 'w', encoding='utf-8') as file_handle:
+        file_handle.write("<div></div>")
+    assert path.stat().st_mode == plain.stat().st_mode
+
+
+def test_atomic_write_failure_keeps_original(tmp_path, mocker):
+    path = tmp_path / "table.html"
+    path.write_text("original", encoding='utf-8')
+    mocker.patch('os.replace', side_effect=OSError("interrupted"))
+    with pytest.raises(OSError):
+        osink.atomic_write(str(path), "new")
+    assert path.read_text(encoding='utf-8') == "original"
+    assert os.listdir(tmp_path) == ["table.html"]
+
+
+def test_sink_writes_and_reports_metrics(tmp_path):
+    sink = osink.OutputSink()
+    sink.submit_table("<table></table>", str(tmp_path), "summary")
+    sink.submit(str(tmp_path / "data.txt"), lambda: b"12345")
+    sink.close()
+    assert (tmp_path / "summary.html").read_text(
+        encoding='utf-8') == "<table></table>"
+    assert (tmp_path / "data.txt").read_bytes() == b"12345"
+    metrics = sink.metrics()
+    assert metrics['queue_depth'] == 0
+    assert metrics['files_written'] == 2
+    assert metrics['bytes_written'] == len("<table></table>") + 5
+    assert metrics['max_queue_depth'] >= 1
+
+
+def test_sink_flush_raises_writer_error(tmp_path):
+    def render():
+        raise ValueError("render failed")
+    sink = osink.OutputSink()
+    sink.submit(str(tmp_path / "broken.png"), render)
+    with pytest.raises(ValueError):
+        sink.flush()
+    sink.close()
+    assert not os.listdir(tmp_path)
+
+
+def test_sink_flush_only_raises_own_errors(tmp_path):
+    def render():
+        raise ValueError("render failed")
+    sink = osink.OutputSink()
+    thread = threading.Thread(
+        target=sink.submit, args=(str(tmp_path / "broken.png"), render))
+    thread.start()
+    thread.join()
+    sink.submit(str(tmp_path / "table.html"), lambda: "<table></table>")
+    # The error belongs to the task of the other thread.
+    sink.flush()
+    assert (tmp_path / "table.html").exists()
+    with pytest.raises(ValueError):
+        sink.close()
+
+
+def test_merge_metrics():
+    metrics = [
+        dict(max_queue_depth=3, files_written=2, bytes_written=100,
+             write_seconds=1.0),
+        dict(max_queue_depth=5, files_written=1, bytes_written=50,
+             write_seconds=0.5),
+    ]
+    merged = osink.merge_metrics(metrics)
+    assert merged['max_queue_depth'] == 5
+    assert merged['files_written'] == 3
+    assert merged['bytes_written'] == 150
+    assert merged['bytes_per_second'] == 100
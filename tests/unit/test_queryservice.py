@@ -0,0 +1,153 @@
+"""Unit tests for the queryservice module."""
+# pylint: disable=missing-function-docstring
+
+import json
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+
+import covid19trackerph.queryservice as qs
+import covid19trackerph.trackerchart as tc
+
+
+def case_data(health_status):
+    dates = pd.to_datetime(['2021-01-01', '2021-01-01', '2021-01-02',
+                            '2021-01-05', '2021-01-11', None])
+    return pd.DataFrame({
+        'CaseCode': [f"C{index}" for index in range(len(dates))],
+        'DateRepConf': dates,
+        'DateOnset': dates,
+        tc.REGION: ['NCR', 'NCR', 'CAR', 'NCR', 'CAR', 'NCR'],
+        tc.CITY_MUN: ['A', 'B', 'C', 'A', 'C', 'A'],
+        'HealthStatus': health_status,
+        tc.CASE_STATUS: ['CLOSED' if status in ('RECOVERED', 'DIED')
+                         else 'ACTIVE' for status in health_status],
+    })
+
+
+def frames(health_status=('MILD',) * 6):
+    return {'ci_data': case_data(list(health_status)), 'test_data': None}
+
+
+@pytest.fixture(name="service")
+def fixture_service():
+    return qs.QueryService(frames(['MILD', 'DIED', 'MILD', 'RECOVERED',
+                                   'MILD', 'MILD']))
+
+
+def query(service, url):
+    status, body = service.handle(url)
+    return status, json.loads(body)
+
+
+def test_counts(service):
+    status, result = query(service, "/counts?start=2021-01-02")
+    assert status == 200
+    counts = [(row['date'], row['count'], row['cumulative'])
+              for row in result['counts']]
+    assert counts[0] == ('2021-01-02', 1, 1)
+    assert counts[3] == ('2021-01-05', 1, 2)
+    assert counts[-1] == ('2021-01-11', 1, 3)
+
+
+def test_counts_weekly_by_region(service):
+    _, result = query(service, "/counts?freq=weekly&by=Region&status=ACTIVE")
+    assert [(row['Region'], row['date'], row['count'], row['cumulative'])
+            for row in result['counts']] == [
+                ('CAR', '2021-01-03', 1, 1), ('CAR', '2021-01-10', 0, 1),
+                ('CAR', '2021-01-17', 1, 2), ('NCR', '2021-01-03', 1, 1),
+                ('NCR', '2021-01-10', 0, 1), ('NCR', '2021-01-17', 0, 1)]
+
+
+def test_counts_filters(service):
+    _, result = query(service, "/counts?region=NCR&city=A&days=7")
+    assert [row['date'] for row in result['counts']] == ['2021-01-05']
+    _, result = query(service, "/counts?health=DIED&health=RECOVERED")
+    assert sum(row['count'] for row in result['counts']) == 2
+
+
+def test_top(service):
+    _, result = query(service, "/top?area=CityMunRes&n=2")
+    assert result['top'] == [{'CityMunRes': 'A', 'count': 3},
+                             {'CityMunRes': 'C', 'count': 2}]
+    _, result = query(service, "/top?end=2021-01-01")
+    assert result['top'] == [{'Region': 'NCR', 'count': 2}]
+
+
+@pytest.mark.parametrize("url, status", [
+    ("/counts?date=CaseCode", 400), ("/counts?freq=hourly", 400),
+    ("/counts?by=CaseCode", 400), ("/top?n=ten", 400),
+    ("/counts?start=someday", 400), ("/counts?days=3&start=2021-01-01", 400),
+    ("/unknown", 404)])
+def test_invalid_queries(service, url, status):
+    result_status, result = query(service, url)
+    assert result_status == status
+    assert result['error']
+
+
+def test_not_loaded():
+    status, body = qs.QueryService().handle("/counts")
+    assert status == 503
+    assert json.loads(body)['error']
+
+
+def test_unexpected_error(service, monkeypatch):
+    def fail(query):
+        raise KeyError(query)
+    monkeypatch.setitem(service.endpoints, '/counts', fail)
+    status, body = service.handle("/counts")
+    assert status == 500
+    assert json.loads(body) == {'error': "Internal error"}
+    # The failure is not cached.
+    monkeypatch.undo()
+    assert service.handle("/counts")[0] == 200
+
+
+def test_cache_is_invalidated_on_refresh(service):
+    assert query(service, "/top")[1]['top'][0]['count'] == 4
+    query(service, "/top")
+    assert service.cache.stats()['hits'] == 1
+    service.set_data(frames(['MILD'] * 6))
+    _, result = query(service, "/top?status=ACTIVE")
+    assert result['top'][0]['count'] == 4
+    stats = service.metrics()
+    assert stats['version'] == 2
+    assert stats['cache']['size'] == 1
+    assert stats['endpoints']['/top']['requests'] == 3
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = qs.ResponseCache(maxsize=2)
+    cache.put('a', b'1')
+    cache.put('b', b'2')
+    assert cache.get('a') == b'1'
+    cache.put('c', b'3')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1'
+    assert cache.stats()['hit_rate'] == pytest.approx(2 / 3)
+
+
+def test_jsonable():
+    assert qs.jsonable({'a': [pd.Timestamp('2021-01-02'), float('nan'),
+                              pd.NaT], 1: pd.Series([1]).sum()}) == {
+        'a': ['2021-01-02', None, None], '1': 1}
+
+
+def test_server_on_localhost(service):
+    server = qs.start_server(service, port=0)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(f"{url}/top?n=1") as response:
+            assert response.headers['Content-Type'] == "application/json"
+            assert json.load(response) == {
+                'area': 'Region', 'top': [{'Region': 'NCR', 'count': 4}]}
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/top?n=0")  # pylint: disable=consider-using-with
+        assert error.value.code == 400
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert json.load(response)['endpoints']['/top']['requests'] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
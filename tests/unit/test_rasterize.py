@@ -0,0 +1,59 @@
+"""Unit tests for the rasterize module."""
+# pylint: disable=missing-function-docstring
+
+import os
+import json
+
+import covid19trackerph.rasterize as rz
+
+
+def test_list_pending(tmp_path):
+    (tmp_path / "Active.json").write_text("{}", encoding='utf-8')
+    (tmp_path / "Recovery.json").write_text("{}", encoding='utf-8')
+    (tmp_path / "Recovery.png").write_bytes(b"png")
+    (tmp_path / "Death.html").write_text("", encoding='utf-8')
+    # Make the existing PNG newer than its JSON file.
+    os.utime(tmp_path / "Recovery.json", (0, 0))
+
+    pending = rz.list_pending(str(tmp_path))
+    assert [os.path.basename(image) for _, image in pending] == ["Active.png"]
+
+    pending = rz.list_pending(str(tmp_path), force=True)
+    assert len(pending) == 2
+
+    pending = rz.list_pending(str(tmp_path), image_format='svg')
+    assert len(pending) == 2
+
+
+def test_list_pending_stale_image(tmp_path):
+    (tmp_path / "Active.json").write_text("{}", encoding='utf-8')
+    (tmp_path / "Active.png").write_bytes(b"png")
+    os.utime(tmp_path / "Active.png", (0, 0))
+    assert len(rz.list_pending(str(tmp_path))) == 1
+
+
+def test_render_file(tmp_path, mocker):
+    fig_dict = {'data': [], 'layout': {'title': {'text': 'Active'}}}
+    json_path = tmp_path / "Active.json"
+    json_path.write_text(json.dumps(fig_dict), encoding='utf-8')
+    render = mocker.patch.object(rz.outputsink, 'render_chart',
+                                 return_value=b"png data")
+
+    written = rz.render_file((str(json_path), str(tmp_path / "Active.png")))
+
+    assert written == len(b"png data")
+    assert render.call_args[0][0] == fig_dict
+    assert render.call_args[0][1] == 'png'
+    assert (tmp_path / "Active.png").read_bytes() == b"png data"
+
+
+def test_rasterize_default_processes(tmp_path, mocker):
+    (tmp_path / "Active.json").write_text("{}", encoding='utf-8')
+    (tmp_path / "Recovery.json").write_text("{}", encoding='utf-8')
+    (tmp_path / "Death.json").write_text("{}", encoding='utf-8')
+    mocker.patch.object(rz.execution, 'default_workers', return_value=2)
+    pool = mocker.patch.object(rz.mp, 'Pool')
+    pool.return_value.__enter__.return_value.imap_unordered.return_value = [
+        1, 2, 3]
+    assert rz.rasterize(str(tmp_path)) == 3
+    pool.assert_called_once_with(2)
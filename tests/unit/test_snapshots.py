@@ -0,0 +1,129 @@
+"""Unit tests for the snapshots module."""
+# pylint: disable=missing-function-docstring
+
+import json
+
+import pandas as pd
+import pytest
+
+import covid19trackerph.snapshots as ss
+from covid19trackerph.benchmarks import synthetic
+
+
+FORMATS = ['pickle', pytest.param('parquet', marks=pytest.mark.skipif(
+    ss.pyarrow is None, reason="pyarrow is not installed"))]
+
+
+@pytest.fixture(name="drops")
+def fixture_drops():
+    """Three revisions of a drop, indexed by CaseCode."""
+    first = synthetic.case_information(300, seed=6, days=30).astype(str)
+    first = first.set_index(ss.KEY)
+    second = first.drop(first.index[:5])
+    second.loc[second.index[:10], 'HealthStatus'] = 'REVISED'
+    new = first.iloc[:3].copy()
+    new.index = ['N1', 'N2', 'N3']
+    second = pd.concat([second, new])
+    third = second.copy()
+    third['NewColumn'] = 'x'
+    third = third.drop(columns=['Pregnanttab'])
+    return [first, second, third]
+
+
+def assert_same(restored, expected):
+    pd.testing.assert_frame_equal(restored.sort_index(),
+                                  expected.sort_index(), check_names=False)
+
+
+def test_diff(drops):
+    first, second, _ = drops
+    upserts, removed, inserted = ss.diff(first, second)
+    assert inserted == 3
+    assert len(upserts) == 13
+    assert list(removed) == sorted(first.index[:5])
+    assert_same(ss.apply_delta(first, upserts, removed), second)
+
+
+@pytest.mark.parametrize("file_format", FORMATS)
+def test_store(drops, tmp_path, file_format):
+    store = ss.SnapshotStore(tmp_path, file_format)
+    for day, drop in enumerate(drops):
+        store.add(drop, f"2020-08-0{day + 1}", source_bytes=100000)
+    assert [snapshot['kind'] for snapshot in store.snapshots] == [
+        'base', 'delta', 'delta']
+    assert store.snapshots[1]['changed'] == 10
+    assert store.snapshots[1]['removed'] == 5
+
+    # A store is reopened from its index.
+    store = ss.SnapshotStore(tmp_path)
+    for day, drop in enumerate(drops):
+        assert_same(store.restore(f"2020-08-0{day + 1}"), drop)
+    columns = store.restore("2020-08-03", columns=['HealthStatus',
+                                                  'NewColumn'])
+    assert_same(columns, drops[2][['HealthStatus', 'NewColumn']])
+    assert store.stats()['ratio'] > 1
+    with pytest.raises(KeyError):
+        store.restore("2020-09-01")
+
+
+def test_store_base_interval(drops, tmp_path, monkeypatch):
+    monkeypatch.setattr(ss, 'BASE_INTERVAL', 2)
+    store = ss.SnapshotStore(tmp_path, 'pickle')
+    for day, drop in enumerate(drops):
+        store.add(drop, f"2020-08-0{day + 1}")
+    assert [snapshot['kind'] for snapshot in store.snapshots] == [
+        'base', 'delta', 'base']
+    assert_same(store.restore("2020-08-02"), drops[1])
+
+
+def test_store_order(drops, tmp_path):
+    store = ss.SnapshotStore(tmp_path, 'pickle')
+    store.add(drops[0], "2020-08-02")
+    with pytest.raises(ValueError, match="older"):
+        store.add(drops[1], "2020-08-01")
+    # The drop of the same date replaces the latest one.
+    store.add(drops[1], "2020-08-02")
+    assert store.dates() == ["2020-08-02"]
+    assert_same(store.restore("2020-08-02"), drops[1])
+    with pytest.raises(ValueError, match="format"):
+        ss.SnapshotStore(tmp_path, 'parquet')
+
+
+def test_store_replace_keeps_files_until_indexed(drops, tmp_path,
+                                                 monkeypatch):
+    store = ss.SnapshotStore(tmp_path, 'pickle')
+    store.add(drops[0], "2020-08-01")
+    store.add(drops[1], "2020-08-02")
+    monkeypatch.setattr(ss, 'BASE_INTERVAL', 1)
+    monkeypatch.setattr(store, '_save_index', lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        store.add(drops[2], "2020-08-02")
+    assert_same(ss.SnapshotStore(tmp_path).restore("2020-08-02"), drops[1])
+
+    monkeypatch.undo()
+    store = ss.SnapshotStore(tmp_path)
+    monkeypatch.setattr(ss, 'BASE_INTERVAL', 1)
+    store.add(drops[2], "2020-08-02")
+    assert store.snapshots[-1]['kind'] == 'base'
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "2020-08-01.base.pkl.gz", "2020-08-02.base.pkl.gz", ss.INDEX]
+    assert_same(ss.SnapshotStore(tmp_path).restore("2020-08-02"), drops[2])
+
+
+def test_pickle_fallback_is_logged(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(ss, 'pyarrow', None)
+    store = ss.SnapshotStore(tmp_path)
+    assert store.format == 'pickle'
+    assert "pyarrow is not installed" in caplog.text
+
+
+def test_add_drop(tmp_path):
+    case_path, _ = synthetic.write_data_drop(tmp_path / "data", 200, seed=2,
+                                             days=20)
+    store = ss.SnapshotStore(tmp_path / "store", 'pickle')
+    snapshot = store.add_drop(tmp_path / "data")
+    published = pd.read_csv(case_path, dtype=str).set_index(ss.KEY)
+    assert snapshot['date'] == published['DateRepConf'].max()
+    assert_same(store.restore(snapshot['date']), published)
+    index = json.loads((tmp_path / "store" / ss.INDEX).read_text())
+    assert index['snapshots'][0]['rows'] == 200
@@ -0,0 +1,118 @@
+"""Unit tests for the synthetic data drop generator and the pipeline
+benchmark."""
+# pylint: disable=missing-function-docstring
+
+import argparse
+import os
+import logging
+
+import pandas as pd
+import pytest
+
+import covid19trackerph.trackerchart as tc
+from covid19trackerph.benchmarks import pipeline
+from covid19trackerph.benchmarks import synthetic
+
+
+def test_case_information_is_seeded():
+    first = synthetic.case_information(500, seed=3)
+    pd.testing.assert_frame_equal(first, synthetic.case_information(500,
+                                                                    seed=3))
+    assert not first.equals(synthetic.case_information(500, seed=4))
+
+
+def test_case_information_schema():
+    data = synthetic.case_information(20000, seed=1, days=100)
+    assert list(data.columns) == synthetic.CASE_COLUMNS
+    assert data['CaseCode'].is_unique
+    assert data['CaseCode'].str.match(r"C\d{7}$").all()
+    assert set(data['AgeGroup']) <= set(tc.AGE_GROUP_CATEGORY_ARRAY)
+    assert data['RegionRes'].isna().mean() == pytest.approx(
+        synthetic.NULL_RATES['RegionRes'], abs=0.02)
+    assert data['DateOnset'].isna().mean() == pytest.approx(
+        synthetic.NULL_RATES['DateOnset'], abs=0.02)
+    dates = pd.to_datetime(data['DateRepConf'])
+    assert dates.max() == pd.Timestamp(synthetic.DEFAULT_START) + pd.Timedelta(
+        days=99)
+    # A few of the municipalities have most of the cases.
+    counts = data['CityMunRes'].value_counts()
+    assert counts.iloc[:len(counts) // 10].sum() > counts.sum() / 3
+    closed = data['HealthStatus'].isin(['RECOVERED', 'DIED'])
+    assert (data.loc[closed, 'RemovalType'] == data.loc[closed,
+                                                        'HealthStatus']).all()
+
+
+def test_testing_aggregates():
+    data = synthetic.testing_aggregates(seed=1, days=60, facilities=3)
+    assert list(data.columns) == synthetic.TEST_COLUMNS
+    assert data['facility_name'].nunique() == 3
+    by_facility = data.groupby('facility_name')['cumulative_samples_tested']
+    assert by_facility.apply(lambda values: values.is_monotonic_increasing
+                             ).all()
+
+
+def test_write_data_drop_is_prepared(tmp_path):
+    case_path, test_path = synthetic.write_data_drop(
+        tmp_path, 2500, seed=2, days=90, chunk_rows=1000)
+    cases = pd.read_csv(case_path)
+    assert len(cases) == 2500
+    assert cases['CaseCode'].is_unique
+    prepared = tc.calc_case_info_data(cases)
+    assert set(prepared[tc.CASE_STATUS]) == {'ACTIVE', 'CLOSED'}
+    tests = tc.calc_testing_aggregates_data(pd.read_csv(test_path))
+    assert len(tests) > 0
+
+
+@pytest.mark.parametrize("value, expected", [("10k", 10_000),
+                                             ("2.5M", 2_500_000),
+                                             ("1234", 1234)])
+def test_parse_rows(value, expected):
+    assert synthetic.parse_rows(value) == expected
+
+
+@pytest.mark.parametrize("value", ["ten", "0", "-5k"])
+def test_parse_rows_invalid(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        synthetic.parse_rows(value)
+
+
+def test_time_stage_with_profile():
+    result, timing = pipeline.time_stage(lambda: sum(range(1000)),
+                                         profile=True)
+    assert result == 499500
+    assert timing['seconds'] >= 0
+    assert timing['profile']
+    assert {'function', 'calls', 'tottime', 'cumtime'} == set(
+        timing['profile'][0])
+
+
+def test_data_drop_is_cached(tmp_path, mocker):
+    write = mocker.spy(synthetic, 'write_data_drop')
+    first = pipeline.data_drop(str(tmp_path), 100, 0, 30)
+    assert pipeline.data_drop(str(tmp_path), 100, 0, 30) == first
+    assert write.call_count == 1
+
+
+def test_compare(caplog):
+    previous = {'sizes': {'100': {'stages': {'read': {'seconds': 2.0}}}}}
+    results = {'sizes': {'100': {'stages': {'read': {'seconds': 1.0},
+                                            'plot': {'seconds': 1.0}}}}}
+    with caplog.at_level(logging.INFO):
+        pipeline.compare(previous, results)
+    assert "read: 2.000s -> 1.000s (2.00x)" in caplog.text
+    assert "plot" not in caplog.text
+
+
+def test_run_writes_to_temporary_directories(tmp_path):
+    chart_output = tc.CHART_OUTPUT
+    existed = os.path.exists(chart_output)
+    args = argparse.Namespace(
+        sizes=[2000], stages=['prepare_data', 'plot'], data_dir=str(tmp_path),
+        seed=1, days=120, executor='process', workers=1,
+        start_method='spawn', profile=False)
+    results = pipeline.run(args)
+    result = results['sizes']['2000']
+    assert set(result['stages']) == {'prepare_data', 'plot'}
+    assert result['charts']
+    assert tc.CHART_OUTPUT == chart_output
+    assert os.path.exists(chart_output) == existed
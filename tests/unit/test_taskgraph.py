@@ -0,0 +1,179 @@
+"""Unit tests for the taskgraph module."""
+# pylint: disable=missing-function-docstring
+
+import time
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+import covid19trackerph.taskgraph as tg
+
+
+def add(x, y):
+    return x + y
+
+
+def fail():
+    raise RuntimeError("task failed")
+
+
+def record(calls, name):
+    calls.append(name)
+    return name
+
+
+def test_run_with_dependencies(tmp_path):
+    graph = tg.TaskGraph()
+    graph.add_value('base', 1)
+    graph.add('plus2', add, tg.Dep('base'), 2)
+    graph.add('plus3', add, tg.Dep('plus2'), y=tg.Dep('base'))
+    graph.add('chart', add, tg.Dep('plus3'), 10, kind='chart')
+    with ThreadPool(2) as pool:
+        results = graph.run(pool, workers=2, spill_dir=str(tmp_path))
+    assert results['chart'] == 14
+    assert graph.names(kind='chart') == ['chart']
+    assert set(graph.timings) == {'plus2', 'plus3', 'chart'}
+
+
+def test_run_without_spill_dir():
+    graph = tg.TaskGraph()
+    graph.add_value('base', [1, 2])
+    graph.add('sum', sum, tg.Dep('base'))
+    with ThreadPool(1) as pool:
+        results = graph.run(pool)
+    assert results['sum'] == 3
+
+
+def test_longest_first():
+    calls = []
+    graph = tg.TaskGraph()
+    graph.add('short', record, calls, 'short', cost=1)
+    graph.add('long', record, calls, 'long', cost=5)
+    graph.add('medium', record, calls, 'medium', cost=2)
+    # A cheap task with an expensive dependent goes first.
+    graph.add('prepare', record, calls, 'prepare', cost=1)
+    graph.add('render', record, calls, 'render', deps=['prepare'], cost=10)
+    with ThreadPool(1) as pool:
+        graph.run(pool, workers=1)
+    assert calls == ['prepare', 'render', 'long', 'medium', 'short']
+
+
+def test_deadline_skips_the_remaining_tasks():
+    calls = []
+    graph = tg.TaskGraph()
+    graph.add('first', time.sleep, 0.05, cost=2)
+    graph.add('second', record, calls, 'second', cost=1)
+    graph.add('third', record, calls, 'third', deps=['second'])
+    with ThreadPool(1) as pool:
+        results = graph.run(pool, workers=1, deadline=time.time() + 0.01)
+    assert set(results) == {'first'}
+    assert graph.skipped == ['second', 'third']
+    assert not calls
+
+
+def test_estimates_override_cost():
+    graph = tg.TaskGraph()
+    graph.add('a', add, 1, 1, cost=1)
+    graph.add('b', add, 1, 1, cost=2)
+    assert graph.ranks() == {'a': 1, 'b': 2}
+    assert graph.ranks({'a': 3}) == {'a': 3, 'b': 2}
+
+
+def test_unknown_dependency():
+    graph = tg.TaskGraph()
+    graph.add('a', add, tg.Dep('missing'), 1)
+    with ThreadPool(1) as pool:
+        with pytest.raises(ValueError):
+            graph.run(pool)
+
+
+def test_duplicate_name():
+    graph = tg.TaskGraph()
+    graph.add_value('a', 1)
+    with pytest.raises(ValueError):
+        graph.add('a', add, 1, 1)
+
+
+def test_task_error_is_raised():
+    graph = tg.TaskGraph()
+    graph.add('fail', fail)
+    with ThreadPool(1) as pool:
+        with pytest.raises(RuntimeError):
+            graph.run(pool)
+
+
+def test_critical_path():
+    graph = tg.TaskGraph()
+    graph.add('a', add, 1, 1)
+    graph.add('b', add, 1, 1, deps=['a'])
+    graph.add('c', add, 1, 1)
+    graph.timings = {'a': {'duration': 2}, 'b': {'duration': 3},
+                     'c': {'duration': 4}}
+    assert graph.critical_path() == (['a', 'b'], 5)
+
+
+def test_save_and_load_timings(tmp_path):
+    path = str(tmp_path / "timings.json")
+    assert not tg.load_timings(path)
+    graph = tg.TaskGraph()
+    graph.timings = {'a': {'duration': 2, 'start': 0, 'pid': 1}}
+    tg.save_timings(path, graph)
+    assert tg.load_timings(path) == {'a': 2}
+
+
+def test_select_includes_dependencies():
+    graph = tg.TaskGraph()
+    graph.add_value('ci_data', 1)
+    graph.add_value('test_data', 2)
+    graph.add('ci_data:active', add, tg.Dep('ci_data'), 1)
+    graph.add('ActivePie', add, tg.Dep('ci_data:active'), 1, kind='chart')
+    graph.add('TopActiveRegion', add, tg.Dep('ci_data:active'), 2,
+              kind='chart')
+    graph.add('daily_output_samples_tested', add, tg.Dep('test_data'), 1,
+              kind='chart')
+
+    selected = graph.select(only=['TopActive*'])
+    assert selected.names(kind='chart') == ['TopActiveRegion']
+    assert selected.names() == ['ci_data:active', 'TopActiveRegion']
+    assert list(selected.values) == ['ci_data']
+
+    selected = graph.select(exclude=['Active*', 'daily_*'])
+    assert selected.names(kind='chart') == ['TopActiveRegion']
+
+    selected = graph.select()
+    assert selected.names() == graph.names()
+
+    with pytest.raises(ValueError):
+        graph.select(only=['NoSuchChart'])
+
+
+def test_set_value():
+    graph = tg.TaskGraph()
+    graph.add_value('ci_data', None)
+    graph.set_value('ci_data', 1)
+    assert graph.values['ci_data'] == 1
+    with pytest.raises(KeyError):
+        graph.set_value('test_data', 1)
+
+
+def test_select_depends_on():
+    graph = tg.TaskGraph()
+    graph.add_value('ci_data', 1)
+    graph.add_value('test_data', 2)
+    graph.add('ci_data:active', add, tg.Dep('ci_data'), 1)
+    graph.add('ActivePie', add, tg.Dep('ci_data:active'), 1, kind='chart')
+    graph.add('summary', add, tg.Dep('ci_data'), tg.Dep('test_data'),
+              kind='chart')
+    graph.add('daily_output_samples_tested', add, tg.Dep('test_data'), 1,
+              kind='chart')
+
+    selected = graph.select(depends_on=['test_data'])
+    assert selected.names(kind='chart') == ['summary',
+                                            'daily_output_samples_tested']
+    assert set(selected.values) == {'ci_data', 'test_data'}
+
+    selected = graph.select(exclude=['summary'], depends_on=['ci_data'])
+    assert selected.names() == ['ci_data:active', 'ActivePie']
+
+    with pytest.raises(ValueError):
+        graph.select(only=['ActivePie'], depends_on=['test_data'])
@@ -0,0 +1,114 @@
+"""Unit tests for the tracing module."""
+# pylint: disable=missing-function-docstring
+
+import os
+import json
+
+import covid19trackerph.engines as eng
+import covid19trackerph.execution as ex
+import covid19trackerph.taskgraph as tg
+import covid19trackerph.trackerchart as tc
+import covid19trackerph.tracing as tr
+from covid19trackerph.benchmarks import synthetic
+
+
+def traced_task(value):
+    with tr.span('inner', value=value):
+        return value * 2
+
+
+@tr.traced()
+def decorated(value):
+    return value + 1
+
+
+def spans(events):
+    return [event for event in events if event['ph'] == 'X']
+
+
+def test_span_is_noop_when_disabled(tmp_path):
+    assert not tr.is_enabled()
+    with tr.span('ignored'):
+        pass
+    assert decorated(1) == 2
+    assert not list(tmp_path.iterdir())
+
+
+def test_tracing_writes_chrome_trace(tmp_path):
+    path = tmp_path / "trace.json"
+    with tr.tracing(str(path)):
+        assert tr.is_enabled()
+        with tr.span('outer', 'test', rows=3):
+            decorated(1)
+    assert not tr.is_enabled()
+    trace = json.loads(path.read_text())
+    events = spans(trace['traceEvents'])
+    assert [event['name'] for event in events] == ['decorated', 'outer']
+    decorated_span, outer = events
+    assert outer['args'] == {'rows': 3}
+    assert outer['cat'] == 'test'
+    assert outer['ts'] <= decorated_span['ts']
+    assert (decorated_span['ts'] + decorated_span['dur'] <=
+            outer['ts'] + outer['dur'])
+    metadata = {event['name']: event for event in trace['traceEvents']
+                if event['ph'] == 'M'}
+    assert metadata['process_name']['args'] == {'name': 'main'}
+    assert 'thread_name' in metadata
+
+
+def test_data_preparation_spans(tmp_path):
+    path = tmp_path / "trace.json"
+    with tr.tracing(str(path)):
+        tc.calc_case_info_data(synthetic.case_information(200, seed=1))
+        eng.calc_case_info_data_vectorized(
+            synthetic.case_information(200, seed=1))
+        tc.calc_testing_aggregates_data(synthetic.testing_aggregates(seed=1))
+    events = spans(json.loads(path.read_text())['traceEvents'])
+    names = [event['name'] for event in events]
+    for name in ['calc_case_info_data', 'calc_case_info_data_vectorized',
+                 'calc_testing_aggregates_data']:
+        assert names.count(name) == 1
+    assert names.count('clean_case_info_data') == 2
+    outer = events[names.index('calc_case_info_data')]
+    inner = events[names.index('reporting_delays')]
+    assert outer['ts'] <= inner['ts']
+    assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+
+def test_tracing_without_path():
+    with tr.tracing(None):
+        assert not tr.is_enabled()
+
+
+def test_worker_spans_are_merged(tmp_path):
+    path = tmp_path / "trace.json"
+    with tr.tracing(str(path)):
+        with ex.WorkerPool('process', 2, 'spawn', initializer=tr.start,
+                           initargs=(tr.trace_dir(),)) as pool:
+            results = [pool.apply_async(tg.execute, (traced_task, [value], {},
+                                                     None, f"task{value}"))
+                       for value in range(4)]
+            assert [result.get()[0] for result in results] == [0, 2, 4, 6]
+    events = spans(json.loads(path.read_text())['traceEvents'])
+    names = sorted(event['name'] for event in events)
+    assert names == ['inner'] * 4 + ['task0', 'task1', 'task2', 'task3']
+    pids = {event['pid'] for event in events}
+    assert os.getpid() not in pids
+    assert len(pids) >= 1
+
+
+def test_read_events_skips_partial_lines(tmp_path):
+    event = {'name': 'span', 'ph': 'X', 'ts': 0, 'dur': 5, 'pid': 1,
+             'tid': 1}
+    (tmp_path / f"1{tr.EVENTS_SUFFIX}").write_text(
+        json.dumps(event) + "\n" + '{"name": "cut')
+    (tmp_path / "other.txt").write_text("ignored")
+    assert tr.read_events(str(tmp_path)) == [event]
+
+
+def test_summarize():
+    events = [{'name': 'a', 'ph': 'X', 'dur': 1e6},
+              {'name': 'b', 'ph': 'X', 'dur': 3e6},
+              {'name': 'a', 'ph': 'X', 'dur': 1e6},
+              {'name': 'thread_name', 'ph': 'M'}]
+    assert tr.summarize(events) == [('b', 1, 3.0), ('a', 2, 2.0)]
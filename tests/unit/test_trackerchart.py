@@ -8,6 +8,7 @@ import pandas as pd
 import pytest
 
 import covid19trackerph.trackerchart as tc
+from covid19trackerph.benchmarks import synthetic
 
 
 def test_plot_for_period():
@@ -276,3 +277,56 @@ def test_create_dir(mocker, exists, rebuild, expect_mkdir, expect_rmtree):
         mock_shutil_rmtree.assert_called_with(path)
     else:
         mock_shutil_rmtree.assert_not_called()
+
+
+def test_set_output_formats():
+    original = list(tc.output_formats)
+    try:
+        tc.set_output_formats(['html', 'json'])
+        assert tc.output_formats == ['html', 'json']
+        with pytest.raises(ValueError):
+            tc.set_output_formats(['html', 'gif'])
+        assert tc.output_formats == ['html', 'json']
+    finally:
+        tc.set_output_formats(original)
+
+
+def test_build_chart_graph_selection():
+    charts = tc.list_charts()
+    assert 'summary' in charts
+    assert 'TopActiveCityMunRes' in charts
+    assert not [chart for chart in charts if ':' in chart]
+
+    graph = tc.build_chart_graph().select(only=['daily_output_*'])
+    assert list(graph.values) == ['test_data']
+
+    graph = tc.build_chart_graph().select(only=['DateRecover*'])
+    assert list(graph.values) == ['ci_data']
+    assert 'ci_data:filter_recovered' in graph.names()
+    assert 'ci_data:filter_died' not in graph.names()
+
+
+def add_one(df):
+    return df + 1
+
+
+@pytest.mark.parametrize("executor", ['serial', 'thread'])
+def test_apply_parallel(executor):
+    df = pd.DataFrame({'value': range(10)})
+    with tc.create_pool(executor, workers=3) as pool:
+        result = tc.apply_parallel(df, add_one, pool)
+    pd.testing.assert_frame_equal(result, df + 1)
+
+
+def test_plot_rebuild_keeps_unselected_charts(tmp_path, monkeypatch):
+    monkeypatch.setattr(tc, 'CHART_OUTPUT', str(tmp_path / "charts"))
+    monkeypatch.setattr(tc, 'TABLE_OUTPUT', str(tmp_path / "tables"))
+    (tmp_path / "charts").mkdir()
+    other = tmp_path / "charts" / "Active.json"
+    other.write_text("{}", encoding='utf-8')
+    synthetic.write_data_drop(tmp_path / "data", 300, seed=3, days=60)
+    with tc.create_pool('serial', formats=['json']) as pool:
+        tc.plot(str(tmp_path), "data", rebuild=True, formats=['json'],
+                only=['summary'], pool=pool)
+    assert other.exists()
+    assert (tmp_path / "tables" / "summary.html").exists()
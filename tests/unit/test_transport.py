@@ -0,0 +1,105 @@
+"""Unit tests for the transport module."""
+# pylint: disable=missing-function-docstring
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from google.oauth2.credentials import Credentials
+
+import covid19trackerph.transport as tp
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Fails the first requests of a path with a 503."""
+
+    failures = {}
+    authorizations = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        remaining = self.failures.get(self.path, 0)
+        if remaining:
+            self.failures[self.path] = remaining - 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        self.authorizations.append(self.headers.get('Authorization'))
+        self.send_response(302)
+        self.send_header('Location', "https://example.com/full")
+        self.end_headers()
+
+    def log_message(self, *_):
+        pass
+
+
+@pytest.fixture(name="server")
+def fixture_server(mocker):
+    mocker.patch.object(tp, 'BACKOFF_FACTOR', 0)
+    Handler.failures = {}
+    Handler.authorizations = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_session_http_response(server):
+    with tp.Transport() as http_transport:
+        resp, content = http_transport.http().request(f"{server}/file")
+    assert resp.status == 200
+    assert resp['content-type'] == "text/plain"
+    assert content == b"/file"
+    assert http_transport.stats.summary()['requests'] == 1
+
+
+def test_retries_are_counted(server):
+    Handler.failures = {"/flaky": 2}
+    with tp.Transport(retries=3) as http_transport:
+        resp, _ = http_transport.http().request(f"{server}/flaky")
+    assert resp.status == 200
+    summary = http_transport.stats.summary()
+    assert summary['retries'] == 2
+    assert summary['retried_requests'] == 1
+
+
+def test_retries_exhausted(server):
+    Handler.failures = {"/down": 5}
+    with tp.Transport(retries=1) as http_transport:
+        resp, _ = http_transport.http().request(f"{server}/down")
+    # The last response is returned for the caller to handle.
+    assert resp.status == 503
+
+
+def test_head(server):
+    with tp.Transport() as http_transport:
+        response = http_transport.head(f"{server}/short")
+    assert response.headers['location'] == "https://example.com/full"
+
+
+def test_head_without_credentials(server):
+    credentials = Credentials(token="secret")
+    with tp.Transport(credentials) as http_transport:
+        http_transport.head(f"{server}/short")
+    assert Handler.authorizations == [None]
+
+
+def test_stats_summary():
+    stats = tp.RequestStats()
+    assert stats.summary()['requests'] == 0
+    for latency in range(1, 21):
+        stats.record(latency / 10, 0)
+    summary = stats.summary()
+    assert summary['max_latency'] == 2.0
+    assert summary['p95_latency'] == 2.0
+    assert summary['mean_latency'] == pytest.approx(1.05)
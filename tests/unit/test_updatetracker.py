@@ -0,0 +1,49 @@
+"""Unit tests for the updatetracker module."""
+# pylint: disable=missing-function-docstring
+
+import sys
+
+import pandas as pd
+
+import covid19trackerph.datadrop as dl
+import covid19trackerph.drilldown as dd
+import covid19trackerph.engines as eng
+import covid19trackerph.trackerchart as tc
+import covid19trackerph.updatetracker as ut
+
+
+class Engine:  # pylint: disable=too-few-public-methods
+    """Engine without data."""
+
+    def load_data(self, name, data_dir, rebuild=False, pool=None):
+        # pylint: disable=unused-argument
+        return pd.DataFrame()
+
+
+def test_update_charts_resumes_drilldown(tmp_path, monkeypatch):
+    monkeypatch.setattr(dl, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(sys, 'argv', [
+        "updatetracker", "--executor", "serial", "--drilldown",
+        "--drilldown-budget", "1", "--data-dir", str(tmp_path)])
+    args = ut._parse_args()  # pylint: disable=protected-access
+    plotted = []
+    monkeypatch.setattr(eng, 'get_engine', lambda name: Engine())
+    monkeypatch.setattr(tc, 'plot',
+                        lambda *args, **kwargs: plotted.append('charts'))
+    # The budget runs out before the last areas of the data drop.
+    remaining = [3, 0]
+    monkeypatch.setattr(dd, 'generate', lambda *args, **kwargs: (
+        plotted.append('areas') or (1, remaining.pop(0))))
+
+    monkeypatch.setattr(dl, 'download', lambda **kwargs: True)
+    assert ut.update_charts(args, track_downloads=True) == 0
+    assert not dl.is_plotted()
+
+    # The same data drop: the rest of the areas are rendered.
+    monkeypatch.setattr(dl, 'download', lambda **kwargs: False)
+    assert ut.update_charts(args, track_downloads=True) == 0
+    assert dl.is_plotted()
+    assert plotted == ['charts', 'areas'] * 2
+
+    ut.update_charts(args, track_downloads=True)
+    assert plotted == ['charts', 'areas'] * 2
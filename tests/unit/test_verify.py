@@ -0,0 +1,145 @@
+"""Unit tests for the engines and verify modules."""
+# pylint: disable=missing-function-docstring
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import covid19trackerph.engines as eng
+import covid19trackerph.trackerchart as tc
+import covid19trackerph.verify as vf
+from covid19trackerph.benchmarks import synthetic
+
+
+class ShiftedEngine(eng.PandasEngine):
+    """An engine that reports one more death in the summary."""
+
+    name = 'shifted'
+
+    def summary_metrics(self, ci_data, test_data):
+        metrics = super().summary_metrics(ci_data, test_data)
+        metrics['total_death'] += 1
+        return metrics
+
+
+def test_differences():
+    assert list(vf.differences([1.0, np.nan, 3.0], [1.0 + 1e-12, np.nan, 4],
+                               rtol=1e-9)) == [False, False, True]
+    assert list(vf.differences(np.array(['a', None, 'c']),
+                               np.array(['a', np.nan, 'd'], dtype=object))
+                ) == [False, False, True]
+
+
+def test_compare_frames():
+    reference = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+    candidate = pd.DataFrame({'a': [1.0, 2.5, 3.0], 'c': [0, 0, 0]})
+    mismatches = {mismatch['path']: mismatch
+                  for mismatch in vf.compare_frames(reference, candidate)}
+    assert set(mismatches) == {'columns', 'a'}
+    assert mismatches['columns']['count'] == 2
+    assert mismatches['a']['sample'] == [{'position': 1, 'reference': 2.0,
+                                          'candidate': 2.5}]
+    assert vf.compare_frames(reference,
+                             reference.iloc[:2])[0]['path'] == 'rows'
+
+
+def test_compare_frames_index():
+    reference = pd.DataFrame({'a': [1, 2]}, index=[10, 20])
+    candidate = pd.DataFrame({'a': [1, 2]})
+    assert not vf.compare_frames(reference, candidate)
+    assert vf.compare_frames(reference, candidate,
+                             check_index=True)[0]['path'] == 'index'
+
+
+def test_compare_values():
+    reference = {'Active': [{'x': np.array(['a', 'b']),
+                             'y': np.array([1.0, 2.0])}], 'rate': 1.5}
+    assert not vf.compare_values('', reference, reference)
+    candidate = {'Active': [{'x': np.array(['a', 'b']),
+                             'y': np.array([1.0, 2.1])}], 'count': 1}
+    paths = [mismatch['path'] for mismatch in
+             vf.compare_values('', reference, candidate)]
+    assert paths == ['/Active/0/y', '/rate', '/count']
+
+
+def test_vectorized_engine_matches_reference():
+    data = synthetic.case_information(3000, seed=5, days=120)
+    reference = tc.calc_case_info_data(data.copy())
+    candidate = eng.calc_case_info_data_vectorized(data)
+    assert not vf.compare_frames(reference, candidate)
+
+
+def test_get_engine():
+    assert eng.get_engine('vectorized').name == 'vectorized'
+    with pytest.raises(ValueError, match="pandas"):
+        eng.get_engine('unknown')
+
+
+requires_polars = pytest.mark.skipif('polars' not in eng.ENGINES,
+                                     reason="polars is not installed")
+
+
+@requires_polars
+def test_polars_engine_matches_reference():
+    data = synthetic.case_information(3000, seed=5, days=120)
+    reference = tc.calc_case_info_data(data.copy())
+    candidate = eng.get_engine('polars').calc_case_info_data(data)
+    assert not vf.compare_frames(reference, candidate)
+    for group, date in vf.AGGREGATES:
+        assert not vf.compare_frames(
+            tc.agg_count_cumsum_by_date(reference, 'CaseCode', group, date),
+            eng.get_engine('polars').agg_count_cumsum_by_date(
+                reference, 'CaseCode', group, date), check_index=True)
+
+
+@pytest.fixture(name="data_dir", scope="module")
+def fixture_data_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("datadrop")
+    synthetic.write_data_drop(directory, 2000, seed=1, days=120)
+    return directory
+
+
+def test_verify(data_dir, tmp_path):
+    with tc.create_pool('serial') as pool:
+        verification = vf.verify(data_dir, 'vectorized', pool=pool,
+                                 only=['Active', 'TopActiveRegion'])
+    assert verification.passed
+    checks = {check['name']: check for check in verification.checks}
+    assert {'calc_case_info_data', 'summary_metrics', 'figures'} <= set(checks)
+    assert checks['calc_case_info_data']['speedup'] > 0
+    path = tmp_path / "report.json"
+    vf.save_report(verification, path)
+    assert json.loads(path.read_text())['engine'] == 'vectorized'
+
+
+def test_verify_mismatch(data_dir, caplog):
+    with tc.create_pool('serial') as pool:
+        verification = vf.verify(data_dir, ShiftedEngine(), pool=pool,
+                                 only=['ActivePie'])
+    assert not verification.passed
+    failed = [check for check in verification.checks if check['mismatches']]
+    assert [check['name'] for check in failed] == ['summary_metrics']
+    assert failed[0]['mismatches'][0]['path'] == 'summary/total_death'
+    vf.log_report(verification)
+    assert "does not match" in caplog.text
+
+
+@pytest.mark.parametrize("engine", [
+    'vectorized', pytest.param('polars', marks=requires_polars)])
+def test_load_data(data_dir, engine, tmp_path):
+    for path in data_dir.glob("*.csv"):
+        (tmp_path / path.name).symlink_to(path)
+    with tc.create_pool('serial') as pool:
+        for name in tc.DATA_SOURCES:
+            reference = eng.REFERENCE.load_data(name, tmp_path, pool=pool)
+            candidate = eng.get_engine(engine).load_data(name, data_dir,
+                                                         pool=pool)
+            assert not vf.compare_frames(reference, candidate)
+    assert not list(data_dir.glob("*.pkl"))
+
+
+def test_read_files(tmp_path):
+    with pytest.raises(FileNotFoundError, match="Case Information"):
+        eng.read_files(tmp_path, 'ci_data')
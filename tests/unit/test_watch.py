@@ -0,0 +1,172 @@
+"""Unit tests for the watch module."""
+# pylint: disable=missing-function-docstring
+
+import os
+
+import pytest
+
+import covid19trackerph.trackerchart as tc
+import covid19trackerph.watch as wt
+from covid19trackerph.benchmarks import synthetic
+
+
+CASES = "04 Case Information.csv"
+TESTS = "07 Testing Aggregates.csv"
+
+
+@pytest.fixture(name="data_dir")
+def fixture_data_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / CASES).write_text("cases")
+    (data_dir / TESTS).write_text("tests")
+    return data_dir
+
+
+@pytest.fixture(name="charts")
+def fixture_charts(mocker):
+    load_data = mocker.patch.object(wt.trackerchart, 'load_data',
+                                    side_effect=lambda name, *_, **__: name)
+    plot = mocker.patch.object(wt.trackerchart, 'plot',
+                               return_value=['chart'])
+    return load_data, plot
+
+
+def touch(path):
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+
+def loaded(load_data):
+    names = [call.args[0] for call in load_data.call_args_list]
+    load_data.reset_mock()
+    return names
+
+
+def test_cycle_regenerates_changed_data(data_dir, charts):
+    load_data, plot = charts
+    plotted = []
+    watcher = wt.Watcher(str(data_dir.parent), "data", pool=None,
+                         on_plotted=lambda: plotted.append(True),
+                         plot_options={'formats': ['html'], 'rebuild': True})
+    assert watcher.cycle(first=True) == ['chart']
+    assert loaded(load_data) == ['ci_data', 'test_data']
+    assert plot.call_args.kwargs['depends_on'] is None
+    assert plot.call_args.kwargs['rebuild']
+    assert plotted == [True]
+
+    assert watcher.cycle() == []
+    assert not loaded(load_data)
+
+    touch(data_dir / TESTS)
+    watcher.cycle()
+    assert loaded(load_data) == ['test_data']
+    kwargs = plot.call_args.kwargs
+    assert kwargs['depends_on'] == ['test_data']
+    assert kwargs['data'] == {'ci_data': 'ci_data', 'test_data': 'test_data'}
+    assert not kwargs['rebuild']
+
+    # A new file of a data set is a change too.
+    (data_dir / "04 Case Information 2.csv").write_text("more cases")
+    watcher.cycle()
+    assert loaded(load_data) == ['ci_data']
+
+
+def test_first_cycle_when_current(data_dir, charts):
+    load_data, plot = charts
+    watcher = wt.Watcher(str(data_dir.parent), "data", pool=None,
+                         is_current=lambda: True)
+    assert watcher.cycle(first=True) == []
+    assert loaded(load_data) == ['ci_data', 'test_data']
+    plot.assert_not_called()
+
+
+def test_no_affected_charts(data_dir, charts):
+    load_data, plot = charts
+    watcher = wt.Watcher(str(data_dir.parent), "data", pool=None,
+                         plot_options={'only': ['daily_output_*']})
+    watcher.cycle()
+    touch(data_dir / CASES)
+    watcher.cycle()
+    assert loaded(load_data) == ['ci_data', 'test_data', 'ci_data']
+    assert plot.call_count == 1
+
+
+def test_on_prepared(data_dir, charts):
+    prepared = []
+    watcher = wt.Watcher(str(data_dir.parent), "data", pool=None,
+                         on_prepared=prepared.append)
+    watcher.cycle()
+    watcher.cycle()
+    touch(data_dir / TESTS)
+    watcher.cycle()
+    assert prepared == [{'ci_data': 'ci_data', 'test_data': 'test_data'}] * 2
+    assert charts[1].call_count == 2
+
+
+def test_engine(data_dir, charts, mocker):
+    load_data, plot = charts
+    engine = mocker.Mock()
+    engine.load_data.side_effect = lambda name, *_, **__: f"{name}:engine"
+    watcher = wt.Watcher(str(data_dir.parent), "data", pool=None,
+                         engine=engine)
+    watcher.cycle()
+    assert loaded(engine.load_data) == ['ci_data', 'test_data']
+    assert not load_data.called
+    assert plot.call_args.kwargs['data'] == {'ci_data': 'ci_data:engine',
+                                             'test_data': 'test_data:engine'}
+
+
+def test_failed_cycle_is_retried(data_dir, charts):
+    load_data, plot = charts
+    plot.side_effect = [RuntimeError("plot failed"), ['chart']]
+    watcher = wt.Watcher(str(data_dir.parent), "data", pool=None)
+    with pytest.raises(RuntimeError):
+        watcher.cycle()
+    assert watcher.cycle() == ['chart']
+    assert loaded(load_data) == ['ci_data', 'test_data'] * 2
+
+
+def test_download_errors_are_logged(data_dir, charts):
+    def download():
+        raise OSError("offline")
+    watcher = wt.Watcher(str(data_dir.parent), "data", pool=None,
+                         download=download)
+    assert watcher.cycle() == ['chart']
+    assert charts[1].call_count == 1
+
+
+def test_run_stops(data_dir, mocker):
+    watcher = wt.Watcher(str(data_dir.parent), "data", pool=None,
+                         interval=0)
+    mocker.patch.object(watcher, 'cycle', side_effect=lambda first: (
+        watcher.stop()))
+    assert watcher.run() == wt.STOPPED
+    with pytest.raises(KeyboardInterrupt):
+        watcher.stop()
+
+
+def test_run_reloads_on_code_change(data_dir, charts, mocker):
+    watcher = wt.Watcher(str(data_dir.parent), "data", pool=None,
+                         interval=0)
+    mocker.patch.object(wt, 'code_fingerprint', return_value=("changed",))
+    assert watcher.run() == wt.RELOAD
+    assert charts[1].call_count == 1
+
+
+def test_first_rebuild_cycle_removes_stale_charts(tmp_path, monkeypatch):
+    monkeypatch.setattr(tc, 'CHART_OUTPUT', str(tmp_path / "charts"))
+    monkeypatch.setattr(tc, 'TABLE_OUTPUT', str(tmp_path / "tables"))
+    build_chart_graph = tc.build_chart_graph
+    monkeypatch.setattr(tc, 'build_chart_graph', lambda: build_chart_graph(
+        ).select(only=['summary']))
+    synthetic.write_data_drop(tmp_path / "data", 500, seed=8, days=60)
+    (tmp_path / "charts").mkdir()
+    stale = tmp_path / "charts" / "Removed.json"
+    stale.write_text("{}")
+    with tc.create_pool('serial', formats=['json']) as pool:
+        watcher = wt.Watcher(str(tmp_path), "data", pool=pool,
+                             plot_options={'formats': ['json'],
+                                           'rebuild': True})
+        assert watcher.cycle(first=True) == ['summary']
+    assert not stale.exists()